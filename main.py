@@ -1,14 +1,38 @@
 import sys
-import numpy as np
 from src.models.models import GSSEMModel
-from src.utils.plot_utils import plot
+from src.utils.benchmark import run_and_compare
+from src.utils.cache import RunCache
+from src.utils.regression import run_regression
+from src.utils.sweep import load_samples, run_sweep
+
+USAGE = (
+    "Usage: python main.py [show_params|show_docs|run_simulation"
+    "|sweep <grid.json|samples.csv> <out_dir>"
+    "|benchmark <out.json> [baseline.json]|regression [engine ...]]"
+)
+
 
 def main():
     model = GSSEMModel(time=100)
 
-    if len(sys.argv) != 2:
+    if len(sys.argv) == 4 and sys.argv[1] == "sweep":
+        # Run a parameter sweep; rerun the same command to resume it
+        samples = load_samples(sys.argv[2])
+        run_sweep(samples, sys.argv[3], time=model.params.time, cache=RunCache())
+        print("Sweep completed.")
+        sys.exit(0)
+
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == "benchmark":
+        # Fails when a benchmark is slower than the baseline by over 20%
+        sys.exit(0 if run_and_compare(*sys.argv[2:4]) else 1)
+
+    elif len(sys.argv) >= 2 and sys.argv[1] == "regression":
+        # Fails when an engine no longer reproduces the stored results
+        sys.exit(0 if run_regression(sys.argv[2:] or None) else 1)
+
+    elif len(sys.argv) != 2:
         print("Argv != 2")
-        print("Usage: python main.py [show_params|show_docs|run_simulation]")
+        print(USAGE)
         sys.exit(1)
 
     elif sys.argv[1] == "show_params":
@@ -22,21 +46,23 @@ def main():
         sys.exit(0)
 
     elif sys.argv[1] == "run_simulation":
+        # Imported here so the other commands do not pay for matplotlib
+        from src.utils.plot_utils import plot
+
         # Run simulation
-        x, y = model.run_simulation()
+        # Reruns with unchanged parameters and code come from the run cache
+        result = model.run_simulation(cache=RunCache())
         print("Simulation completed.")
-        x = np.array(x)
-        y = np.array(y)
-        print("x: ", x)
-        print(x.shape)
-        print("y: ", y)
-        print(y.shape)
-        plot(x, y)
+        print("x: ", result.flows)
+        print(result.flows.shape)
+        print("y: ", result.states)
+        print(result.states.shape)
+        plot(result)
         sys.exit(0)
         
     else:
         print("Invalid command.")
-        print("Usage: python main.py [show_params|show_docs|run_simulation]")
+        print(USAGE)
         sys.exit(1)
 
 
@@ -0,0 +1,75 @@
+import numpy as np
+from src.models.parameters import NOISE_NAMES
+from src.models.trajectory import FLOW_INDEX
+
+
+class Checkpoint:
+    """
+    Snapshot of a run at one time index, to resume or branch from it.
+
+    Holds everything the time loop carries from one step to the next:
+    - index: Time index of the snapshot; the resumed run computes index + 1.
+    - state: The 49 state values at `index` (`STATE_NAMES` order), shape (49,)
+      for a single run or (49, N) for an ensemble; `state_names` order with
+      more than two household classes.
+    - EEIRP: Energy flow carried over while the ERP pool is exhausted.
+    - noise: The Ito noise draws (`NOISE_NAMES` order) from `index` to the end
+      of the spin-up horizon, shape (2, remaining steps, K[, N]) for K
+      household classes. The draws are made up front, so this is the
+      position in the noise stream: a resumed run sees exactly the values
+      the uninterrupted run would have seen.
+    Parameters are not stored, so a branch may resume with different ones.
+    """
+
+    def __init__(self, index: int, state, EEIRP, noise):
+        self.index = int(index)
+        self.state = np.asarray(state, dtype=float)
+        self.EEIRP = np.asarray(EEIRP, dtype=float)
+        self.noise = np.asarray(noise, dtype=float)
+
+    @classmethod
+    def from_step(cls, record, params):
+        """
+        Snapshot the state reached by a `Step` record of `steps()`.
+
+        Parameters:
+        - record (Step): Record yielded by `GSSEMModel.steps()` or
+          `GSSEMEnsemble.steps()`.
+        - params (Parameters): Parameters of the run that yielded it.
+        """
+        # Ensemble records may hold scalars shared by every member
+        state = np.array(np.broadcast_arrays(*record.state), dtype=float)
+        noise = [getattr(params, name)[record.index:] for name in NOISE_NAMES]
+        return cls(record.index, state, record.flows[FLOW_INDEX["EEIRP"]], noise)
+
+    def apply_noise(self, params):
+        """
+        Continue the noise stream of the snapshot in `params`.
+
+        The draws of `params` are replaced by spliced copies, so the arrays
+        (or streamed `NoiseSeries`) passed as overrides are left unchanged
+        and can be reused by other runs.
+        """
+        steps = min(self.noise.shape[1], params.time - self.index)
+        for name, draws in zip(NOISE_NAMES, self.noise):
+            current = getattr(params, name)
+            if getattr(current, "streamed", False):
+                spliced = current.splice(self.index, draws[:steps])
+            else:
+                spliced = np.array(current, dtype=float)
+                spliced[self.index:self.index + steps] = draws[:steps]
+            # The noise is set like the draws made on first use (see
+            # `Parameters.__getattr__`); every other value stays read-only
+            object.__setattr__(params, name, spliced)
+
+    def save(self, path: str):
+        """Write the snapshot to a binary `.npz` file."""
+        np.savez(
+            path, index=self.index, state=self.state, EEIRP=self.EEIRP, noise=self.noise
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        """Read a snapshot written by `save`."""
+        with np.load(path) as data:
+            return cls(data["index"], data["state"], data["EEIRP"], data["noise"])
@@ -0,0 +1,705 @@
+from math import sqrt
+import os
+import numpy as np
+from src.models.graph import compile_graph
+from src.models.models import class_total, class_weights, household_demands
+from src.models.parameters import NOISE_NAMES, Parameters, by_class, value_ndim
+from src.models.trajectory import (
+    STATE_INDEX, Step, Trajectory, class_rows, flow_index, state_index,
+)
+from src.utils.statistics import SUMMARY_NAMES, EnsembleStatistics
+
+
+class GSSEMEnsemble:
+    """
+    Vectorized GSSEM engine that advances N parameter sets in lockstep.
+
+    Every state variable is a NumPy array of shape (N,) and each time step is
+    computed for all members at once. The `if/else` flow-balancing branches of
+    `GSSEMModel.run_simulation` are expressed as masked array operations, so
+    member k of the ensemble follows the same path as a scalar run with the
+    same parameters.
+    """
+
+    def __init__(self, time: int = 100, n: int = None, overrides: dict = None,
+                 forcing=None):
+        """
+        Parameters:
+        - time (int): Simulation time period.
+        - n (int): Number of members. Inferred from the array overrides when
+          omitted.
+        - overrides (dict): Parameter values replacing the defaults. Scalars
+          apply to every member, arrays of shape (N,) give one value per
+          member (see `Parameters`). Noise draws of shape (time, K, N) give
+          each member its own realization (see `montecarlo`).
+        - forcing (Forcing): Optional exogenous series added at every step,
+          the same for every member (see `src/models/forcing.py`).
+        """
+        overrides = {
+            name: np.asarray(value, dtype=float)
+            if np.ndim(value) and not getattr(value, "streamed", False)
+            else value
+            for name, value in (overrides or {}).items()
+        }
+        n = self._member_count(overrides, n)
+
+        self.n = n
+        self.params = Parameters(time, overrides)
+        self._overrides = overrides
+        self.forcing = forcing
+        self.members = np.arange(n)
+
+    @staticmethod
+    def _member_count(overrides, n=None):
+        """Number of members: `n`, or the length of the per-member overrides."""
+        # Member arrays have shape (N,); class values (K, N), noise draws
+        # (time, K, N)
+        sizes = {
+            np.shape(value)[-1]
+            for name, value in overrides.items()
+            if np.ndim(value) == value_ndim(name) + 1
+        }
+        if n is None:
+            n = sizes.pop() if len(sizes) == 1 else 1
+        if sizes - {n}:
+            raise ValueError(f"Override arrays must all have length n={n}")
+        return n
+
+    def initial_state(self):
+        """Initial values of the state rows, each broadcast to shape (N,)."""
+        return np.array(
+            [
+                np.broadcast_to(value, (self.n,))
+                for value in self.params.initial_state()
+            ],
+            dtype=float,
+        )
+
+    def run_simulation(self, dtype=np.float64, start=None, out_dir=None, stop=None):
+        """
+        Run all members over the time period.
+
+        Consumes `steps()` and writes each step into one preallocated
+        `Trajectory` (also kept as `self.trajectory`): in memory by default,
+        or memory-mapped files written as the run goes when `out_dir` is
+        given, so ensembles larger than RAM can be run.
+
+        Parameters:
+        - dtype: Storage precision, np.float64 (default) or np.float32. The
+          computation itself always runs in double precision.
+        - start (Checkpoint): Resume from a snapshot (see `steps`). Steps
+          before the snapshot are left as NaN.
+        - out_dir (str): Directory for `x_results.npy` (N, time, 77) and
+          `y_results.npy` (N, 49, time); None keeps the results in memory.
+        - stop (StopCriteria): Retire members early (see `steps`); the steps
+          after a member's `stop_time` are left as NaN.
+
+        Returns:
+        - Trajectory: Flows (N, time, 77) and states (N, 49, time), in the
+          scalar x/y layouts and accessible by name.
+        """
+        classes = self.params.classes
+        if out_dir is None:
+            self.trajectory = Trajectory.allocate(
+                self.params.time, (self.n,), dtype, classes
+            )
+        else:
+            os.makedirs(out_dir, exist_ok=True)
+            self.trajectory = Trajectory.create(
+                os.path.join(out_dir, "x_results.npy"),
+                os.path.join(out_dir, "y_results.npy"),
+                self.params.time,
+                (self.n,),
+                dtype,
+                classes,
+            )
+        x = self.trajectory.flows
+        y = self.trajectory.states
+        if start is None:
+            y[:, :, 0] = self.initial_state().T
+        else:
+            x[:, :start.index] = np.nan
+            y[:, :, :start.index] = np.nan
+            y[:, :, start.index] = self._broadcast(start.state).T
+
+        n = self.n
+        for record in self.steps(start, stop):
+            # Only the members still running are in the record
+            rows = slice(None) if self.n == n else self.members
+            for k, value in enumerate(record.flows):
+                x[rows, record.step, k] = value
+            for k, value in enumerate(record.state):
+                y[rows, k, record.index] = value
+            y[rows, STATE_INDEX["ERP"], record.index - 1] = record.ERP
+        for k in np.flatnonzero(self.stop_reason != ""):
+            x[k, self.stop_time[k]:] = np.nan
+            y[k, :, self.stop_time[k] + 1:] = np.nan
+
+        self.trajectory.flush()
+        return self.trajectory
+
+    def run_statistics(self, names=SUMMARY_NAMES, statistics=None, start=None,
+                       stop=None):
+        """
+        Run all members, keeping per-step statistics instead of trajectories.
+
+        Each step feeds the members' values of `names` into streaming
+        accumulators, so memory is O(time) per variable whatever N is.
+
+        Parameters:
+        - names (tuple): Flows and states to summarize.
+        - statistics (EnsembleStatistics): Accumulators to add to, e.g. to
+          collect several batches; a new one is created when omitted.
+        - start (Checkpoint): Resume from a snapshot (see `steps`).
+        - stop (StopCriteria): Retire members early (see `steps`); the steps
+          after a member stopped only summarize the members still running.
+
+        Returns:
+        - EnsembleStatistics: Mean, variance and quantile sketch per step.
+          Flows are indexed by step and states by time index, as in x and y.
+        """
+        if statistics is None:
+            statistics = EnsembleStatistics(self.params.time, names)
+        flows = [name for name in names if name in flow_index(self.params.classes)]
+        states = [name for name in names if name not in flows]
+
+        def feed(names, t, values, n):
+            for name, value in zip(names, values):
+                statistics.update(name, t, np.broadcast_to(value, (n,)))
+
+        # States are fed one index late: a step may still zero the ERP level
+        # of the previous index when the pool runs out
+        if start is None:
+            pending, pending_index = self.initial_state(), 0
+        else:
+            pending, pending_index = self._broadcast(start.state), start.index
+        pending = [pending[state_index(self.params.classes)[name]] for name in states]
+        pending_members = self.members
+        for record in self.steps(start, stop):
+            feed(flows, record.step, [record[name] for name in flows], self.n)
+            if record.index > pending_index:
+                # Members retired after the pending state keep it as is
+                kept = np.isin(pending_members, self.members)
+                if not kept.all():
+                    pending = [np.broadcast_to(value, kept.shape) for value in pending]
+                    feed(states, pending_index, [value[~kept] for value in pending],
+                         np.count_nonzero(~kept))
+                    pending = [value[kept] for value in pending]
+                if "ERP" in states:
+                    pending[states.index("ERP")] = record.ERP
+                feed(states, pending_index, pending, self.n)
+            pending = [record[name] for name in states]
+            pending_index = record.index
+            pending_members = self.members
+        feed(states, pending_index, pending, len(pending_members))
+        return statistics
+
+    def steps(self, start=None, stop=None):
+        """
+        Advance all members one step at a time.
+
+        A generator yielding a `Step` record per time step whose values are
+        arrays of shape (N,) (or scalars shared by all members). Nothing is
+        retained between steps, so memory use is constant unless the caller
+        keeps the records.
+
+        Parameters:
+        - start (Checkpoint): Resume from a snapshot instead of the initial
+          state. A single-run snapshot (state shape (49,)) is shared by every
+          member, so N policy variants can branch from one spin-up.
+        - stop (StopCriteria): Retire each member at the first state that
+          meets one of the criteria. Its reason and time index are kept in
+          `self.stop_reason` ("" for members that reach the horizon) and
+          `self.stop_time` (time - 1 for those), arrays of shape (N,). The
+          following records hold only the members still running, whose
+          indices are `self.members` while the record is current.
+        """
+        time = self.params.time
+        full, n = self.params, self.n
+        self.members = np.arange(n)
+        self.stop_reason = np.full(n, "", dtype=object)
+        self.stop_time = np.full(n, time - 1)
+        initial = self.initial_state()
+
+        # Weighting factors for total population variables, (K, N)
+        self._alfa = class_weights(initial[class_rows("numHH", full.classes)])
+
+        if start is None:
+            first = 0
+            state = initial
+            # Energy flows keep their last value while ERP is exhausted
+            self._ERPEE = np.zeros(self.n)
+            self._EEIRP = np.zeros(self.n)
+        else:
+            if not 0 <= start.index < time - 1:
+                raise ValueError(
+                    f"Checkpoint at index {start.index} is outside the horizon "
+                    f"of {time} steps"
+                )
+            first = start.index
+            state = self._broadcast(start.state)
+            self._ERPEE = np.broadcast_to(start.EEIRP, (self.n,)).copy()
+            self._EEIRP = self._ERPEE.copy()
+            start.apply_noise(self.params)
+        if stop is not None:
+            stop.reset(state)
+
+        try:
+            for step in range(first, time):
+                # The last record repeats the step into the final time index
+                i = min(step, time - 2)
+                with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                    flows, next_state = self._step(i, state)
+                done = np.zeros(self.n, dtype=bool)
+                if stop is not None and step < time - 1:
+                    reasons = stop.check(next_state)
+                    done = reasons != ""
+                    self.stop_reason[self.members[done]] = reasons[done]
+                    self.stop_time[self.members[done]] = i + 1
+                yield Step(step, i + 1, flows, next_state, state[STATE_INDEX["ERP"]])
+                if done.all():
+                    return
+                if step < time - 2:
+                    state = np.array(
+                        [np.broadcast_to(value, (self.n,)) for value in next_state]
+                    )
+                if done.any():
+                    state = state[:, ~done]
+                    stop.retain(~done)
+                    self._retire(full, ~done)
+        finally:
+            self.params, self.n, self.members = full, n, np.arange(n)
+
+    def step_map(self, i, state, EEIRP=0.0, rounding=np.ceil):
+        """
+        Apply the one-step map of the model to arbitrary states.
+
+        Computes step i from each column of `state` without advancing any
+        run, e.g. to evaluate a batch of perturbed states at once (see
+        `equilibrium.fixed_point`).
+
+        Parameters:
+        - i (int): Time index of the step (sets the demographic trends and the
+          noise draw used).
+        - state (ndarray): The 49 state rows, shape (49, M). With one member
+          (n = 1) the columns are any M states of its parameter set;
+          otherwise M = n and column k belongs to member k.
+        - EEIRP: Energy flow carried over in case the ERP pool is exhausted.
+        - rounding: Applied to household births and deaths; the model rounds
+          them up to whole households (np.ceil), and passing e.g. np.positive
+          gives its continuous relaxation.
+
+        Returns:
+        - flows (ndarray): The 77 flows of the step, shape (77, M).
+        - state (ndarray): The 49 state rows at i + 1, shape (49, M).
+        """
+        state = np.array(state, dtype=float)
+        columns = state.shape[1]
+        initial = self.initial_state()
+        self._alfa = class_weights(initial[class_rows("numHH", self.params.classes)])
+        self._ERPEE = np.broadcast_to(EEIRP, (columns,)).astype(float)
+        self._EEIRP = self._ERPEE.copy()
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            flows, next_state = self._step(i, state, rounding)
+        result = []
+        for rows in (flows, next_state):
+            matrix = np.empty((len(rows), columns))
+            for k, value in enumerate(rows):
+                matrix[k] = value
+            result.append(matrix)
+        return tuple(result)
+
+    def _retire(self, full, keep):
+        """
+        Continue with the members where `keep` is True.
+
+        The parameters of the remaining members are rebuilt from the original
+        overrides and the noise drawn for the full ensemble `full`, so each
+        member computes exactly what it would have computed alongside the
+        others.
+        """
+        self.members = self.members[keep]
+        overrides = {
+            name: value[..., self.members]
+            if np.ndim(value) == value_ndim(name) + 1
+            else value
+            for name, value in self._overrides.items()
+        }
+        for name in NOISE_NAMES:
+            draws = getattr(full, name)
+            overrides[name] = draws[..., self.members] if draws.ndim == 3 else draws
+        self.params = Parameters(full.time, overrides)
+        self.n = len(self.members)
+        for name in ("_alfa", "_ERPEE", "_EEIRP"):
+            setattr(self, name, getattr(self, name)[..., keep])
+
+    def _broadcast(self, state):
+        """Broadcast checkpointed state rows, (49,) or (49, N), to (49, N)."""
+        return np.array(np.broadcast_to(state.T, (self.n, len(state))).T, dtype=float)
+
+    def _atmosphere(self, CO2eq, increase):
+        """CO2eq at i + 1, from the increase (ppm) of each member's emissions."""
+        return CO2eq + increase
+
+    def _step(self, i, state, rounding=np.ceil):
+        """
+        Compute the flows of step i and the state at i + 1 for all members.
+
+        `state` holds the current value of every y row, shape (49, N). An
+        exhausted ERP pool is zeroed in place, as in the scalar engine.
+        `rounding` turns births and deaths into whole households. Household
+        class values are arrays of shape (K, N), one row per class.
+
+        Only the ecosystem passes come from the model graph; the economy,
+        demographics and GHG sections are written out here as in
+        `GSSEMModel.steps` and `jit._run`, and change with them.
+        """
+        p = self.params
+        graph = compile_graph(p, batched=True)
+        (P1, P2, P3, H1, H2, H3, C1, C2, HH, ISmass, RP, IRP, numHH, percapmass,
+         P1H1massdeficit, P1ISmassdeficit, P1HHmassdeficit, H1massdeficit,
+         ISmassdeficit) = state[:19]
+        ERP, EE, CO2eq, temp = state[23:27]
+        numHH_k = state[class_rows("numHH", p.classes)]
+        HH_k = state[class_rows("HH", p.classes)]
+        percapmass_k = HH_k / numHH_k
+        P1massdeficit = P1H1massdeficit + P1ISmassdeficit + P1HHmassdeficit
+
+        alfa = self._alfa
+
+        # Demographic params due current trends (2014)
+        mHH_k = by_class(p.mHH_trend[i]) + p.sigmam * by_class(p.epsilonm[i]) * sqrt(1)
+        etaa_k = by_class(p.etaa_trend[i])
+        forced = None if self.forcing is None else self.forcing.at(i)
+        if forced is not None:
+            mHH_k = mHH_k + forced.mHH
+            etaa_k = etaa_k + forced.etaa
+        aa = mHH_k[0]
+        bb = mHH_k[1]
+        mHH = class_total(mHH_k, alfa)
+        cc = mHH
+        etab = p.etab
+
+        # RPP1 RPP2 RPP3 MATERIAL FLOW as a function of temperature
+        thermal = np.exp(-((temp - p.tempo) ** 2) / 100)
+        gRPP1 = p.gRPP1p * thermal
+        gRPP2 = p.gRPP2p * thermal
+        gRPP3 = p.gRPP3p * thermal
+
+        # Humans
+        mHH = -(mHH * thermal) + (2.0 * mHH)
+
+        dd = mHH_k[0]
+        ee = mHH_k[1]
+        ff = mHH
+
+        # -----TEMPERATURE CALCULATION-----
+        atemp_next = 0.010008 * CO2eq - 3.21675
+        temp_next = p.tempo + atemp_next
+        if forced is not None:
+            temp_next = temp_next + forced.temp
+
+        # I. Economic calculations
+        W_k = np.maximum(
+            by_class(p.aw_k)
+            + by_class(p.cw_k)
+            * (p.ISbar - (ISmassdeficit + ISmass))
+            / (p.theta + p.lambda_)
+            - by_class(p.dw_k) * numHH,
+            0,
+        )
+        W = class_total(W_k, alfa)
+
+        # Economic Mobility Factor, bounded by the poorest and the richest class
+        EMF = p.psi * ((p.Wgid - W * numHH) / p.Wgid)
+        EMF = np.where(EMF * numHH > numHH_k[0], numHH_k[0] / numHH, EMF)
+        EMF = np.where(EMF * numHH < (-numHH_k[-1]), numHH_k[-1] / numHH, EMF)
+
+        # Pricing and Production calculations
+        P1stock = (P1massdeficit + P1) - p.P1bar
+        pP1 = np.where(
+            P1 == 0, 0, np.maximum(p.aP1 + p.bP1 * W - p.cP1 * P1stock, 0)
+        )
+        P1production = np.where(
+            P1 == 0, 0, np.maximum(p.aP1p - p.bP1p * W - p.cP1p * P1stock, 0)
+        )
+
+        H1stock = (H1massdeficit + H1) - p.H1bar
+        pH1 = np.where(
+            H1 == 0, 0, np.maximum(p.aH1 + p.bH1 * W - p.cH1 * H1stock, 0)
+        )
+        H1production = np.where(
+            H1 == 0, 0, np.maximum(p.aH1p - p.bH1p * W - p.cH1p * H1stock, 0)
+        )
+
+        noHH = (HH == 0) | (numHH < 20)
+        ISstock = p.ISbar - (ISmassdeficit + ISmass)
+        pIS = np.where(
+            noHH,
+            0,
+            np.maximum(p.aIS + p.bIS * W + p.cIS * ISstock / (p.theta + p.lambda_), 0),
+        )
+        ISproduction = np.where(
+            noHH,
+            0,
+            np.maximum(
+                p.aISp - p.bISp * W + p.cISp * ISstock / (p.theta + p.lambda_), 0
+            ),
+        )
+        pEE = np.where(noHH, 0, np.maximum(p.aEE + p.bEE * W + (p.cEE / ERP), 0))
+
+        # II. Demanda
+        noH1trade = (H1 == 0) | noHH
+        P1H1demand = np.where(
+            noH1trade,
+            0,
+            np.maximum(p.dP1H1 - p.eP1H1 * W - p.fP1H1 * pP1 - p.gP1H1 * H1stock, 0),
+        )
+        P2H1 = np.where(noH1trade, 0, p.khat)
+
+        # Demand calculations for P1HH, H1HH, ISHH and EEHH
+        P1HHdemand, H1HHdemand, ISHHdemand, EEHHdemand = (
+            np.where(noHH, 0, np.maximum(demand, 0) * 50)
+            for demand in household_demands(p, pP1, pH1, pIS, pEE)
+        )
+
+        # Demand scaling, one row per class
+        P1HHdemand_k = P1HHdemand * by_class(p.f2pc)
+        H1HHdemand_k = H1HHdemand * by_class(p.f2pc)
+        ISHHdemand_k = ISHHdemand * by_class(p.f2pd)
+        EEHHdemand_k = EEHHdemand * by_class(p.f2pd)
+
+        P1HHdemand = class_total(P1HHdemand_k, alfa)
+        H1HHdemand = class_total(H1HHdemand_k, alfa)
+        ISHHdemand = class_total(ISHHdemand_k, alfa)
+        EEHHdemand = class_total(EEHHdemand_k, alfa)
+
+        # Energy demands
+        EEHHtotdemand = EEHHdemand * numHH
+        EEISdemand = ISproduction * p.gammaEEIS
+
+        # Labor flows for P1H2 and H1C2
+        P1H2 = np.where(
+            (P1 == 0) | (H2 == 0),
+            0,
+            np.maximum(gRPP1 * P1 * RP - p.mP1 * P1 - P1production, 0),
+        )
+        H1C1 = np.where(
+            (H1 == 0) | (C1 == 0),
+            0,
+            np.maximum(P1H1demand + P2H1 - p.mH1 * H1 - H1production, 0),
+        )
+
+        # If there are no humans, consumption of P1H2 and H1C1 is natural (Lokta-Volterra)
+        P1H2 = np.where(noHH, p.gP1H2 * P1 * H2, P1H2)
+        H1C1 = np.where(noHH, p.gH1C1 * H1 * C1, H1C1)
+
+        P1ISdemand = p.theta * ISproduction
+        RPISdemand = p.lambda_ * ISproduction
+
+        # III. Calculate all but next state, according to system equations.
+
+        # Ecosystem flows, balanced against their compartments; the arguments
+        # follow graph.BALANCE_INPUTS
+        (P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+         H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+         RPP1, RPP2, RPP3, IRPP2, IRPP3) = graph.balance(
+            P1, P2, P3, H1, H2, H3, C1, C2, HH, RP, IRP, numHH, percapmass,
+            gRPP1, gRPP2, gRPP3, P1H1demand, P1ISdemand, P1HHdemand,
+            H1HHdemand, P1H2, P2H1, H1C1, P1massdeficit, P1H1massdeficit,
+            P1HHmassdeficit, P1ISmassdeficit, H1massdeficit, rounding,
+        )
+
+        # RP
+        IRPRP = np.maximum(IRP * p.mIRPRP, 0)
+        RPIS = np.minimum(p.lambda_ * P1IS / p.theta, RPISdemand)
+        stockRP = (
+            RP + P1RP + P2RP + P3RP + H1RP + H2RP + H3RP + C1RP + C2RP + HHRP + IRPRP
+        )
+        stockRP = np.where(stockRP < 0, 0, stockRP)
+        RPshort = (stockRP - (RPP1 + RPP2 + RPP3) - p.RPIRP - RPIS <= 0) & (
+            p.RPIRP == 0
+        )
+        RPdemand = RPP1 + RPP2 + RPP3 + RPISdemand
+        RPP1 = np.where(RPshort, RPP1 * stockRP / RPdemand, RPP1)
+        RPP2 = np.where(RPshort, RPP2 * stockRP / RPdemand, RPP2)
+        RPP3 = np.where(RPshort, RPP3 * stockRP / RPdemand, RPP3)
+        RPIS = np.where(
+            RPshort & (RPIS != 0), stockRP - (RPP1 + RPP2 + RPP3), np.where(RPshort, 0, RPIS)
+        )
+        P1IS = np.minimum(p.theta * RPIS / p.lambda_, P1IS)
+
+        # ERP
+        hasERP = ERP > 0
+        EEproduction = EEHHtotdemand + EEISdemand
+        EEHHmass = EEHHtotdemand * p.gammaEEIRP
+        ERPEE = EEproduction * p.gammaEEIRP
+        depleted = hasERP & (ERP - ERPEE < 0)
+        ERPEE = np.where(depleted, ERP, ERPEE)
+        ERP = np.where(depleted, 0, ERP)
+        state[STATE_INDEX["ERP"]] = ERP
+        self._ERPEE = ERPEE = np.where(hasERP, ERPEE, self._ERPEE)
+        self._EEIRP = EEIRP = np.where(hasERP, ERPEE, self._EEIRP)
+        pEE = np.where(hasERP, pEE, 0)
+        EEproduction = np.where(hasERP, EEproduction, 0)
+        EEHHmass = np.where(hasERP, EEHHmass, 0)
+        EEHHtotdemand = np.where(hasERP, EEHHtotdemand, 0)
+        EEISdemand = np.where(hasERP, EEISdemand, 0)
+        EEHHdemand = np.where(hasERP, EEHHdemand, 0)
+
+        # III.A. make checks again, to balance flows, and update the compartments
+        # (arguments in graph.REBALANCE_INPUTS order)
+        (
+            (P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+             H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+             RPP1, RPP2, RPP3, IRPP2, IRPP3),
+            (P1_next, IP1_next, DP1_next, P2_next, IP2_next, DP2_next, P3_next,
+             IP3_next, DP3_next, H1_next, IH1_next, DH1_next, H2_next, IH2_next,
+             DH2_next, H3_next, IH3_next, DH3_next, C1_next, IC1_next, DC1_next,
+             C2_next, IC2_next, DC2_next, HH_next),
+        ) = graph.rebalance(
+            P1, P2, P3, H1, H2, H3, C1, C2, HH, IRP, numHH, percapmass, P1RP,
+            P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3, H1RP,
+            H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, RPP1, RPP2,
+            RPP3, IRPP2, IRPP3, P1massdeficit, P1H1massdeficit,
+            P1HHmassdeficit, P1ISmassdeficit, H1massdeficit, rounding,
+        )
+
+        # IV. Demographic
+        ISHHflow = np.maximum((p.theta + p.lambda_) * ISHHdemand * numHH, 0)
+        ISIRP = ISHHflow
+        ISavail = ISmass + P1IS + RPIS - ISIRP
+        ISIRP = np.where(
+            ISavail <= 0,
+            ISmass + P1IS + RPIS,
+            np.where(
+                (ISmassdeficit < 0) & (numHH >= 2),
+                ISIRP + np.minimum(ISavail, -ISmassdeficit),
+                ISIRP,
+            ),
+        )
+
+        nobirths = ((P1HH + H1HH + ISIRP) == 0) | (
+            (pP1 * P1HH + pH1 * H1HH + pIS * ISIRP) == 0
+        )
+        weightedprice = np.where(
+            nobirths,
+            0,
+            (pP1 * P1HH + pH1 * H1HH + pIS * ISIRP + pEE * EEHHmass)
+            / (P1HH + H1HH + ISIRP + EEHHmass),
+        )
+        percapbirths_k = np.where(
+            nobirths,
+            0,
+            np.maximum(
+                etaa_k
+                - etab * np.sqrt(W / weightedprice)
+                + p.sigmab * by_class(p.epsilonb[i]) * sqrt(1),
+                0,
+            ),
+        )  # 2P-a
+        percapbirths = np.where(nobirths, 0, class_total(percapbirths_k, alfa))
+
+        # -----Next Step-----
+        # The compartments and HH were updated by graph.rebalance
+        noP1 = P1 == 0
+        P1H1demand = np.where(noP1, 0, P1H1demand)
+        P1ISdemand = np.where(noP1, 0, P1ISdemand)
+        P1HHdemand = np.where(noP1, 0, P1HHdemand)
+        P1HHdemand_k = np.where(noP1, 0, P1HHdemand_k)
+
+        P1H1massdeficit_next = P1H1massdeficit + P1H1 - P1H1demand
+        P1ISmassdeficit_next = P1ISmassdeficit + P1IS - P1ISdemand
+        P1HHmassdeficit_next = P1HHmassdeficit + P1HH - P1HHdemand * numHH
+
+        noH1 = H1 == 0
+        H1HHdemand = np.where(noH1, 0, H1HHdemand)
+        H1HHdemand_k = np.where(noH1, 0, H1HHdemand_k)
+
+        H1massdeficit_next = H1massdeficit + H1HH - H1HHdemand * numHH
+
+        HH_k_next = HH_next * by_class(p.f2pe)  # 2P-e
+
+        ISmass_next = ISmass + P1IS + RPIS - ISIRP
+        ISmassdeficit_next = ISmassdeficit + ISIRP - ISHHflow
+
+        IRP_next = IRP - IRPP2 - IRPP3 + p.RPIRP + ISIRP - IRPRP + EEIRP
+        IIRP_next = p.RPIRP + ISIRP + EEIRP
+        DIRP_next = IRPP2 + IRPP3 + IRPRP
+
+        RP_next = stockRP - (RPP1 + RPP2 + RPP3) - p.RPIRP - RPIS
+        INRP_next = stockRP
+        DRP_next = RPP1 + RPP2 + RPP3 + p.RPIRP + RPIS
+
+        ERP_next = ERP - EEIRP  # En
+        if forced is not None:
+            ERP_next = ERP_next + forced.ERP
+        EE_next = EE + ERPEE - EEIRP  # En
+
+        # Healthcare factors, phi - phi_k (zero for the poorest class)
+        phi_gap = p.phi - by_class(p.phi_k)
+        numHH_k_next = np.maximum(
+            numHH_k
+            + rounding(percapbirths_k * numHH_k)
+            - rounding(mHH_k * numHH_k)
+            - rounding(
+                numHH_k * phi_gap * (percapmass_k - p.idealpercapmass) ** 2
+            ),
+            1,
+        )
+        numHH_next = np.maximum(
+            numHH
+            + rounding(percapbirths * numHH)
+            - rounding(mHH * numHH)
+            - rounding(
+                numHH * phi_gap[0] * (percapmass - p.idealpercapmass) ** 2
+            ),
+            1,
+        )
+
+        percapmass_k_next = HH_k_next / numHH_k_next  # 2P-a
+        percapmass_next = class_total(percapmass_k_next, alfa)
+
+        yGHG = [
+            P1, H1, numHH, P1production, H1production, ISproduction,
+            EEproduction, P2, P3, RP,
+        ]
+        emissions = 0
+        for value, factor in zip(yGHG, p.GtCO2eq):
+            emissions = emissions + value * factor
+        CO2eq_next = self._atmosphere(CO2eq, emissions * p.ppmCO2eq)  # In ppm
+        if forced is not None:
+            CO2eq_next = CO2eq_next + forced.emissions * p.ppmCO2eq
+
+        flows = [
+            P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+            H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+            ISIRP, RPP1, RPP2, RPP3, RPIS, IRPP2, IRPP3, IRPRP, P1HHdemand,
+            H1HHdemand, ISHHdemand, P1ISdemand, RPISdemand, P1production,
+            H1production, ISproduction, pP1, pH1, pIS, percapbirths,
+            weightedprice, W, W_k[0], W_k[1], P1HHdemand_k[0], P1HHdemand_k[1],
+            H1HHdemand_k[0], H1HHdemand_k[1], ISHHdemand_k[0], ISHHdemand_k[1],
+            EEHHdemand_k[0], EEHHdemand_k[1], pEE, EEHHdemand, EEHHtotdemand,
+            EEISdemand, EEproduction, EEHHmass, EEIRP, percapbirths_k[0],
+            percapbirths_k[1], mHH_k[0], mHH_k[1], EMF, np.round(EMF * numHH),
+            gRPP1, gRPP2, gRPP3, mHH, aa, bb, cc, dd, ee, ff,
+            # Classes 3 .. K (see `flow_names`)
+            *W_k[2:], *P1HHdemand_k[2:], *H1HHdemand_k[2:], *ISHHdemand_k[2:],
+            *EEHHdemand_k[2:], *percapbirths_k[2:], *mHH_k[2:],
+        ]
+        state = [
+            P1_next, P2_next, P3_next, H1_next, H2_next, H3_next, C1_next,
+            C2_next, HH_next, ISmass_next, RP_next, IRP_next, numHH_next,
+            percapmass_next, P1H1massdeficit_next, P1ISmassdeficit_next,
+            P1HHmassdeficit_next, H1massdeficit_next, ISmassdeficit_next,
+            numHH_k_next[0], numHH_k_next[1], HH_k_next[0], HH_k_next[1],
+            ERP_next, EE_next, CO2eq_next, temp_next, IP1_next, DP1_next,
+            IP2_next, DP2_next, IP3_next, DP3_next, IH1_next, DH1_next,
+            IH2_next, DH2_next, IH3_next, DH3_next, IC1_next, DC1_next,
+            IC2_next, DC2_next, IH3_next, DH3_next, IIRP_next, DIRP_next,
+            INRP_next, DRP_next,
+            # Classes 3 .. K (see `state_names`)
+            *numHH_k_next[2:], *HH_k_next[2:],
+        ]
+        return flows, state
+
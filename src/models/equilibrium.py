@@ -0,0 +1,358 @@
+from typing import NamedTuple
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.trajectory import (
+    STATE_NAMES, flow_classes, flow_index, state_index, state_names,
+)
+
+# State rows that drive the next step (the others only record flows), to
+# which the rows of household classes 3 .. K are added (see `dynamic_names`)
+DYNAMIC_NAMES = STATE_NAMES[:27]
+
+# Slow pools held at their starting values by default: the exhaustible energy
+# resource, the energy stock and the accumulated atmosphere (temp follows CO2eq)
+FROZEN = ("ERP", "EE", "CO2eq", "temp")
+
+# Stocks and populations, kept non-negative while solving
+NONNEGATIVE = (
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "ISmass", "RP", "IRP",
+    "numHH", "percapmass", "numHH1", "numHH2", "HH1", "HH2",
+)
+
+# Eigenvalues this close to the unit circle count as neutral
+NEUTRAL_TOLERANCE = 1e-6
+
+# A stock or population alive at the start has collapsed once it is within
+# this fraction of its starting value of its floor (one household, zero mass)
+COLLAPSE_FRACTION = 1e-6
+
+# A solve has diverged once its residual grows this many times the starting one
+DIVERGENCE = 1e6
+
+# Variables producing GHG, in the order of `Parameters.yGHGstb`
+GHG_NAMES = (
+    "P1", "H1", "numHH", "P1production", "H1production", "ISproduction",
+    "EEproduction", "P2", "P3", "RP",
+)
+
+
+def dynamic_names(classes: int = 2):
+    """State rows that drive the next step of a run with `classes` household classes."""
+    return DYNAMIC_NAMES + state_names(classes)[len(STATE_NAMES):]
+
+
+def household_counts(classes: int = 2):
+    """The household count rows, in total and per class, e.g. to hold them fixed."""
+    return ("numHH",) + tuple(f"numHH{k}" for k in range(1, classes + 1))
+
+
+class Equilibrium(NamedTuple):
+    """
+    Fixed point of the one-step map, as returned by `fixed_point`.
+
+    - state: The 49 state values at the fixed point, in `STATE_NAMES` order
+      (`state_names` with more than two household classes).
+    - flows: The 77 flows of a step taken from it, in `FLOW_NAMES` order.
+    - names: The state rows solved for (`dynamic_names` minus the frozen ones).
+    - jacobian: Derivative of the map over `names` at the fixed point.
+    - eigenvalues: Eigenvalues of `jacobian`, largest modulus first.
+    - converged: Whether the residual met the tolerance.
+    - iterations: Map evaluations spent on the solve, Jacobians excluded.
+    Eigenvalues of modulus one are neutral directions, which the model has
+    by construction: the mass deficits only accumulate, and extinct
+    compartments or populations at their floor stay where they are.
+    - residual: Largest |F(z) - z| over `names` at the returned state.
+    - collapsed: Whether a stock or population alive at the start is at its
+      floor (see `COLLAPSE_FRACTION`), as in the collapse every run ends in.
+    """
+
+    state: np.ndarray
+    flows: np.ndarray
+    names: tuple
+    jacobian: np.ndarray
+    eigenvalues: np.ndarray
+    converged: bool
+    iterations: int
+    residual: float
+    collapsed: bool
+
+    @property
+    def spectral_radius(self):
+        return float(np.abs(self.eigenvalues[0])) if len(self.eigenvalues) else 0.0
+
+    @property
+    def neutral(self):
+        """Number of eigenvalues on the unit circle (within 1e-6)."""
+        return int(np.sum(np.abs(np.abs(self.eigenvalues) - 1) <= NEUTRAL_TOLERANCE))
+
+    @property
+    def stable(self):
+        """No eigenvalue outside the unit circle: small perturbations do not grow."""
+        return self.spectral_radius <= 1 + NEUTRAL_TOLERANCE
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            classes = flow_classes(len(self.flows))
+            if key in flow_index(classes):
+                return self.flows[flow_index(classes)[key]]
+            return self.state[state_index(classes)[key]]
+        return tuple.__getitem__(self, key)
+
+    def ghg_values(self):
+        """The GHG-producing variables at the fixed point, comparable to `yGHGstb`."""
+        return np.array([self[name] for name in GHG_NAMES])
+
+
+class _StepMap:
+    """The one-step map restricted to the solved rows, evaluated in batches."""
+
+    def __init__(self, time, overrides, i, start, frozen, rounding):
+        self.ensemble = GSSEMEnsemble(max(time, i + 2), n=1, overrides=overrides)
+        self.i = i
+        self.base = np.array(
+            self.ensemble.initial_state()[:, 0] if start is None else start, dtype=float
+        )
+        classes = self.ensemble.params.classes
+        self.dynamic = dynamic_names(classes)
+        self.names = state_names(classes)
+        index = state_index(classes)
+        self.rows = [index[name] for name in self.dynamic if name not in frozen]
+        # The households and household mass of every class are non-negative
+        nonnegative = set(NONNEGATIVE) | set(self.dynamic[len(DYNAMIC_NAMES):])
+        self.lower = np.array(
+            [0.0 if self.names[row] in nonnegative else -np.inf for row in self.rows]
+        )
+        # Stocks and populations alive at the start, and how close to their
+        # floor (one household, zero mass) they may come
+        counts = set(household_counts(classes))
+        floor = np.array([1.0 if self.names[row] in counts else 0.0 for row in self.rows])
+        start = self.base[self.rows]
+        self.living = np.flatnonzero(np.isfinite(self.lower) & (start > floor))
+        self.floor = (floor + COLLAPSE_FRACTION * (start - floor))[self.living]
+        self.rounding = rounding
+
+    def collapsed(self, z):
+        """Whether a stock or population alive at the start is at its floor in z."""
+        return bool(np.any(z[self.living] <= self.floor))
+
+    def __call__(self, z):
+        """F over columns of solved rows z, shape (d, M); also gives the flows and states."""
+        state = np.repeat(self.base[:, np.newaxis], z.shape[1], axis=1)
+        state[self.rows] = z
+        flows, next_state = self.ensemble.step_map(self.i, state, rounding=self.rounding)
+        return next_state[self.rows], flows, next_state
+
+    def jacobian(self, z, fz):
+        """Forward-difference Jacobian at z, all d perturbations in one batch."""
+        d = len(z)
+        h = np.sqrt(np.finfo(float).eps) * np.maximum(np.abs(z), 1)
+        perturbed = np.repeat(z[:, np.newaxis], d, axis=1)
+        perturbed[np.arange(d), np.arange(d)] += h
+        return (self(perturbed)[0] - fz[:, np.newaxis]) / h
+
+
+def _converged(g, z, atol, rtol):
+    return bool(np.all(np.abs(g) <= atol + rtol * np.abs(z)))
+
+
+def _diverged(g, initial):
+    """Whether the residual g is non-finite or `DIVERGENCE` times the initial one."""
+    return not np.all(np.isfinite(g)) or np.abs(g).max() > DIVERGENCE * initial
+
+
+def _anderson(f, z, atol, rtol, max_iter, memory, exclude, growth=10):
+    """
+    Anderson-accelerated iteration z <- F(z).
+
+    Mixed iterates are kept non-negative where the state must be, and the
+    mixing restarts from the plain step when the residual becomes non-finite
+    or `growth` times the best one seen, or when the mixed iterate collapses
+    (with `exclude`). The solve stops early once the plain step collapses or
+    the residual diverges, since the iteration then goes nowhere useful.
+    """
+    fz = f(z[:, np.newaxis])[0][:, 0]
+    g = fz - z
+    best = initial = np.abs(g).max()
+    f_history, g_history = [], []
+    evaluations = 1
+    while evaluations < max_iter and not _converged(g, z, atol, rtol):
+        candidate = fz
+        if g_history:
+            dF = np.diff(np.array(f_history + [fz]).T, axis=1)
+            dG = np.diff(np.array(g_history + [g]).T, axis=1)
+            candidate = fz - dF @ np.linalg.lstsq(dG, g, rcond=None)[0]
+            candidate = np.maximum(candidate, f.lower)
+            if exclude and f.collapsed(candidate):
+                candidate = fz
+        if exclude and f.collapsed(candidate):
+            break
+        fc = f(candidate[:, np.newaxis])[0][:, 0]
+        evaluations += 1
+        if not np.all(np.isfinite(fc)) or np.abs(fc - candidate).max() > growth * best:
+            f_history, g_history = [], []
+            candidate = fz
+            if exclude and f.collapsed(candidate):
+                break
+            fc = f(candidate[:, np.newaxis])[0][:, 0]
+            evaluations += 1
+        else:
+            f_history.append(fz)
+            g_history.append(g)
+            del f_history[:-memory], g_history[:-memory]
+        z, fz, g = candidate, fc, fc - candidate
+        if _diverged(g, initial):
+            break
+        best = min(best, np.abs(g).max())
+    return z, evaluations, _converged(g, z, atol, rtol)
+
+
+def _newton(f, z, atol, rtol, max_iter, exclude, patience=50):
+    """
+    Newton on F(z) - z = 0 with a batched finite-difference Jacobian.
+
+    Rows are scaled by their starting magnitude, as the state mixes
+    thousands of households with per capita masses of 1e-4. Steps are kept
+    non-negative where the state must be and halved until the residual
+    decreases without collapsing the state (with `exclude`); when that fails
+    the plain step z <- F(z) is taken. The solve stops early when the plain
+    step collapses too, when the residual diverges, or when it has not
+    improved in `patience` steps.
+    """
+    d = len(z)
+    scale = np.maximum(np.abs(z), 1e-6)
+    fz = f(z[:, np.newaxis])[0][:, 0]
+    g = fz - z
+    best = initial = np.abs(g).max()
+    evaluations = 1
+    stalled = 0
+    while evaluations < max_iter and not _converged(g, z, atol, rtol):
+        jacobian = f.jacobian(z, fz)
+        if np.all(np.isfinite(jacobian)):
+            # Least squares, as neutral directions make J - I singular
+            step = scale * np.linalg.lstsq(
+                (jacobian - np.eye(d)) * scale, -g, rcond=None
+            )[0]
+        else:
+            step = g
+        for length in 0.5 ** np.arange(8):
+            candidate = np.maximum(z + length * step, f.lower)
+            if exclude and f.collapsed(candidate):
+                continue
+            fc = f(candidate[:, np.newaxis])[0][:, 0]
+            evaluations += 1
+            gc = fc - candidate
+            if np.all(np.isfinite(gc)) and np.abs(gc).max() < np.abs(g).max():
+                break
+        else:
+            candidate = fz
+            if exclude and f.collapsed(candidate):
+                break
+            fc = f(candidate[:, np.newaxis])[0][:, 0]
+            evaluations += 1
+        z, fz, g = candidate, fc, fc - candidate
+        if _diverged(g, initial):
+            break
+        stalled = 0 if np.abs(g).max() < 0.99 * best else stalled + 1
+        best = min(best, np.abs(g).max())
+        if stalled >= patience:
+            break
+    return z, evaluations, _converged(g, z, atol, rtol)
+
+
+def fixed_point(time: int = 100, overrides: dict = None, i: int = 0, start=None,
+                frozen=FROZEN, relaxed: bool = True, method: str = "newton",
+                atol: float = 1e-9, rtol: float = 0.0, max_iter: int = 10000,
+                memory: int = 5, exclude_collapse: bool = True):
+    """
+    Find a fixed point of the one-step GSSEM map and its local stability.
+
+    Solves F(z) = z, where F is step i of the model (`GSSEMEnsemble.step_map`)
+    over the dynamic state rows minus `frozen`, which keep their starting
+    values. The trends of step i (mortality, births) are held fixed, so the
+    result is the state the model would settle into under the conditions of
+    year i, without simulating the approach to it. Stability is read off the
+    eigenvalues of the Jacobian of F at the fixed point (forward differences,
+    all perturbed states evaluated as one batch): perturbations grow along
+    eigenvalues outside the unit circle.
+
+    The model rounds household births and deaths up to whole households, so
+    its map only has fixed points where they balance exactly (such as the
+    collapse to one household) and no useful derivatives in the household
+    counts. By default F is its continuous relaxation instead, with
+    fractional households; the rounded model then hovers within about one
+    household of the relaxed fixed point.
+
+    Every run of the model ends in the collapse to one household with its
+    food chain extinct, and that fixed point attracts the solvers from almost
+    anywhere, so states where a stock or population alive at the start dies
+    out are rejected (`exclude_collapse`). With the default frozen rows the
+    model has no other fixed point: births outpace deaths until the food
+    runs out, and energy drawn from the held ERP pool keeps adding mass to
+    IRP. The populated equilibrium is that of the ecosystem and economy for
+    a given population (`household_counts` frozen) with no energy mass
+    flowing in (`gammaEEIRP = 0`); it is stable and matches the P1, H1 and
+    production values of `Parameters.yGHGstb`. Its total mass is conserved,
+    so it is one of a family of fixed points along that neutral direction.
+    Solves that cannot get anywhere stop early instead of using up
+    `max_iter`: when the plain step collapses, when the residual grows
+    `DIVERGENCE` times, or when Newton stops improving.
+
+    Parameters:
+    - time (int): Horizon of the parameter set (the noise draws of step i are
+      used when the Ito process is on).
+    - overrides (dict): Scalar parameter overrides (see `Parameters`).
+    - i (int): Time index of the step whose map is solved.
+    - start (ndarray): State (49,) to start from, with the rows of
+      `state_names` for more than two household classes; the initial state
+      when omitted. Different starts may reach different fixed points.
+    - frozen (tuple): State rows held at their starting values.
+    - relaxed (bool): Solve the continuous relaxation (default) instead of
+      the map with whole households.
+    - method (str): "newton" (default; Newton steps with the batched
+      Jacobian and backtracking, which also finds fixed points that repel
+      the iteration) or "anderson" (Anderson acceleration of the iteration
+      z <- F(z), cheaper per step where the iteration itself converges).
+    - atol, rtol (float): Convergence when |F(z) - z| <= atol + rtol |z|
+      for every solved row. Only use rtol when the rows have similar
+      scales; a diverging solve would otherwise pass it.
+    - max_iter (int): Map evaluations allowed.
+    - memory (int): Past steps mixed by Anderson acceleration.
+    - exclude_collapse (bool): Reject collapsed states (default); without
+      it, the solvers mostly return the collapse.
+
+    Returns:
+    - Equilibrium: The fixed point, its Jacobian and eigenvalues; check
+      `converged`, `collapsed` and `stable` before using it.
+    """
+    frozen = tuple(frozen)
+    f = _StepMap(time, overrides, i, start, frozen, np.positive if relaxed else np.ceil)
+    unknown = set(frozen) - set(f.dynamic)
+    if unknown:
+        raise AttributeError(f"Unknown state names: {sorted(unknown)}")
+    z = f.base[f.rows]
+    if method == "newton":
+        z, iterations, converged = _newton(f, z, atol, rtol, max_iter, exclude_collapse)
+    elif method == "anderson":
+        z, iterations, converged = _anderson(f, z, atol, rtol, max_iter, memory, exclude_collapse)
+    else:
+        raise ValueError(f"Unknown method {method!r}, use 'anderson' or 'newton'")
+
+    fz, flows, next_state = f(z[:, np.newaxis])
+    jacobian = f.jacobian(z, fz[:, 0])
+    eigenvalues = np.linalg.eigvals(jacobian)
+    state = f.base.copy()
+    state[f.rows] = z
+    # The recorded (non-dynamic) rows are those of a step from the fixed point
+    recorded = slice(len(DYNAMIC_NAMES), len(STATE_NAMES))
+    state[recorded] = next_state[recorded, 0]
+    return Equilibrium(
+        state=state,
+        flows=flows[:, 0],
+        names=tuple(f.names[row] for row in f.rows),
+        jacobian=jacobian,
+        eigenvalues=eigenvalues[np.argsort(-np.abs(eigenvalues))],
+        converged=converged,
+        iterations=iterations,
+        residual=float(np.abs(fz[:, 0] - z).max()),
+        collapsed=f.collapsed(z),
+    )
@@ -0,0 +1,117 @@
+from collections import namedtuple
+from itertools import islice
+import numpy as np
+
+# Exogenous series a run can be forced with, each added to the model's own
+# value at every step:
+# - emissions: GtCO2eq emitted in the step on top of the model's emissions.
+# - temp: Temperature anomaly added to temp at the next time index.
+# - mHH: Added to the household mortality rate of every class.
+# - etaa: Added to the birth-rate trend of every class.
+# - ERP: Change of the ERP pool at the next time index (shocks are negative;
+#   a pool driven to zero or below is exhausted, as when it is depleted).
+FORCING_NAMES = ("emissions", "temp", "mHH", "etaa", "ERP")
+
+# The forcing of one step, zero for the series the source does not have
+ForcingStep = namedtuple("ForcingStep", FORCING_NAMES)
+
+
+class Forcing:
+    """
+    Exogenous forcing series, streamed chunk by chunk into the time loop.
+
+    Row i of the source forces step i, which computes time index i + 1 from
+    i, so a run of `time` steps reads rows 0 .. time - 2. Only one chunk of
+    `chunk_size` rows is held in memory at a time, so horizons of millions
+    of steps never materialize the whole series:
+    - `.npy` files are memory-mapped, and chunks are read from the mapping.
+    - `.csv` files (a header row with the series names, one row per step)
+      are read sequentially; going back to an earlier chunk rereads the
+      file from the start.
+    - Arrays in memory (a structured array, or a dict of 1-D arrays) are
+      used as they are.
+    A `Forcing` is shared by every member of an ensemble (and by any number
+    of runs), as the same value of each series applies to all members.
+    """
+
+    def __init__(self, source, names=None, chunk_size: int = 65536):
+        """
+        Parameters:
+        - source: Path of a `.csv` or `.npy` file, a structured array with
+          one field per series, or a dict of series name -> 1-D array.
+        - names (list): Series names of the columns of a plain 2-D `.npy`
+          array (steps, len(names)).
+        - chunk_size (int): Rows read at a time.
+        """
+        self.chunk_size = chunk_size
+        self.path = source if isinstance(source, str) else None
+        self._columns = None
+        if isinstance(source, str) and source.endswith(".csv"):
+            with open(source) as f:
+                self.names = tuple(name.strip() for name in f.readline().split(","))
+        else:
+            data = np.load(source, mmap_mode="r") if isinstance(source, str) else source
+            if isinstance(data, dict):
+                self._columns = {name: np.asarray(data[name]) for name in data}
+            elif data.dtype.names is not None:
+                self._columns = {name: data[name] for name in data.dtype.names}
+            else:
+                if names is None or np.shape(data)[1] != len(names):
+                    raise ValueError("A plain forcing array needs one name per column")
+                self._columns = {name: data[:, k] for k, name in enumerate(names)}
+            self.names = tuple(self._columns)
+        unknown = set(self.names) - set(FORCING_NAMES)
+        if unknown:
+            raise AttributeError(
+                f"Unknown forcing series: {sorted(unknown)}, use {FORCING_NAMES}"
+            )
+        self._file = None
+        self._begin = 0
+        self._rows = []
+
+    def at(self, i: int):
+        """The `ForcingStep` of step i, loading the chunk that holds it."""
+        offset = i - self._begin
+        if not 0 <= offset < len(self._rows):
+            self._load(i - i % self.chunk_size)
+            offset = i - self._begin
+            if offset >= len(self._rows):
+                raise IndexError(f"The forcing ends before step {i}")
+        return self._rows[offset]
+
+    def _load(self, begin):
+        """Read the chunk of rows from `begin` as `ForcingStep` records."""
+        end = begin + self.chunk_size
+        if self._columns is not None:
+            block = {name: column[begin:end] for name, column in self._columns.items()}
+        else:
+            block = self._read_csv(begin)
+        rows = len(next(iter(block.values()))) if block else 0
+        table = np.zeros((rows, len(FORCING_NAMES)))
+        for name, values in block.items():
+            table[:, FORCING_NAMES.index(name)] = values
+        self._begin = begin
+        self._rows = [ForcingStep(*row) for row in table.tolist()]
+
+    def _read_csv(self, begin):
+        # Continue reading where the last chunk ended, or reopen the file
+        if self._file is None or begin < self._next:
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path)
+            self._file.readline()
+            self._next = 0
+        lines = list(
+            islice(self._file, begin - self._next, begin - self._next + self.chunk_size)
+        )
+        self._next = begin + len(lines)
+        if not lines:
+            return {name: np.empty(0) for name in self.names}
+        table = np.loadtxt(lines, delimiter=",", ndmin=2).reshape(-1, len(self.names))
+        return {name: table[:, k] for k, name in enumerate(self.names)}
+
+    def close(self):
+        """Close the file of a `.csv` source; it is reopened when read again."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
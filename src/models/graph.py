@@ -0,0 +1,533 @@
+import ast
+import builtins
+import linecache
+from functools import lru_cache
+from types import FunctionType
+from typing import NamedTuple
+import numpy as np
+from src.models.trajectory import FLOW_NAMES
+
+
+class Flow(NamedTuple):
+    """
+    A flow between compartments and its rate law.
+
+    - name: Flow name, as in `FLOW_NAMES`.
+    - law: Python expression of the flow before balancing. Parameters are
+      written `p.<name>`; other names are states or values the step computes
+      before the ecosystem flows, and `rounding` turns household counts into
+      whole households.
+    - refresh: Evaluate the law again before the second balancing pass, so
+      that pass starts from the unbalanced flow.
+    """
+
+    name: str
+    law: str
+    refresh: bool = False
+
+
+class Compartment(NamedTuple):
+    """
+    A stock and the rule that balances its outflows.
+
+    The compartment holds `name`, receives `inflows`, returns `loss` to RP
+    and is drawn on by `demands`. When the outflows would take it below
+    `floor` (0, or a parameter such as `belownoreproduction`):
+    - collapse: even `loss` alone takes it below the floor. Everything
+      available returns to RP and no demand is served.
+    - rationed: what is left after `loss` is shared out in proportion to the
+      demands; the last demand takes the remainder, so no mass is lost to
+      rounding.
+    Otherwise, when `deficit` (the accumulated unmet demand, <= 0) is
+    negative, the surplus repays it up to -deficit: demand k receives the
+    share parts[k] / deficit of the surplus (no share where parts[k] is
+    None); without `parts` the last demand receives all of it.
+
+    Sums are taken in the order the flows are given, as in the original
+    model. `recorded` compartments keep their inflow and outflow totals as
+    the I<name> and D<name> states; `outflow_order` is the order of the
+    outflow total where the original model sums it differently.
+    """
+
+    name: str
+    inflows: tuple
+    loss: str
+    demands: tuple = ()
+    floor: str = None
+    deficit: str = None
+    parts: tuple = None
+    recorded: bool = True
+    outflow_order: tuple = None
+
+
+class Pool(NamedTuple):
+    """
+    A stock shared by several uptakes, balanced before its consumers.
+
+    When the uptakes exceed what the pool holds after its `loss` and
+    `inflow` (expressions, like rate laws), each uptake whose consumer
+    is not empty gets the share rates[k] / sum(rates) of it. An empty pool
+    serves no uptake.
+    """
+
+    name: str
+    uptakes: tuple
+    consumers: tuple
+    rates: tuple
+    loss: str
+    inflow: str
+
+
+# Unbalanced ecosystem flows. P1H2, H1C1 and P2H1 come from the demand
+# section of the step.
+RATES = (
+    Flow("P1RP", "max(p.mP1 * P1, 0)"),
+    Flow("RPP1", "max(gRPP1 * P1 * RP, 0)"),
+    Flow("P1H1", "P1H1demand"),
+    Flow("P1IS", "P1ISdemand"),
+    Flow("P1HH", "P1HHdemand * numHH"),
+    Flow("P2H2", "p.gP2H2 * P2 * H2"),
+    Flow("P2H3", "p.gP2H3 * P2 * H3"),
+    Flow("P2RP", "max(p.mP2 * P2, 0)"),
+    Flow("RPP2", "max(gRPP2 * RP * P2, 0)"),
+    Flow("IRPP2", "max(p.rIRPP2 * P2 * IRP, 0)"),
+    Flow("P3RP", "max(p.mP3 * P3, 0)"),
+    Flow("P3H3", "p.gP3H3 * P3 * H3"),
+    Flow("RPP3", "max(gRPP3 * RP * P3, 0)"),
+    Flow("IRPP3", "max(p.rIRPP3 * P3 * IRP, 0)"),
+    Flow("H1RP", "max(p.mH1 * H1, 0)"),
+    Flow("H1HH", "H1HHdemand * numHH"),
+    Flow("H2C1", "p.gH2C1 * C1 * H2"),
+    Flow("H2C2", "p.gH2C2 * H2 * C2"),
+    Flow("H2RP", "max(p.mH2 * H2, 0)"),
+    Flow("H3RP", "max(p.mH3 * H3, 0)"),
+    Flow("H3C2", "p.gH3C2 * H3 * C2"),
+    Flow("C1RP", "max(p.mC1 * C1, 0)"),
+    Flow("C2RP", "max(p.mC2 * C2, 0)"),
+    Flow("HHRP", "rounding(p.mHH * numHH) * percapmass", refresh=True),
+)
+
+# Balancing rules, in the order the passes apply them
+RULES = (
+    Compartment(
+        "P1", ("RPP1",), "P1RP", ("P1H2", "P1H1", "P1HH", "P1IS"),
+        deficit="P1massdeficit",
+        parts=(None, "P1H1massdeficit", "P1HHmassdeficit", "P1ISmassdeficit"),
+        outflow_order=("P1RP", "P1H1", "P1H2", "P1HH", "P1IS"),
+    ),
+    Pool(
+        "IRP", ("IRPP2", "IRPP3"), ("P2", "P3"), ("rIRPP2", "rIRPP3"),
+        loss="max(IRP * p.mIRPRP, 0)", inflow="p.RPIRP",
+    ),
+    Compartment(
+        "P2", ("IRPP2", "RPP2"), "P2RP", ("P2H2", "P2H3", "P2H1"),
+        floor="belownoreproduction",
+        outflow_order=("P2RP", "P2H1", "P2H2", "P2H3"),
+    ),
+    Compartment(
+        "P3", ("IRPP3", "RPP3"), "P3RP", ("P3H3",), floor="belownoreproduction"
+    ),
+    Compartment(
+        "H1", ("P1H1", "P2H1"), "H1RP", ("H1C1", "H1HH"), deficit="H1massdeficit"
+    ),
+    Compartment(
+        "H2", ("P1H2", "P2H2"), "H2RP", ("H2C1", "H2C2"), floor="belownoreproduction"
+    ),
+    Compartment("H3", ("P2H3", "P3H3"), "H3RP", ("H3C2",), floor="belownoreproduction"),
+    Compartment("C1", ("H1C1", "H2C1"), "C1RP", floor="belownoreproduction"),
+    Compartment("C2", ("H2C2", "H3C2"), "C2RP", floor="belownoreproduction"),
+    Compartment("HH", ("P1HH", "H1HH"), "HHRP", recorded=False),
+)
+
+COMPARTMENTS = tuple(rule for rule in RULES if isinstance(rule, Compartment))
+
+# Flows returned by both passes, in `FLOW_NAMES` order
+BALANCED = tuple(
+    name
+    for name in FLOW_NAMES
+    if name in {flow.name for flow in RATES}
+    or any(
+        name in (rule.inflows + (rule.loss,) + rule.demands)
+        for rule in COMPARTMENTS
+    )
+)
+
+# Arguments of the passes, in order. The engines pass them positionally to
+# keep the calls cheap, so the generator checks them against what each pass
+# reads.
+BALANCE_INPUTS = (
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "RP", "IRP", "numHH",
+    "percapmass", "gRPP1", "gRPP2", "gRPP3", "P1H1demand", "P1ISdemand",
+    "P1HHdemand", "H1HHdemand", "P1H2", "P2H1", "H1C1", "P1massdeficit",
+    "P1H1massdeficit", "P1HHmassdeficit", "P1ISmassdeficit", "H1massdeficit",
+    "rounding",
+)
+REBALANCE_INPUTS = (
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "IRP", "numHH",
+    "percapmass", "P1RP", "P1H1", "P1H2", "P1IS", "P1HH", "P2RP", "P2H1",
+    "P2H2", "P2H3", "P3RP", "P3H3", "H1RP", "H1C1", "H1HH", "H2RP", "H2C1",
+    "H2C2", "H3RP", "H3C2", "C1RP", "C2RP", "RPP1", "RPP2", "RPP3", "IRPP2",
+    "IRPP3", "P1massdeficit", "P1H1massdeficit", "P1HHmassdeficit",
+    "P1ISmassdeficit", "H1massdeficit", "rounding",
+)
+
+# Values of the next state returned by the second pass
+NEXT = tuple(
+    name
+    for rule in COMPARTMENTS
+    for name in (
+        (rule.name, "I" + rule.name, "D" + rule.name) if rule.recorded else (rule.name,)
+    )
+)
+
+
+class CompiledGraph(NamedTuple):
+    """
+    Step functions generated from the graph (see `compile_graph`).
+
+    - balance(*BALANCE_INPUTS, profile=None): Evaluates the rate laws
+      and the first balancing pass; returns the `BALANCED` flows.
+    - rebalance(*REBALANCE_INPUTS, profile=None): Refreshes the rate laws so
+      marked, repeats the balancing pass on the flows after RP and ERP were
+      shared out, and applies the mass balance of every compartment; returns
+      the `BALANCED` flows and the `NEXT` values (X, IX and DX as
+      "<name>_next").
+    - source: The generated Python source.
+    """
+
+    balance: object
+    rebalance: object
+    source: str
+
+
+def _compartment(rule, label, batched):
+    """Source lines balancing one compartment (see `Compartment`)."""
+    floor = "0" if rule.floor is None else f"p.{rule.floor}"
+    demands = rule.demands
+    net = " - ".join(("_left",) + demands)
+    lines = [
+        f"# {rule.name}",
+        f"_available = {' + '.join((rule.name,) + rule.inflows)}",
+        f"_left = _available - {rule.loss}",
+    ]
+    shares = [f"_left * {demand} / _total" for demand in demands[:-1]]
+    if batched:
+        if not demands:
+            return lines + [
+                f"{rule.loss} = where(_left < {floor}, _available, {rule.loss})"
+            ]
+        lines += [
+            f"_net = {net}",
+            f"_short = _net < {floor}",
+            f"_empty = _short & (_left < {floor})",
+        ]
+        if shares:
+            lines.append(f"_total = {' + '.join(demands)}")
+        lines += [f"_share{k} = {share}" for k, share in enumerate(shares)]
+        served = " + ".join(f"_share{k}" for k in range(len(shares)))
+        lines.append(
+            f"_share{len(shares)} = _left - ({served})" if shares else "_share0 = _left"
+        )
+        if rule.deficit is not None:
+            lines += [
+                f"_repay = ~_short & ({rule.deficit} < 0)",
+                f"_surplus = minimum(_net, -{rule.deficit})",
+            ]
+        lines.append(f"{rule.loss} = where(_empty, _available, {rule.loss})")
+        for k, demand in enumerate(demands):
+            repaid = _repaid(rule, k)
+            value = demand if repaid is None else f"where(_repay, {repaid}, {demand})"
+            lines.append(
+                f"{demand} = where(_empty, 0, where(_short, _share{k}, {value}))"
+            )
+        return lines
+
+    def count(branch):
+        return [
+            "if profile is not None:",
+            f"    profile.branch('{label} {rule.name} {branch}')",
+        ]
+
+    collapse = count("collapse") + [f"{rule.loss} = _available"]
+    collapse += [f"{demand} = 0" for demand in demands]
+    if not demands:
+        # With nothing to ration, falling below the floor is a collapse
+        return lines + [f"if _left < {floor}:"] + _indent(collapse)
+    rationed = count("rationed")
+    if shares:
+        rationed.append(f"_total = {' + '.join(demands)}")
+    rationed += [f"{demand} = {share}" for demand, share in zip(demands, shares)]
+    rationed.append(
+        f"{demands[-1]} = _left - ({' + '.join(demands[:-1])})" if shares
+        else f"{demands[-1]} = _left"
+    )
+    test = net
+    if rule.deficit is not None:
+        lines.append(f"_net = {net}")
+        test = "_net"
+    lines += [f"if {test} < {floor}:"] + _indent(
+        [f"if _left < {floor}:"] + _indent(collapse) + ["else:"] + _indent(rationed)
+    )
+    if rule.deficit is not None:
+        repay = count("deficit repaid") + [f"_surplus = min(_net, -{rule.deficit})"]
+        for k, demand in enumerate(demands):
+            if _repaid(rule, k) is not None:
+                repay.append(f"{demand} = {_repaid(rule, k)}")
+        lines += [f"elif {rule.deficit} < 0:"] + _indent(repay)
+    return lines
+
+
+def _repaid(rule, k):
+    """Expression of demand k after repaying the deficit, None if it gets no share."""
+    if rule.deficit is None:
+        return None
+    demand = rule.demands[k]
+    if rule.parts is None:
+        return f"{demand} + _surplus" if k == len(rule.demands) - 1 else None
+    part = rule.parts[k]
+    return None if part is None else f"{demand} + _surplus * {part} / {rule.deficit}"
+
+
+def _pool(rule, label, batched):
+    """Source lines sharing a pool between its uptakes (see `Pool`)."""
+    available = f"{rule.name} - {rule.loss} + {rule.inflow}"
+    short = " - ".join((rule.name,) + rule.uptakes) + f" - {rule.loss} + {rule.inflow} < 0"
+    rates = " + ".join(f"p.{rate}" for rate in rule.rates)
+    shares = [f"p.{rate} * _available / ({rates})" for rate in rule.rates]
+    lines = [f"# {rule.name}"]
+    if batched:
+        lines += [
+            f"_available = {available}",
+            f"_short = ({rule.name} > 0) & ({short})",
+        ]
+        lines += [
+            f"{uptake} = where(_short & ({consumer} != 0), {share}, {uptake})"
+            for uptake, consumer, share in zip(rule.uptakes, rule.consumers, shares)
+        ]
+        lines += [
+            f"{uptake} = where({rule.name} <= 0, 0, {uptake})" for uptake in rule.uptakes
+        ]
+        return lines
+    exhausted = [
+        "if profile is not None:",
+        f"    profile.branch('{label} {rule.name} exhausted')",
+    ] + [f"{uptake} = 0" for uptake in rule.uptakes]
+    rationed = [
+        "if profile is not None:",
+        f"    profile.branch('{label} {rule.name} rationed')",
+        f"_available = {available}",
+    ]
+    for uptake, consumer, share in zip(rule.uptakes, rule.consumers, shares):
+        rationed += [f"if {consumer} != 0:", f"    {uptake} = {share}"]
+    return (
+        lines
+        + [f"if {rule.name} <= 0:"] + _indent(exhausted)
+        + [f"elif {short}:"] + _indent(rationed)
+    )
+
+
+def _indent(lines):
+    return ["    " + line for line in lines]
+
+
+def _stage(name, statements, arguments):
+    """Source of a step function taking `arguments`, the names it reads first."""
+    inputs, assigned = set(), set()
+
+    def read(node):
+        inputs.update(
+            n.id
+            for n in ast.walk(node)
+            if isinstance(n, ast.Name)
+            and n.id not in assigned
+            and n.id not in _RESERVED
+            and not hasattr(builtins, n.id)
+        )
+
+    def scan(nodes):
+        for node in nodes:
+            if isinstance(node, ast.Assign):
+                read(node.value)
+                assigned.update(target.id for target in node.targets)
+            elif isinstance(node, ast.If):
+                read(node.test)
+                before = set(assigned)
+                scan(node.body)
+                branch = set(assigned)
+                assigned.intersection_update(before)
+                scan(node.orelse)
+                assigned.update(branch)
+            else:
+                read(node)
+
+    scan(ast.parse("\n".join(statements)).body)
+    if inputs != set(arguments):
+        raise ValueError(
+            f"The {name} pass reads {sorted(inputs)}, not {sorted(arguments)}"
+        )
+    return [f"def {name}({', '.join(arguments)}, profile=None):"] + _indent(
+        statements
+    )
+
+
+def _rules(label, batched):
+    lines = []
+    for rule in RULES:
+        build = _pool if isinstance(rule, Pool) else _compartment
+        lines += build(rule, label, batched)
+    return lines
+
+
+def _mass_balances():
+    lines = []
+    for rule in COMPARTMENTS:
+        gains = " + ".join((rule.name,) + rule.inflows)
+        lines.append(f"{rule.name}_next = {' - '.join((gains, rule.loss) + rule.demands)}")
+        if rule.recorded:
+            outflows = rule.outflow_order or (rule.loss,) + rule.demands
+            lines.append(f"I{rule.name}_next = {' + '.join(rule.inflows)}")
+            lines.append(f"D{rule.name}_next = {' + '.join(outflows)}")
+    return lines
+
+
+@lru_cache(maxsize=2)
+def _source(batched):
+    """Generated source of both passes, parameters still written `p.<name>`."""
+    flows = f"({', '.join(BALANCED)})"
+    next_state = f"({', '.join(name + '_next' for name in NEXT)})"
+    balance = _stage(
+        "balance",
+        [f"{flow.name} = {flow.law}" for flow in RATES]
+        + _rules("III", batched)
+        + [f"return {flows}"],
+        BALANCE_INPUTS,
+    )
+    rebalance = _stage(
+        "rebalance",
+        [f"{flow.name} = {flow.law}" for flow in RATES if flow.refresh]
+        + _rules("III.A", batched)
+        + _mass_balances()
+        + [f"return {flows}, {next_state}"],
+        REBALANCE_INPUTS,
+    )
+    return "\n".join(balance + [""] + rebalance) + "\n"
+
+
+class _Bind(ast.NodeTransformer):
+    """Read parameters as globals `p_<name>`; use NumPy functions in batched code."""
+
+    def __init__(self, batched):
+        self.batched = batched
+        self.parameters = set()
+
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == "p":
+            self.parameters.add(node.attr)
+            return ast.copy_location(ast.Name("p_" + node.attr, ast.Load()), node)
+        return self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if self.batched and node.id in _BATCHED_NAMES:
+            node.id = _BATCHED_NAMES[node.id]
+        return node
+
+
+_BATCHED_NAMES = {"max": "maximum", "min": "minimum"}
+_BATCHED_FUNCTIONS = {"where": np.where, "maximum": np.maximum, "minimum": np.minimum}
+# Names bound by the generated code, never arguments of the step functions
+_RESERVED = {"p", "profile"} | set(_BATCHED_FUNCTIONS)
+
+
+class _Plain(ast.NodeTransformer):
+    """Take the parameters as a first argument `p` and drop the branch counts."""
+
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        node.args.args = [ast.arg("p")] + node.args.args[:-1]  # without profile
+        node.args.defaults = []
+        return node
+
+    def visit_If(self, node):
+        self.generic_visit(node)
+        if ast.unparse(node.test) == "profile is not None":
+            return None
+        return node
+
+
+def _exec(tree, filename):
+    """Compile a generated module; returns its namespace and source."""
+    source = ast.unparse(ast.fix_missing_locations(tree)) + "\n"
+    # Keep the source for tracebacks and debuggers
+    linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+    namespace = {}
+    exec(compile(source, filename, "exec"), namespace)
+    return namespace, source
+
+
+@lru_cache(maxsize=2)
+def _compile(batched):
+    """Compile both passes once; returns their code, parameters and source."""
+    bind = _Bind(batched)
+    namespace, source = _exec(
+        bind.visit(ast.parse(_source(batched))),
+        f"<graph {'batched' if batched else 'scalar'}>",
+    )
+    return (
+        namespace["balance"].__code__,
+        namespace["rebalance"].__code__,
+        tuple(sorted(bind.parameters)),
+        source,
+    )
+
+
+def compile_graph(params, batched: bool = False):
+    """
+    Step functions of a parameter set, generated from `RATES` and `RULES`.
+
+    The rules are unrolled into straight-line code with no call per
+    compartment. The code is compiled once per process; each parameter set
+    only binds its values as constants of the functions (globals
+    `p_<name>`), which takes microseconds, so runs with different
+    parameters do not recompile.
+
+    Parameters:
+    - params (Parameters): Parameter set of the run; values may be scalars
+      or per-member arrays.
+    - batched (bool): Generate code for arrays of shape (N,), selecting each
+      member's branch with masks (division warnings must be silenced by the
+      caller), instead of branching on scalars and counting the branches in
+      `profile`.
+
+    Returns:
+    - CompiledGraph: The `balance` and `rebalance` functions and their source.
+    """
+    balance, rebalance, parameters, source = _compile(batched)
+    constants = {"p_" + name: getattr(params, name) for name in parameters}
+    constants["__builtins__"] = builtins
+    if batched:
+        constants.update(_BATCHED_FUNCTIONS)
+    return CompiledGraph(
+        FunctionType(balance, constants, "balance", (None,)),
+        FunctionType(rebalance, constants, "rebalance", (None,)),
+        source,
+    )
+
+
+@lru_cache(maxsize=1)
+def compile_plain_graph():
+    """
+    Scalar step functions that take the parameter set as an argument.
+
+    `balance(p, *BALANCE_INPUTS)` and `rebalance(p, *REBALANCE_INPUTS)`
+    read the parameters as attributes of `p` and count no branches, so
+    they hold no Python objects besides their arguments and can be compiled
+    by Numba (see `src/models/jit.py`). They compute what the functions of
+    `compile_graph(params)` do.
+
+    Returns:
+    - CompiledGraph: The `balance` and `rebalance` functions and their source.
+    """
+    namespace, source = _exec(
+        _Plain().visit(ast.parse(_source(False))), "<graph plain>"
+    )
+    return CompiledGraph(namespace["balance"], namespace["rebalance"], source)
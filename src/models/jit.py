@@ -0,0 +1,524 @@
+import ast
+import inspect
+from collections import namedtuple
+from math import exp, sqrt
+import numpy as np
+from src.models.graph import compile_plain_graph
+from src.models.models import CARRIED_NAMES
+from src.models.trajectory import STATE_INDEX
+
+try:
+    import numba
+except ImportError:  # Optional: without Numba the kernel runs as plain Python
+    numba = None
+
+NUMBA = numba is not None
+
+
+def _jit(function):
+    """
+    Compile a function of the kernel when Numba is installed.
+
+    Divisions by zero give inf or nan as in NumPy (and the ensemble engine)
+    instead of raising: checking every division for zero more than doubles
+    the time of a step.
+    """
+    if numba is None:
+        return function
+    return numba.njit(error_model="numpy")(function)
+
+
+# Ecosystem passes of the graph, compiled along with the kernel
+_graph = compile_plain_graph()
+_balance = _jit(_graph.balance)
+_rebalance = _jit(_graph.rebalance)
+
+_ERP = STATE_INDEX["ERP"]
+
+
+@_jit
+def _ceil(value):
+    # Whole households as floats: no integer overflow in compiled code
+    return np.ceil(value)
+
+
+@_jit
+def _demand(c, pP1, pH1, pIS, pEE):
+    # One folded household demand equation (see `household_demands`)
+    return max(c[0] + c[1] * pP1 + c[2] * pH1 + c[3] * pIS + c[4] * pEE, 0) * 50
+
+
+@_jit
+def _class_total(values, alfa):
+    # Classes added one after the other, as in `class_total`
+    total = values[0] * alfa[0]
+    for k in range(1, len(values)):
+        total += values[k] * alfa[k]
+    return total
+
+
+@_jit
+def _run(p, first, carried, EEIRP, x, y, two):
+    """
+    The time loop of `GSSEMModel.steps`, writing each step into x and y.
+
+    Follows the scalar loop operation by operation, so both give the same
+    results. Only the ecosystem passes come from the model graph; the
+    economy, demographics and GHG sections are a third copy of those in
+    `GSSEMModel.steps` and `GSSEMEnsemble._step`, kept in line by
+    `tests/test_jit.py`.
+    Squares are taken as `** two` with `two` = 2.0 passed at run time: a
+    constant exponent compiles to v * v, which rounds differently from the
+    pow() CPython calls for `** 2`. The household classes are looped over,
+    with the squares of their array expressions taken as v * v as in NumPy.
+    """
+    (P1, P2, P3, H1, H2, H3, C1, C2, HH, ISmass, RP, IRP, numHH, percapmass,
+     P1H1massdeficit, P1ISmassdeficit, P1HHmassdeficit, H1massdeficit,
+     ISmassdeficit, P1massdeficit, numHH_k, percapmass_k, ERP, EE, CO2eq,
+     temp) = carried
+    ERPEE = EEIRP
+    time = len(x)
+    flow_columns = len(x[0]) - 7 * (len(numHH_k) - 2)
+    state_rows = len(y) - 2 * (len(numHH_k) - 2)
+
+    # Weighting factors for total population variables, and the per-class
+    # values of a step (the demands with one column each for P1, H1, IS, EE)
+    classes = len(numHH_k)
+    total = p.numHH_k[0]
+    for k in range(1, classes):
+        total += p.numHH_k[k]
+    alfa = p.numHH_k / total
+    mHH_k = np.empty(classes)
+    W_k = np.empty(classes)
+    HHdemand_k = np.empty((classes, 4))
+    percapbirths_k = np.empty(classes)
+    HH_k_next = np.empty(classes)
+    numHH_k_next = np.empty(classes)
+    percapmass_k_next = np.empty(classes)
+
+    for step in range(first, time):
+        i = step
+        if i == time - 1:
+            i = time - 2
+
+        # Demographic params due current trends (2014)
+        for k in range(classes):
+            mHH_k[k] = p.mHH_trend[i, k] + p.sigmam * p.epsilonm[i, k] * sqrt(1)
+        aa = mHH_k[0]
+        bb = mHH_k[1]
+        mHH = _class_total(mHH_k, alfa)
+        cc = mHH
+        etab = p.etab
+
+        # Growth of the plants and mortality of the households with temperature
+        gRPP1 = p.gRPP1p * exp(-((temp - p.tempo) ** two) / 100)
+        gRPP2 = p.gRPP2p * exp(-((temp - p.tempo) ** two) / 100)
+        gRPP3 = p.gRPP3p * exp(-((temp - p.tempo) ** two) / 100)
+        mHH = -(mHH * exp(-((temp - p.tempo) ** two) / 100)) + (2.0 * mHH)
+        dd = mHH_k[0]
+        ee = mHH_k[1]
+        ff = mHH
+
+        atemp_next = 0.010008 * CO2eq - 3.21675
+        temp_next = p.tempo + atemp_next
+
+        # I. Economic calculations
+        for k in range(classes):
+            W_k[k] = max(
+                p.aw_k[k]
+                + p.cw_k[k] * (p.ISbar - (ISmassdeficit + ISmass)) / (p.theta + p.lambda_)
+                - p.dw_k[k] * numHH,
+                0,
+            )
+        W = _class_total(W_k, alfa)
+
+        EMF = p.psi * ((p.Wgid - W * numHH) / p.Wgid)
+        if EMF * numHH > numHH_k[0]:
+            EMF = numHH_k[0] / numHH
+        if EMF * numHH < (-numHH_k[classes - 1]):
+            EMF = numHH_k[classes - 1] / numHH
+
+        # Pricing and production
+        if P1 == 0:
+            pP1 = 0
+            P1production = 0
+        else:
+            pP1 = max(p.aP1 + p.bP1 * W - p.cP1 * ((P1massdeficit + P1) - p.P1bar), 0)
+            P1production = max(
+                p.aP1p - p.bP1p * W - p.cP1p * ((P1massdeficit + P1) - p.P1bar), 0
+            )
+
+        if H1 == 0:
+            pH1 = 0
+            H1production = 0
+        else:
+            pH1 = max(p.aH1 + p.bH1 * W - p.cH1 * ((H1massdeficit + H1) - p.H1bar), 0)
+            H1production = max(
+                p.aH1p - p.bH1p * W - p.cH1p * ((H1massdeficit + H1) - p.H1bar), 0
+            )
+
+        if HH == 0 or numHH < 20:
+            pIS = 0
+            ISproduction = 0
+        else:
+            pIS = max(
+                p.aIS
+                + p.bIS * W
+                + p.cIS * (p.ISbar - (ISmassdeficit + ISmass)) / (p.theta + p.lambda_),
+                0,
+            )
+            ISproduction = max(
+                p.aISp
+                - p.bISp * W
+                + p.cISp * (p.ISbar - (ISmassdeficit + ISmass)) / (p.theta + p.lambda_),
+                0,
+            )
+
+        if HH == 0 or numHH < 20:
+            pEE = 0
+        else:
+            pEE = max(p.aEE + p.bEE * W + (p.cEE / ERP), 0)
+
+        # II. Demand
+        if H1 == 0 or HH == 0 or numHH < 20:
+            P1H1demand = 0
+            P2H1 = 0
+        else:
+            P1H1demand = max(
+                p.dP1H1
+                - p.eP1H1 * W
+                - p.fP1H1 * pP1
+                - p.gP1H1 * ((H1massdeficit + H1) - p.H1bar),
+                0,
+            )
+            P2H1 = p.khat
+
+        if HH == 0 or numHH < 20:
+            P1HHdemand = 0
+            H1HHdemand = 0
+            ISHHdemand = 0
+            EEHHdemand = 0
+        else:
+            rows = p.HHdemand_coefficients
+            P1HHdemand = _demand(rows[0], pP1, pH1, pIS, pEE)
+            H1HHdemand = _demand(rows[1], pP1, pH1, pIS, pEE)
+            ISHHdemand = _demand(rows[2], pP1, pH1, pIS, pEE)
+            EEHHdemand = _demand(rows[3], pP1, pH1, pIS, pEE)
+
+        for k in range(classes):
+            HHdemand_k[k, 0] = p.f2pc[k] * P1HHdemand
+            HHdemand_k[k, 1] = p.f2pc[k] * H1HHdemand
+            HHdemand_k[k, 2] = p.f2pd[k] * ISHHdemand
+            HHdemand_k[k, 3] = p.f2pd[k] * EEHHdemand
+
+        P1HHdemand = _class_total(HHdemand_k[:, 0], alfa)
+        H1HHdemand = _class_total(HHdemand_k[:, 1], alfa)
+        ISHHdemand = _class_total(HHdemand_k[:, 2], alfa)
+        EEHHdemand = _class_total(HHdemand_k[:, 3], alfa)
+
+        EEHHtotdemand = EEHHdemand * numHH
+        EEISdemand = ISproduction * p.gammaEEIS
+
+        # Labor flows
+        if P1 == 0 or H2 == 0:
+            P1H2 = 0
+        else:
+            P1H2 = max((gRPP1 * P1 * RP - p.mP1 * P1 - P1production), 0)
+
+        if H1 == 0 or C1 == 0:
+            H1C1 = 0
+        else:
+            H1C1 = max((P1H1demand + P2H1 - p.mH1 * H1 - H1production), 0)
+
+        if HH == 0 or numHH < 20:
+            P1H2 = p.gP1H2 * P1 * H2
+            H1C1 = p.gH1C1 * H1 * C1
+
+        P1ISdemand = p.theta * ISproduction
+        RPISdemand = p.lambda_ * ISproduction
+
+        # III. Ecosystem flows (arguments in graph.BALANCE_INPUTS order)
+        (P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+         H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+         RPP1, RPP2, RPP3, IRPP2, IRPP3) = _balance(
+            p, P1, P2, P3, H1, H2, H3, C1, C2, HH, RP, IRP, numHH, percapmass,
+            gRPP1, gRPP2, gRPP3, P1H1demand, P1ISdemand, P1HHdemand,
+            H1HHdemand, P1H2, P2H1, H1C1, P1massdeficit, P1H1massdeficit,
+            P1HHmassdeficit, P1ISmassdeficit, H1massdeficit, _ceil,
+        )
+
+        # RP
+        IRPRP = max(IRP * p.mIRPRP, 0)
+        RPIS = min(p.lambda_ * P1IS / p.theta, RPISdemand)
+        stockRP = (
+            RP + P1RP + P2RP + P3RP + H1RP + H2RP + H3RP + C1RP + C2RP + HHRP
+            + IRPRP
+        )
+        if stockRP < 0:
+            stockRP = 0
+        if (stockRP - (RPP1 + RPP2 + RPP3) - p.RPIRP - RPIS) <= 0 and p.RPIRP == 0:
+            RPdemand = RPP1 + RPP2 + RPP3 + RPISdemand
+            RPP1 = RPP1 * stockRP / RPdemand
+            RPP2 = RPP2 * stockRP / RPdemand
+            RPP3 = RPP3 * stockRP / RPdemand
+            if RPIS != 0:
+                RPIS = stockRP - (RPP1 + RPP2 + RPP3)
+            else:
+                RPIS = 0
+        P1IS = min(p.theta * RPIS / p.lambda_, P1IS)
+
+        # ERP
+        if ERP > 0:
+            EEproduction = EEHHtotdemand + EEISdemand
+            EEHHmass = EEHHtotdemand * p.gammaEEIRP
+            ERPEE = EEproduction * p.gammaEEIRP
+            if (ERP - ERPEE) < 0:
+                ERPEE = ERP
+                ERP = 0
+            EEIRP = ERPEE
+        else:
+            pEE = 0
+            EEproduction = 0
+            EEHHmass = 0
+            EEHHtotdemand = 0
+            EEISdemand = 0
+            EEHHdemand = 0
+
+        # III.A. Balance the flows again and update the compartments
+        # (arguments in graph.REBALANCE_INPUTS order)
+        (
+            (P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+             H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+             RPP1, RPP2, RPP3, IRPP2, IRPP3),
+            (P1_next, IP1_next, DP1_next, P2_next, IP2_next, DP2_next, P3_next,
+             IP3_next, DP3_next, H1_next, IH1_next, DH1_next, H2_next, IH2_next,
+             DH2_next, H3_next, IH3_next, DH3_next, C1_next, IC1_next, DC1_next,
+             C2_next, IC2_next, DC2_next, HH_next),
+        ) = _rebalance(
+            p, P1, P2, P3, H1, H2, H3, C1, C2, HH, IRP, numHH, percapmass,
+            P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP,
+            P3H3, H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP,
+            C2RP, RPP1, RPP2, RPP3, IRPP2, IRPP3, P1massdeficit,
+            P1H1massdeficit, P1HHmassdeficit, P1ISmassdeficit,
+            H1massdeficit, _ceil,
+        )
+
+        # IV. Demographic
+        ISHHflow = max((p.theta + p.lambda_) * ISHHdemand * numHH, 0)
+        ISIRP = ISHHflow
+        if ISmass + P1IS + RPIS - ISIRP <= 0:
+            ISIRP = ISmass + P1IS + RPIS
+        elif ISmassdeficit < 0 and numHH >= 2:
+            ISIRP += min(ISmass + P1IS + RPIS - ISIRP, -ISmassdeficit)
+
+        if (P1HH + H1HH + ISIRP) == 0 or (pP1 * P1HH + pH1 * H1HH + pIS * ISIRP) == 0:
+            weightedprice = 0
+            percapbirths = 0
+            percapbirths_k[:] = 0
+        else:
+            weightedprice = (
+                pP1 * P1HH + pH1 * H1HH + pIS * ISIRP + pEE * EEHHmass
+            ) / (P1HH + H1HH + ISIRP + EEHHmass)
+            for k in range(classes):
+                percapbirths_k[k] = max(
+                    p.etaa_trend[i, k] - etab * sqrt(W / weightedprice)
+                    + p.sigmab * p.epsilonb[i, k] * sqrt(1),
+                    0,
+                )
+            percapbirths = _class_total(percapbirths_k, alfa)
+
+        # Next state
+        if P1 == 0:
+            P1H1demand = 0
+            P1ISdemand = 0
+            P1HHdemand = 0
+            HHdemand_k[:, 0] = 0
+
+        P1H1massdeficit_next = P1H1massdeficit + P1H1 - P1H1demand
+        P1ISmassdeficit_next = P1ISmassdeficit + P1IS - P1ISdemand
+        P1HHmassdeficit_next = P1HHmassdeficit + P1HH - P1HHdemand * numHH
+        P1massdeficit_next = (
+            P1H1massdeficit_next + P1ISmassdeficit_next + P1HHmassdeficit_next
+        )
+
+        if H1 == 0:
+            H1HHdemand = 0
+            HHdemand_k[:, 1] = 0
+
+        H1massdeficit_next = H1massdeficit + H1HH - H1HHdemand * numHH
+
+        for k in range(classes):
+            HH_k_next[k] = HH_next * p.f2pe[k]
+
+        ISmass_next = ISmass + P1IS + RPIS - ISIRP
+        ISmassdeficit_next = ISmassdeficit + ISIRP - ISHHflow
+
+        IRP_next = IRP - IRPP2 - IRPP3 + p.RPIRP + ISIRP - IRPRP + EEIRP
+        IIRP_next = p.RPIRP + ISIRP + EEIRP
+        DIRP_next = IRPP2 + IRPP3 + IRPRP
+
+        RP_next = stockRP - (RPP1 + RPP2 + RPP3) - p.RPIRP - RPIS
+        INRP_next = stockRP
+        DRP_next = RPP1 + RPP2 + RPP3 + p.RPIRP + RPIS
+
+        ERP_next = ERP - EEIRP
+        EE_next = EE + ERPEE - EEIRP
+
+        for k in range(classes):
+            gap = percapmass_k[k] - p.idealpercapmass
+            numHH_k_next[k] = max(
+                numHH_k[k]
+                + _ceil(percapbirths_k[k] * numHH_k[k])
+                - _ceil(mHH_k[k] * numHH_k[k])
+                - _ceil(numHH_k[k] * (p.phi - p.phi_k[k]) * (gap * gap)),
+                1,
+            )
+            percapmass_k_next[k] = HH_k_next[k] / numHH_k_next[k]
+        numHH_next = max(
+            numHH
+            + _ceil(percapbirths * numHH)
+            - _ceil(mHH * numHH)
+            - _ceil(
+                numHH * (p.phi - p.phi_k[0]) * (percapmass - p.idealpercapmass) ** two
+            ),
+            1,
+        )
+        percapmass_next = _class_total(percapmass_k_next, alfa)
+
+        # GHG emissions, summed in the order of Parameters.yGHGstb
+        yGHG = (
+            P1, H1, numHH, P1production, H1production, ISproduction,
+            EEproduction, P2, P3, RP,
+        )
+        emissions = 0.0
+        for k in range(len(yGHG)):
+            emissions += yGHG[k] * p.GtCO2eq[k]
+        CO2eq_next = CO2eq + emissions * p.ppmCO2eq
+
+        # Results of the step, in FLOW_NAMES and STATE_NAMES order
+        flows = (
+            P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+            H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+            ISIRP, RPP1, RPP2, RPP3, RPIS, IRPP2, IRPP3, IRPRP, P1HHdemand,
+            H1HHdemand, ISHHdemand, P1ISdemand, RPISdemand, P1production,
+            H1production, ISproduction, pP1, pH1, pIS, percapbirths,
+            weightedprice, W, W_k[0], W_k[1], HHdemand_k[0, 0], HHdemand_k[1, 0],
+            HHdemand_k[0, 1], HHdemand_k[1, 1], HHdemand_k[0, 2],
+            HHdemand_k[1, 2], HHdemand_k[0, 3], HHdemand_k[1, 3], pEE,
+            EEHHdemand, EEHHtotdemand, EEISdemand, EEproduction, EEHHmass,
+            EEIRP, percapbirths_k[0], percapbirths_k[1], mHH_k[0], mHH_k[1], EMF,
+            np.rint(EMF * numHH), gRPP1, gRPP2, gRPP3, mHH, aa, bb, cc, dd, ee,
+            ff,
+        )
+        state = (
+            P1_next, P2_next, P3_next, H1_next, H2_next, H3_next, C1_next,
+            C2_next, HH_next, ISmass_next, RP_next, IRP_next, numHH_next,
+            percapmass_next, P1H1massdeficit_next, P1ISmassdeficit_next,
+            P1HHmassdeficit_next, H1massdeficit_next, ISmassdeficit_next,
+            numHH_k_next[0], numHH_k_next[1], HH_k_next[0], HH_k_next[1],
+            ERP_next, EE_next,
+            CO2eq_next, temp_next, IP1_next, DP1_next, IP2_next, DP2_next,
+            IP3_next, DP3_next, IH1_next, DH1_next, IH2_next, DH2_next,
+            IH3_next, DH3_next, IC1_next, DC1_next, IC2_next, DC2_next,
+            IH3_next, DH3_next, IIRP_next, DIRP_next, INRP_next, DRP_next,
+        )
+        for k in range(len(flows)):
+            x[step, k] = flows[k]
+        for k in range(len(state)):
+            y[k, i + 1] = state[k]
+        # Classes 3 .. K, grouped by name after the two-class layout (see
+        # `flow_names` and `state_names`)
+        extra = classes - 2
+        for k in range(2, classes):
+            x[step, flow_columns + k - 2] = W_k[k]
+            for j in range(4):
+                x[step, flow_columns + (j + 1) * extra + k - 2] = HHdemand_k[k, j]
+            x[step, flow_columns + 5 * extra + k - 2] = percapbirths_k[k]
+            x[step, flow_columns + 6 * extra + k - 2] = mHH_k[k]
+            y[state_rows + k - 2, i + 1] = numHH_k_next[k]
+            y[state_rows + extra + k - 2, i + 1] = HH_k_next[k]
+        # ERP is zeroed when the pool runs out, also at the previous index
+        y[_ERP, i] = ERP
+
+        # The last step is computed twice from the same state
+        if step < time - 2:
+            (P1, P2, P3, H1, H2, H3, C1, C2, HH, ISmass, RP, IRP, numHH,
+             percapmass, P1H1massdeficit, P1ISmassdeficit, P1HHmassdeficit,
+             H1massdeficit, ISmassdeficit, P1massdeficit, ERP, EE, CO2eq,
+             temp) = (
+                P1_next, P2_next, P3_next, H1_next, H2_next, H3_next,
+                C1_next, C2_next, HH_next, ISmass_next, RP_next, IRP_next,
+                numHH_next, percapmass_next, P1H1massdeficit_next,
+                P1ISmassdeficit_next, P1HHmassdeficit_next,
+                H1massdeficit_next, ISmassdeficit_next, P1massdeficit_next,
+                ERP_next, EE_next, CO2eq_next, temp_next,
+            )
+            # The class buffers of the next state become the current ones
+            numHH_k, numHH_k_next = numHH_k_next, numHH_k
+            percapmass_k, percapmass_k_next = percapmass_k_next, percapmass_k
+
+
+def _read_parameters(source):
+    return {
+        node.attr
+        for node in ast.walk(ast.parse(source))
+        if isinstance(node, ast.Attribute)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == "p"
+    }
+
+
+# Parameters the kernel and the graph read, as one typed record
+KernelParameters = namedtuple(
+    "KernelParameters",
+    sorted(
+        _read_parameters(inspect.getsource(getattr(_run, "py_func", _run)))
+        | _read_parameters(_graph.source)
+    ),
+)
+
+
+def kernel_parameters(params):
+    """The values of a scalar `Parameters` set the kernel reads, as float64."""
+    return KernelParameters(*(
+        float(value) if np.ndim(value) == 0
+        else np.ascontiguousarray(value, dtype=np.float64)
+        for value in (getattr(params, name) for name in KernelParameters._fields)
+    ))
+
+
+def run_steps(params, x, y, first: int = 0, values: dict = None, EEIRP: float = None):
+    """
+    Step a scalar run in the compiled kernel, in place of `GSSEMModel.steps`.
+
+    The time loop is compiled by Numba over float64 values when it is
+    installed, the first call of a process paying the compilation; otherwise
+    the same loop runs as plain Python. Either way it follows the scalar
+    engine operation by operation, which `tests/test_jit.py` checks for
+    several household classes, noise and checkpoints (and
+    `python main.py regression jit` against the reference run).
+
+    Parameters:
+    - params (Parameters): Scalar parameter set of the run.
+    - x, y (ndarray): Flow matrix (time, 77) and state matrix (49, time)
+      (`flow_names` and `state_names` layouts for K > 2 classes), with the
+      state at index `first` filled in.
+    - first (int): First step, e.g. the index of a checkpoint.
+    - values (dict): Carried state at `first` by `CARRIED_NAMES`; the
+      initial values of `params` by default.
+    - EEIRP (float): EEIRP of the step before `first` (see `Checkpoint`).
+    """
+    if values is None:
+        values = {name: getattr(params, name) for name in CARRIED_NAMES}
+    _run(
+        kernel_parameters(params),
+        first,
+        tuple(
+            float(value) if np.ndim(value) == 0 else np.array(value, dtype=float)
+            for value in (values[name] for name in CARRIED_NAMES)
+        ),
+        0.0 if EEIRP is None else float(EEIRP),
+        np.asarray(x),
+        np.asarray(y),
+        2.0,
+    )
@@ -1,6 +1,60 @@
-from math import exp, log, sqrt, ceil
+from math import exp, sqrt, ceil
+import os
+from time import perf_counter
 import numpy as np
+from src.models.graph import compile_graph
 from src.models.parameters import Parameters
+from src.models.trajectory import STATE_INDEX, Step, Trajectory, class_rows, state_names
+from src.utils.cache import parameter_hash
+from src.utils.profiling import PhaseProfile
+
+# State carried by the time loop from one step to the next; numHH_k and
+# percapmass_k hold one value per household class
+CARRIED_NAMES = (
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "ISmass", "RP", "IRP",
+    "numHH", "percapmass", "P1H1massdeficit", "P1ISmassdeficit",
+    "P1HHmassdeficit", "H1massdeficit", "ISmassdeficit", "P1massdeficit",
+    "numHH_k", "percapmass_k", "ERP", "EE", "CO2eq", "temp",
+)
+
+
+def class_weights(numHH_k):
+    """
+    Weighting factors for total population variables: the share of each
+    household class in the initial households, shape (K,) or (K, N).
+    """
+    return numHH_k / np.cumsum(numHH_k, axis=0)[-1]
+
+
+def class_total(values, alfa):
+    """
+    Total of per-class values (first axis) weighted by the factors `alfa`.
+
+    The classes are added one after the other (`np.sum` adds pairwise), so
+    two classes give value1 * alfa1 + value2 * alfa2 as in the original model
+    and every engine adds in the same order.
+    """
+    return np.cumsum(values * alfa, axis=0)[-1]
+
+
+def household_demands(p, pP1, pH1, pIS, pEE):
+    """
+    Per-household demands for P1, H1, IS and EE before clipping at zero.
+
+    The demand equations are linear in the prices, with coefficients folded
+    into `p.HHdemand_coefficients` when the parameters are built, so each
+    demand is c0 + c1 pP1 + c2 pH1 + c3 pIS + c4 pEE. The terms are added in
+    the order of the scalar loop and element by element (a batched matmul
+    rounds differently depending on the number of members), so every member
+    of an ensemble computes the same demands whatever the batch it runs in.
+    Returns an array of shape (4,) or (4, N).
+    """
+    coefficients = p.HHdemand_coefficients
+    prices = np.broadcast_arrays(pP1, pH1, pIS, pEE)
+    if coefficients.ndim == 2 and prices[0].ndim:
+        coefficients = coefficients[..., np.newaxis]
+    c0, c1, c2, c3, c4 = np.moveaxis(coefficients, 1, 0)
+    return c0 + c1 * pP1 + c2 * pH1 + c3 * pIS + c4 * pEE
 
 
 class GSSEMModel:
@@ -10,14 +64,19 @@ class GSSEMModel:
     concepts from Kotecha's work.
     """
 
-    def __init__(self, time: int = 100):
+    def __init__(self, time: int = 100, overrides: dict = None, forcing=None):
         """
         Parameters:
         - time (int): Simulation time period.
+        - overrides (dict): Optional parameter values replacing the defaults
+          (see `Parameters`).
+        - forcing (Forcing): Optional exogenous series added at every step
+          (see `src/models/forcing.py`).
         """
 
         # Initialize model parameters
-        self.params = Parameters(time)
+        self.params = Parameters(time, overrides)
+        self.forcing = forcing
         print("Model parameters initialized. For details, see src/models/parameters.py")
 
     def simulation_docs(self):
@@ -81,100 +140,278 @@ class GSSEMModel:
 
         print(docs)
 
-    def run_simulation(self):
-        # x = np.zeros(self.params.time)
-        x = []
-        y = []
+    def run_simulation(self, dtype=np.float64, start=None, profile=False,
+                       out_dir="results", cache=None, stop=None, backend="python"):
+        """
+        Run the simulation over the specified time period.
+
+        Consumes `steps()` and writes each step into one preallocated
+        `Trajectory` (also kept as `self.trajectory`). With `out_dir` the
+        storage is a pair of memory-mapped files, `x_results.npy` and
+        `y_results.npy`, written as the run goes; otherwise it stays in memory.
 
-        for i in range(0, self.params.time):
-            if i == self.params.time - 1:
-                i = self.params.time - 2
-            # Weighting factors for total population variables
-            alfa1 = self.params.numHH1[0] / (
-                self.params.numHH1[0] + self.params.numHH2[0]
+        Parameters:
+        - dtype: Storage precision, np.float64 (default) or np.float32. The
+          computation itself always runs in double precision.
+        - start (Checkpoint): Resume from a snapshot. The time axis keeps its
+          absolute indices; steps before the snapshot are left as NaN.
+        - profile (bool): Time each phase of the loop and count the balancing
+          branches taken; the `PhaseProfile` is kept as `self.profile` and
+          `self.profile.report()` gives the structured report.
+        - out_dir (str): Directory of the result files, or None to keep the
+          results in memory only.
+        - cache (RunCache): Look the run up by its `parameter_hash` first; on a
+          hit the stored (read-only) trajectory is returned without stepping
+          the model, and written to `out_dir` as usual. New runs are added.
+          Resumed runs are never cached, and a hit leaves `self.profile` None.
+        - stop (StopCriteria): End the run early (see `steps`); the steps
+          after `self.stop_time` are left as NaN. Such runs are not cached.
+        - backend (str): "python" steps the model with `steps()`; "jit" runs
+          the time loop compiled by Numba (see `src/models/jit.py`), about a
+          hundred times faster, and falls back to `steps()` when Numba is
+          not installed. The jit backend takes no `profile`, `stop` or
+          forcing.
+
+        Returns:
+        - Trajectory: Flows (time, 77) and states (49, time), accessible by
+          name; `x, y = model.run_simulation()` still gives the matrices.
+        """
+        if backend not in ("python", "jit"):
+            raise ValueError(f"Unknown backend {backend!r}, use 'python' or 'jit'")
+        if backend == "jit" and (profile or stop is not None or self.forcing is not None):
+            raise ValueError(
+                "The jit backend runs without profile, stop criteria or forcing"
+            )
+        if backend == "jit":
+            from src.models import jit
+
+            if not jit.NUMBA:
+                backend = "python"
+
+        key = None
+        if cache is not None and start is None and stop is None and self.forcing is None:
+            key = parameter_hash(self.params, type(self).__name__, dtype)
+            hit = cache.get(key)
+            if hit is not None:
+                self.trajectory = hit
+                self.profile = None
+                self.stop_reason, self.stop_time = None, self.params.time - 1
+                if out_dir is not None:
+                    os.makedirs(out_dir, exist_ok=True)
+                    hit.save(
+                        os.path.join(out_dir, "x_results.npy"),
+                        os.path.join(out_dir, "y_results.npy"),
+                    )
+                return hit
+
+        if out_dir is None:
+            self.trajectory = Trajectory.allocate(
+                self.params.time, dtype=dtype, classes=self.params.classes
+            )
+        else:
+            os.makedirs(out_dir, exist_ok=True)
+            self.trajectory = Trajectory.create(
+                os.path.join(out_dir, "x_results.npy"),
+                os.path.join(out_dir, "y_results.npy"),
+                self.params.time,
+                dtype=dtype,
+                classes=self.params.classes,
             )
-            alfa2 = self.params.numHH2[0] / (
-                self.params.numHH1[0] + self.params.numHH2[0]
+        x = self.trajectory.flows
+        y = self.trajectory.states
+        if start is None:
+            y[:, 0] = self.params.initial_state()
+        else:
+            x[:start.index] = np.nan
+            y[:, :start.index] = np.nan
+            y[:, start.index] = start.state
+
+        self.profile = PhaseProfile() if profile else None
+        if backend == "jit":
+            self.stop_reason, self.stop_time = None, self.params.time - 1
+            jit.run_steps(self.params, x, y, *self._start(start))
+        else:
+            for record in self.steps(start, self.profile, stop):
+                x[record.step] = record.flows
+                y[:, record.index] = record.state
+                y[STATE_INDEX["ERP"], record.index - 1] = record.ERP
+        if self.stop_reason is not None:
+            x[self.stop_time:] = np.nan
+            y[:, self.stop_time + 1:] = np.nan
+
+        self.trajectory.flush()
+        if cache is not None and stop is None:
+            cache.put(key, self.trajectory)
+        return self.trajectory
+
+    def _start(self, start):
+        """
+        First step, carried state (by `CARRIED_NAMES`) and EEIRP of a run.
+
+        Resuming from a checkpoint also continues its noise stream in the
+        parameters; EEIRP is None for a run from the initial state.
+        """
+        if start is None:
+            return 0, {name: getattr(self.params, name) for name in CARRIED_NAMES}, None
+        if not 0 <= start.index < self.params.time - 1:
+            raise ValueError(
+                f"Checkpoint at index {start.index} is outside the horizon "
+                f"of {self.params.time} steps"
             )
+        classes = self.params.classes
+        values = dict(zip(state_names(classes), start.state.tolist()))
+        # Aggregates that are not rows of y, rebuilt as the loop builds them
+        values["P1massdeficit"] = (
+            values["P1H1massdeficit"]
+            + values["P1ISmassdeficit"]
+            + values["P1HHmassdeficit"]
+        )
+        values["numHH_k"] = start.state[class_rows("numHH", classes)]
+        values["percapmass_k"] = (
+            start.state[class_rows("HH", classes)] / values["numHH_k"]
+        )
+        start.apply_noise(self.params)
+        return start.index, values, float(start.EEIRP)
+
+    def steps(self, start=None, profile=None, stop=None):
+        """
+        Advance the simulation one step at a time.
+
+        A generator over the time loop that yields a `Step` record per time
+        step, holding the 77 flows of the step and the 49 state values at the
+        next time index (same order as the columns of x and the rows of y).
+        Nothing is retained between steps, so memory use is constant unless
+        the caller keeps the records; stopping the iteration stops the run.
 
+        Parameters:
+        - start (Checkpoint): Resume from a snapshot instead of the initial
+          state; the first step computes index `start.index + 1`.
+        - profile (PhaseProfile): Accumulate the wall time of each phase
+          (demographics, pricing, demand, flows, rebalancing, demographic
+          update, ghg, recording) and counts of the balancing branches taken.
+          The time spent by the caller between steps counts as recording.
+          When omitted the only cost is one flag test per phase and branch.
+        - stop (StopCriteria): End the run at the first state that meets one
+          of the criteria; the reason and time index are kept as
+          `self.stop_reason` and `self.stop_time` (None and time - 1 for a
+          run that reaches its horizon).
+        The `forcing` of the model, when given, is read step by step.
+        The ecosystem passes come from the model graph (`graph.py`); the other
+        sections are mirrored in `GSSEMEnsemble._step` and `jit._run`.
+        """
+        timed = profile is not None
+        forcing = self.forcing
+        graph = compile_graph(self.params)
+        self.stop_reason = None
+        self.stop_time = self.params.time - 1
+        first, values, EEIRP = self._start(start)
+        if start is not None:
+            ERPEE = EEIRP
+        if stop is not None:
+            stop.reset(self.params.initial_state() if start is None else start.state)
+
+        # Household demand coefficients, as Python floats for the scalar loop
+        demand_rows = self.params.HHdemand_coefficients.tolist()
+
+        # Household classes, computed as arrays with one entry per class:
+        # weighting factors, mortality (and its total) and births noise of
+        # every time index, split of the P1, H1, IS and EE demands (one column
+        # each) and healthcare factors (phi - phi_k, zero for the poorest class)
+        classes = self.params.classes
+        alfa = class_weights(self.params.numHH_k)
+        mHH_rates = (
+            self.params.mHH_trend + self.params.sigmam * self.params.epsilonm * sqrt(1)
+        )
+        mHH_totals = class_total(mHH_rates.T, alfa[:, np.newaxis]).tolist()
+        births_noise = self.params.sigmab * self.params.epsilonb * sqrt(1)
+        demand_shares = np.array(
+            [self.params.f2pc, self.params.f2pc, self.params.f2pd, self.params.f2pd]
+        ).T
+        phi_gap = self.params.phi - self.params.phi_k
+        phi_gap1 = float(phi_gap[0])
+
+        # Current state, carried from one step to the next
+        (P1, P2, P3, H1, H2, H3, C1, C2, HH, ISmass, RP, IRP, numHH, percapmass,
+         P1H1massdeficit, P1ISmassdeficit, P1HHmassdeficit, H1massdeficit,
+         ISmassdeficit, P1massdeficit, numHH_k, percapmass_k, ERP, EE, CO2eq,
+         temp) = (values[name] for name in CARRIED_NAMES)
+
+        tick = perf_counter() if timed else None
+        for step in range(first, self.params.time):
+            i = step
+            if i == self.params.time - 1:
+                i = self.params.time - 2
             # Demographic params due current trends (2014)
-            mHH1 = (
-                -3.25 * log(i + 55) + 20.536
-            ) / 1000 + self.params.sigmam * self.params.epsilonm1[i] * sqrt(1)
-            mHH2 = (
-                -0.0103 * (i + 55) + 9.4329
-            ) / 1000 + self.params.sigmam * self.params.epsilonm2[i] * sqrt(1)
-            aa = mHH1
-            bb = mHH2
-            mHH = mHH1 * alfa1 + mHH2 * alfa2
+            mHH_k = mHH_rates[i]
+            mHH = mHH_totals[i]
+            etaa_k = self.params.etaa_trend[i]
+            if forcing is not None:
+                forced = forcing.at(i)
+                mHH_k = mHH_k + forced.mHH
+                mHH = float(class_total(mHH_k, alfa))
+                etaa_k = etaa_k + forced.etaa
+            aa = mHH_k[0]
+            bb = mHH_k[1]
             cc = mHH
-            etaa1 = (41.975 * exp(-0.013 * (i + 55)) + 3) / 1000
-            etab1 = self.params.etab
-            etaa2 = (20.831 * exp(-0.012 * (i + 55)) + 3) / 1000
-            etab2 = self.params.etab
+            etab = self.params.etab
 
             # RPP1 RPP2 RPP3 MATERIAL FLOW as a function of temperature
             # Plants
             gRPP1 = self.params.gRPP1p * exp(
-                -((self.params.temp[i] - self.params.tempo) ** 2) / 100
+                -((temp - self.params.tempo) ** 2) / 100
             )
             gRPP2 = self.params.gRPP2p * exp(
-                -((self.params.temp[i] - self.params.tempo) ** 2) / 100
+                -((temp - self.params.tempo) ** 2) / 100
             )
             gRPP3 = self.params.gRPP3p * exp(
-                -((self.params.temp[i] - self.params.tempo) ** 2) / 100
+                -((temp - self.params.tempo) ** 2) / 100
             )
 
             # Humans
             mHH = -(
-                mHH * exp(-((self.params.temp[i] - self.params.tempo) ** 2) / 100)
+                mHH * exp(-((temp - self.params.tempo) ** 2) / 100)
             ) + (2.0 * mHH)
 
             # Assigning values for further calculations
-            dd = mHH1
-            ee = mHH2
+            dd = mHH_k[0]
+            ee = mHH_k[1]
             ff = mHH
 
             # -----TEMPERATURE CALCULATION-----
-            self.params.atemp[i + 1] = 0.010008 * self.params.CO2eq[i] - 3.21675
-            self.params.temp[i + 1] = self.params.tempo + self.params.atemp[i + 1]
+            atemp_next = 0.010008 * CO2eq - 3.21675
+            temp_next = self.params.tempo + atemp_next
+            if forcing is not None:
+                temp_next = temp_next + forced.temp
+
+            if timed:
+                tick = profile.lap("demographics", tick)
 
             # I. Economic calculations
-            W1 = max(
-                self.params.aw1
-                + self.params.cw1
-                * (
-                    self.params.ISbar
-                    - (self.params.ISmassdeficit[i] + self.params.ISmass[i])
-                )
-                / (self.params.theta + self.params.lambda_)
-                - self.params.dw1 * self.params.numHH[i],
-                0,
-            )
-            W2 = max(
-                self.params.aw2
-                + self.params.cw2
+            W_k = np.maximum(
+                self.params.aw_k
+                + self.params.cw_k
                 * (
                     self.params.ISbar
-                    - (self.params.ISmassdeficit[i] + self.params.ISmass[i])
+                    - (ISmassdeficit + ISmass)
                 )
                 / (self.params.theta + self.params.lambda_)
-                - self.params.dw2 * self.params.numHH[i],
+                - self.params.dw_k * numHH,
                 0,
             )
-            W = W1 * alfa1 + W2 * alfa2
+            W = float(class_total(W_k, alfa))
 
-            # Economic Mobility Factor
+            # Economic Mobility Factor, bounded by the poorest and the
+            # richest class
             EMF = self.params.psi * (
-                (self.params.Wgid - W * self.params.numHH[i]) / self.params.Wgid
+                (self.params.Wgid - W * numHH) / self.params.Wgid
             )
-            if EMF * self.params.numHH[i] > self.params.numHH1[i]:
-                EMF = self.params.numHH1[i] / self.params.numHH[i]
-            if EMF * self.params.numHH[i] < (-self.params.numHH2[i]):
-                EMF = self.params.numHH2[i] / self.params.numHH[i]
+            if EMF * numHH > numHH_k[0]:
+                EMF = float(numHH_k[0]) / numHH
+            if EMF * numHH < (-numHH_k[-1]):
+                EMF = float(numHH_k[-1]) / numHH
 
                 # Pricing and Production calculations
-            if self.params.P1[i] == 0:
+            if P1 == 0:
                 pP1 = 0
                 P1production = 0
             else:
@@ -183,7 +420,7 @@ class GSSEMModel:
                     + self.params.bP1 * W
                     - self.params.cP1
                     * (
-                        (self.params.P1massdeficit[i] + self.params.P1[i])
+                        (P1massdeficit + P1)
                         - self.params.P1bar
                     ),
                     0,
@@ -193,13 +430,13 @@ class GSSEMModel:
                     - self.params.bP1p * W
                     - self.params.cP1p
                     * (
-                        (self.params.P1massdeficit[i] + self.params.P1[i])
+                        (P1massdeficit + P1)
                         - self.params.P1bar
                     ),
                     0,
                 )
 
-            if self.params.H1[i] == 0:
+            if H1 == 0:
                 pH1 = 0
                 H1production = 0
             else:
@@ -208,7 +445,7 @@ class GSSEMModel:
                     + self.params.bH1 * W
                     - self.params.cH1
                     * (
-                        (self.params.H1massdeficit[i] + self.params.H1[i])
+                        (H1massdeficit + H1)
                         - self.params.H1bar
                     ),
                     0,
@@ -218,13 +455,13 @@ class GSSEMModel:
                     - self.params.bH1p * W
                     - self.params.cH1p
                     * (
-                        (self.params.H1massdeficit[i] + self.params.H1[i])
+                        (H1massdeficit + H1)
                         - self.params.H1bar
                     ),
                     0,
                 )
 
-            if self.params.HH[i] == 0 or self.params.numHH[i] < 20:
+            if HH == 0 or numHH < 20:
                 pIS = 0
                 ISproduction = 0
             else:
@@ -234,7 +471,7 @@ class GSSEMModel:
                     + self.params.cIS
                     * (
                         self.params.ISbar
-                        - (self.params.ISmassdeficit[i] + self.params.ISmass[i])
+                        - (ISmassdeficit + ISmass)
                     )
                     / (self.params.theta + self.params.lambda_),
                     0,
@@ -245,27 +482,30 @@ class GSSEMModel:
                     + self.params.cISp
                     * (
                         self.params.ISbar
-                        - (self.params.ISmassdeficit[i] + self.params.ISmass[i])
+                        - (ISmassdeficit + ISmass)
                     )
                     / (self.params.theta + self.params.lambda_),
                     0,
                 )
 
-            if self.params.HH[i] == 0 or self.params.numHH[i] < 20:
+            if HH == 0 or numHH < 20:
                 pEE = 0
             else:
                 pEE = max(
                     self.params.aEE
                     + self.params.bEE * W
-                    + (self.params.cEE / self.params.ERP[i]),
+                    + (self.params.cEE / ERP),
                     0,
                 )
 
+            if timed:
+                tick = profile.lap("pricing", tick)
+
                 # II. Demanda
             if (
-                self.params.H1[i] == 0
-                or self.params.HH[i] == 0
-                or self.params.numHH[i] < 20
+                H1 == 0
+                or HH == 0
+                or numHH < 20
             ):
                 P1H1demand = 0
                 P2H1 = 0
@@ -276,7 +516,7 @@ class GSSEMModel:
                     - self.params.fP1H1 * pP1
                     - self.params.gP1H1
                     * (
-                        (self.params.H1massdeficit[i] + self.params.H1[i])
+                        (H1massdeficit + H1)
                         - self.params.H1bar
                     ),
                     0,
@@ -284,418 +524,88 @@ class GSSEMModel:
                 P2H1 = self.params.khat
 
                 # Demand calculations for P1HH, H1HH, and ISHH
-            if self.params.HH[i] == 0 or self.params.numHH[i] < 20:
+            if HH == 0 or numHH < 20:
                 P1HHdemand = 0
                 H1HHdemand = 0
                 ISHHdemand = 0
                 EEHHdemand = 0
             else:
-                P1HHdemand = (
-                    max(
-                        (
-                            1
-                            / (
-                                -1
-                                + self.params.zP1HH
-                                + self.params.zH1HH
-                                + self.params.zISHH
-                            )
-                        )
-                        * (
-                            -self.params.dP1HH
-                            - self.params.mP1HH * pH1
-                            - self.params.nP1HH * pIS
-                            + self.params.kP1HH * pP1
-                            - self.params.dH1HH * self.params.zP1HH
-                            - self.params.dISHH * self.params.zP1HH
-                            + self.params.mH1HH * pH1 * self.params.zP1HH
-                            - self.params.mISHH * pH1 * self.params.zP1HH
-                            - self.params.nH1HH * pIS * self.params.zP1HH
-                            + self.params.nISHH * pIS * self.params.zP1HH
-                            - self.params.kH1HH * pP1 * self.params.zP1HH
-                            + self.params.dP1HH * self.params.zH1HH
-                            + self.params.mP1HH * pH1 * self.params.zH1HH
-                            + self.params.nP1HH * pIS * self.params.zH1HH
-                            - self.params.kP1HH * pP1 * self.params.zH1HH
-                            + self.params.dP1HH * self.params.zISHH
-                            + self.params.mP1HH * pH1 * self.params.zISHH
-                            + self.params.nP1HH * pIS * self.params.zISHH
-                            - self.params.kP1HH * pP1 * self.params.zISHH
-                        ),
-                        0,
-                    )
-                    * 50
-                )
-
-                H1HHdemand = (
-                    max(
-                        (
-                            1
-                            / (
-                                -1
-                                + self.params.zP1HH
-                                + self.params.zH1HH
-                                + self.params.zISHH
-                            )
-                        )
-                        * (
-                            -self.params.dH1HH
-                            + self.params.mH1HH * pH1
-                            - self.params.nH1HH * pIS
-                            - self.params.kH1HH * pP1
-                            + self.params.dH1HH * self.params.zP1HH
-                            - self.params.mH1HH * pH1 * self.params.zP1HH
-                            + self.params.nH1HH * pIS * self.params.zP1HH
-                            + self.params.kH1HH * pP1 * self.params.zP1HH
-                            - self.params.dISHH * self.params.zH1HH
-                            - self.params.dP1HH * self.params.zH1HH
-                            - self.params.mISHH * pH1 * self.params.zH1HH
-                            - self.params.mP1HH * pH1 * self.params.zH1HH
-                            + self.params.nISHH * pIS * self.params.zH1HH
-                            - self.params.nP1HH * pIS * self.params.zH1HH
-                            - self.params.kISHH * pP1 * self.params.zH1HH
-                            + self.params.kP1HH * pP1 * self.params.zH1HH
-                            + self.params.dH1HH * self.params.zISHH
-                            - self.params.mH1HH * pH1 * self.params.zISHH
-                            + self.params.nH1HH * pIS * self.params.zISHH
-                            + self.params.kH1HH * pP1 * self.params.zISHH
-                        ),
-                        0,
-                    )
-                    * 50
-                )
-
-                ISHHdemand = (
-                    max(
-                        -(
-                            (
-                                self.params.dISHH
-                                + self.params.mISHH * pH1
-                                - self.params.nISHH * pIS
-                                + self.params.kISHH * pP1
-                                - self.params.dISHH * self.params.zP1HH
-                                - self.params.mISHH * pH1 * self.params.zP1HH
-                                + self.params.nISHH * pIS * self.params.zP1HH
-                                - self.params.kISHH * pP1 * self.params.zP1HH
-                                - self.params.dISHH * self.params.zH1HH
-                                - self.params.mISHH * pH1 * self.params.zH1HH
-                                + self.params.nISHH * pIS * self.params.zH1HH
-                                - self.params.kISHH * pP1 * self.params.zH1HH
-                                + self.params.dH1HH * self.params.zISHH
-                                + self.params.dP1HH * self.params.zISHH
-                                - self.params.mH1HH * pH1 * self.params.zISHH
-                                + self.params.mP1HH * pH1 * self.params.zISHH
-                                + self.params.nH1HH * pIS * self.params.zISHH
-                                + self.params.nP1HH * pIS * self.params.zISHH
-                                + self.params.kH1HH * pP1 * self.params.zISHH
-                                - self.params.kP1HH * pP1 * self.params.zISHH
-                            )
-                            / (
-                                -1
-                                + self.params.zP1HH
-                                + self.params.zH1HH
-                                + self.params.zISHH
-                            )
-                        ),
-                        0,
-                    )
-                    * 50
-                )
-
-                EEHHdemand = (
-                    max(
-                        -(
-                            (
-                                self.params.dEEHH
-                                + self.params.mEEHH * pH1
-                                - self.params.nEEHH * pEE
-                                + self.params.kEEHH * pP1
-                                - self.params.dEEHH * self.params.zP1HH
-                                - self.params.mEEHH * pH1 * self.params.zP1HH
-                                + self.params.nEEHH * pEE * self.params.zP1HH
-                                - self.params.kEEHH * pP1 * self.params.zP1HH
-                                - self.params.dEEHH * self.params.zH1HH
-                                - self.params.mEEHH * pH1 * self.params.zH1HH
-                                + self.params.nEEHH * pEE * self.params.zH1HH
-                                - self.params.kEEHH * pP1 * self.params.zH1HH
-                                + self.params.dH1HH * self.params.zEEHH
-                                + self.params.dP1HH * self.params.zEEHH
-                                - self.params.mH1HH * pH1 * self.params.zEEHH
-                                + self.params.mP1HH * pH1 * self.params.zEEHH
-                                + self.params.nH1HH * pEE * self.params.zEEHH
-                                + self.params.nP1HH * pEE * self.params.zEEHH
-                                + self.params.kH1HH * pP1 * self.params.zEEHH
-                                - self.params.kP1HH * pP1 * self.params.zEEHH
-                            )
-                            / (
-                                -1
-                                + self.params.zP1HH
-                                + self.params.zH1HH
-                                + self.params.zEEHH
-                            )
-                        ),
-                        0,
-                    )
-                    * 50
+                # Folded demand equations (see `household_demands`), as a
+                # matrix-vector product over plain floats
+                P1HHdemand, H1HHdemand, ISHHdemand, EEHHdemand = (
+                    max(c0 + c1 * pP1 + c2 * pH1 + c3 * pIS + c4 * pEE, 0) * 50
+                    for c0, c1, c2, c3, c4 in demand_rows
                 )
 
-                # Demand scaling
-            P1HHdemand1 = P1HHdemand * self.params.f2pc[0]
-            P1HHdemand2 = P1HHdemand * self.params.f2pc[1]
-            H1HHdemand1 = H1HHdemand * self.params.f2pc[0]
-            H1HHdemand2 = H1HHdemand * self.params.f2pc[1]
-            ISHHdemand1 = ISHHdemand * self.params.f2pd[0]
-            ISHHdemand2 = ISHHdemand * self.params.f2pd[1]
-            EEHHdemand1 = EEHHdemand * self.params.f2pd[0]
-            EEHHdemand2 = EEHHdemand * self.params.f2pd[1]
-
-            P1HHdemand = P1HHdemand1 * alfa1 + P1HHdemand2 * alfa2
-            H1HHdemand = H1HHdemand1 * alfa1 + H1HHdemand2 * alfa2
-            ISHHdemand = ISHHdemand1 * alfa1 + ISHHdemand2 * alfa2
-            EEHHdemand = EEHHdemand1 * alfa1 + EEHHdemand2 * alfa2
+                # Demand scaling, one row per class and one column per
+                # demand (P1, H1, IS, EE)
+            HHdemand_k = demand_shares * np.array(
+                [P1HHdemand, H1HHdemand, ISHHdemand, EEHHdemand], dtype=float
+            )
+            P1HHdemand, H1HHdemand, ISHHdemand, EEHHdemand = class_total(
+                HHdemand_k, alfa[:, np.newaxis]
+            ).tolist()
 
             # Energy demands
-            EEHHtotdemand = EEHHdemand * self.params.numHH[i]
+            EEHHtotdemand = EEHHdemand * numHH
             EEISdemand = ISproduction * self.params.gammaEEIS
 
             # Labor flows for P1H2 and H1C2
-            if self.params.P1[i] == 0 or self.params.H2[i] == 0:
+            if P1 == 0 or H2 == 0:
                 P1H2 = 0
             else:
                 P1H2 = max(
                     (
-                        gRPP1 * self.params.P1[i] * self.params.RP[i]
-                        - self.params.mP1 * self.params.P1[i]
+                        gRPP1 * P1 * RP
+                        - self.params.mP1 * P1
                         - P1production
                     ),
                     0,
                 )
 
-            if self.params.H1[i] == 0 or self.params.C1[i] == 0:
+            if H1 == 0 or C1 == 0:
                 H1C1 = 0
             else:
                 H1C1 = max(
                     (
                         P1H1demand
                         + P2H1
-                        - self.params.mH1 * self.params.H1[i]
+                        - self.params.mH1 * H1
                         - H1production
                     ),
                     0,
                 )
 
                 # If there are no humans, consumption of P1H2 and H1C1 is natural (Lokta-Volterra)
-            if self.params.HH[i] == 0 or self.params.numHH[i] < 20:
-                P1H2 = self.params.gP1H2 * self.params.P1[i] * self.params.H2[i]
-                H1C1 = self.params.gH1C1 * self.params.H1[i] * self.params.C1[i]
+            if HH == 0 or numHH < 20:
+                P1H2 = self.params.gP1H2 * P1 * H2
+                H1C1 = self.params.gH1C1 * H1 * C1
 
             P1ISdemand = self.params.theta * ISproduction
             RPISdemand = self.params.lambda_ * ISproduction
 
-            # III. Calculate all but next state, according to system equations.
-
-            # P1
-            P1RP = max(self.params.mP1 * self.params.P1[i], 0)
-            RPP1 = max(gRPP1 * self.params.P1[i] * self.params.RP[i], 0)
-            P1H1 = P1H1demand
-            P1IS = P1ISdemand
-            P1HH = P1HHdemand * self.params.numHH[i]
-
-            if self.params.P1[i] + RPP1 - P1RP - P1H2 - P1H1 - P1HH - P1IS < 0:
-                if self.params.P1[i] + RPP1 - P1RP < 0:
-                    P1RP = self.params.P1[i] + RPP1
-                    P1H2 = 0
-                    P1H1 = 0
-                    P1HH = 0
-                    P1IS = 0
-                else:
-                    totP1demand = P1H2 + P1H1 + P1HH + P1IS
-                    P1avail = self.params.P1[i] + RPP1 - P1RP
-                    P1H2 = P1avail * P1H2 / totP1demand
-                    P1H1 = P1avail * P1H1 / totP1demand
-                    P1HH = P1avail * P1HH / totP1demand
-                    P1IS = P1avail - (P1H2 + P1H1 + P1HH)
-            else:
-                if self.params.P1massdeficit[i] < 0:
-                    P1surplus = min(
-                        self.params.P1[i] + RPP1 - P1RP - P1H2 - P1H1 - P1HH - P1IS,
-                        -self.params.P1massdeficit[i],
-                    )
-                    P1H1 += (
-                        P1surplus
-                        * self.params.P1H1massdeficit[i]
-                        / self.params.P1massdeficit[i]
-                    )
-                    P1IS += (
-                        P1surplus
-                        * self.params.P1ISmassdeficit[i]
-                        / self.params.P1massdeficit[i]
-                    )
-                    P1HH += (
-                        P1surplus
-                        * self.params.P1HHmassdeficit[i]
-                        / self.params.P1massdeficit[i]
-                    )
-
-                    # P2
-            P2H2 = self.params.gP2H2 * self.params.P2[i] * self.params.H2[i]
-            P2H3 = self.params.gP2H3 * self.params.P2[i] * self.params.H3[i]
-            P2RP = max(self.params.mP2 * self.params.P2[i], 0)
-            RPP2 = max(gRPP2 * self.params.RP[i] * self.params.P2[i], 0)
-            IRPP2 = max(self.params.rIRPP2 * self.params.P2[i] * self.params.IRP[i], 0)
-            P3RP = max(self.params.mP3 * self.params.P3[i], 0)
-            P3H3 = self.params.gP3H3 * self.params.P3[i] * self.params.H3[i]
-            RPP3 = max(gRPP3 * self.params.RP[i] * self.params.P3[i], 0)
-            IRPP3 = max(self.params.rIRPP3 * self.params.P3[i] * self.params.IRP[i], 0)
-
-            if self.params.IRP[i] <= 0:
-                IRPP2 = 0
-                IRPP3 = 0
-            elif (
-                self.params.IRP[i]
-                - IRPP2
-                - IRPP3
-                - max(self.params.IRP[i] * self.params.mIRPRP, 0)
-                + self.params.RPIRP
-                < 0
-            ):
-                if self.params.P2[i] != 0:
-                    IRPP2 = (
-                        self.params.rIRPP2
-                        * (
-                            self.params.IRP[i]
-                            - max(self.params.IRP[i] * self.params.mIRPRP, 0)
-                            + self.params.RPIRP
-                        )
-                        / (self.params.rIRPP2 + self.params.rIRPP3)
-                    )
-                if self.params.P3[i] != 0:
-                    IRPP3 = (
-                        self.params.rIRPP3
-                        * (
-                            self.params.IRP[i]
-                            - max(self.params.IRP[i] * self.params.mIRPRP, 0)
-                            + self.params.RPIRP
-                        )
-                        / (self.params.rIRPP2 + self.params.rIRPP3)
-                    )
-
-            if (
-                self.params.P2[i] + IRPP2 + RPP2 - P2RP - P2H2 - P2H3 - P2H1
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.P2[i] + IRPP2 + RPP2 - P2RP
-                    < self.params.belownoreproduction
-                ):
-                    P2RP = self.params.P2[i] + IRPP2 + RPP2
-                    P2H2 = 0
-                    P2H3 = 0
-                    P2H1 = 0
-                else:
-                    totP2demand = P2H2 + P2H3 + P2H1
-                    P2avail = self.params.P2[i] + IRPP2 + RPP2 - P2RP
-                    P2H2 = P2H2 * P2avail / totP2demand
-                    P2H3 = P2H3 * P2avail / totP2demand
-                    P2H1 = P2avail - (P2H2 + P2H3)
+            if timed:
+                tick = profile.lap("demand", tick)
 
-                    # P3
-            if (
-                self.params.P3[i] + IRPP3 + RPP3 - P3RP - P3H3
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.P3[i] + IRPP3 + RPP3 - P3RP
-                    < self.params.belownoreproduction
-                ):
-                    P3RP = self.params.P3[i] + IRPP3 + RPP3
-                    P3H3 = 0
-                else:
-                    totP3demand = P3H3
-                    P3avail = self.params.P3[i] + IRPP3 + RPP3 - P3RP
-                    P3H3 = P3H3 * P3avail / totP3demand
-
-                    # H1
-            H1RP = max(self.params.mH1 * self.params.H1[i], 0)
-            H1HH = H1HHdemand * self.params.numHH[i]
-            if self.params.H1[i] + P1H1 + P2H1 - H1RP - H1C1 - H1HH < 0:
-                if self.params.H1[i] + P1H1 + P2H1 - H1RP < 0:
-                    H1RP = self.params.H1[i] + P1H1 + P2H1
-                    H1C1 = 0
-                    H1HH = 0
-                else:
-                    totH1demand = H1C1 + H1HH
-                    H1avail = self.params.H1[i] + P1H1 + P2H1 - H1RP
-                    H1C1 = H1avail * H1C1 / totH1demand
-                    H1HH = H1avail - H1C1
-            else:
-                if self.params.H1massdeficit[i] < 0:
-                    H1HH += min(
-                        self.params.H1[i] + P1H1 + P2H1 - H1RP - H1C1 - H1HH,
-                        -self.params.H1massdeficit[i],
-                    )
+            # III. Calculate all but next state, according to system equations.
 
-                    # H2
-            H2C1 = self.params.gH2C1 * self.params.C1[i] * self.params.H2[i]
-            H2C2 = self.params.gH2C2 * self.params.H2[i] * self.params.C2[i]
-            H2RP = max(self.params.mH2 * self.params.H2[i], 0)
-            if (
-                self.params.H2[i] + P1H2 + P2H2 - H2RP - H2C1 - H2C2
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.H2[i] + P1H2 + P2H2 - H2RP
-                    < self.params.belownoreproduction
-                ):
-                    H2RP = self.params.H2[i] + P1H2 + P2H2
-                    H2C1 = 0
-                    H2C2 = 0
-                else:
-                    totH2demand = H2C1 + H2C2
-                    H2avail = self.params.H2[i] + P1H2 + P2H2 - H2RP
-                    H2C1 = H2C1 * H2avail / totH2demand
-                    H2C2 = H2avail - H2C1
-
-                    # H3
-            H3RP = max(self.params.mH3 * self.params.H3[i], 0)
-            H3C2 = self.params.gH3C2 * self.params.H3[i] * self.params.C2[i]
-            if (
-                self.params.H3[i] + P2H3 + P3H3 - H3RP - H3C2
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.H3[i] + P2H3 + P3H3 - H3RP
-                    < self.params.belownoreproduction
-                ):
-                    H3RP = self.params.H3[i] + P2H3 + P3H3
-                    H3C2 = 0
-                else:
-                    totH3demand = H3C2
-                    H3avail = self.params.H3[i] + P2H3 + P3H3 - H3RP
-                    H3C2 = H3C2 * H3avail / totH3demand
-
-                    # C1
-            C1RP = max(self.params.mC1 * self.params.C1[i], 0)
-            if self.params.C1[i] + H1C1 + H2C1 - C1RP < self.params.belownoreproduction:
-                C1RP = self.params.C1[i] + H1C1 + H2C1
-
-                # C2
-            C2RP = max(self.params.mC2 * self.params.C2[i], 0)
-            if self.params.C2[i] + H2C2 + H3C2 - C2RP < self.params.belownoreproduction:
-                C2RP = self.params.C2[i] + H2C2 + H3C2
-
-                # HH
-            HHRP = (
-                ceil(self.params.mHH * self.params.numHH[i]) * self.params.percapmass[i]
+            # Ecosystem flows, balanced against their compartments; the arguments
+            # follow graph.BALANCE_INPUTS
+            (P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+             H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+             RPP1, RPP2, RPP3, IRPP2, IRPP3) = graph.balance(
+                P1, P2, P3, H1, H2, H3, C1, C2, HH, RP, IRP, numHH, percapmass,
+                gRPP1, gRPP2, gRPP3, P1H1demand, P1ISdemand, P1HHdemand,
+                H1HHdemand, P1H2, P2H1, H1C1, P1massdeficit, P1H1massdeficit,
+                P1HHmassdeficit, P1ISmassdeficit, H1massdeficit, ceil,
+                profile=profile,
             )
-            if HHRP > (self.params.HH[i] + P1HH + H1HH):
-                HHRP = self.params.HH[i] + P1HH + H1HH
 
                 # RP
-            IRPRP = max(self.params.IRP[i] * self.params.mIRPRP, 0)
+            IRPRP = max(IRP * self.params.mIRPRP, 0)
             RPIS = min(self.params.lambda_ * P1IS / self.params.theta, RPISdemand)
             stockRP = (
-                self.params.RP[i]
+                RP
                 + P1RP
                 + P2RP
                 + P3RP
@@ -712,6 +622,8 @@ class GSSEMModel:
             if (
                 stockRP - (RPP1 + RPP2 + RPP3) - self.params.RPIRP - RPIS
             ) <= 0 and self.params.RPIRP == 0:
+                if timed:
+                    profile.branch("III RP rationed")
                 RPdemand = RPP1 + RPP2 + RPP3 + RPISdemand
                 RPP1 = RPP1 * stockRP / RPdemand
                 RPP2 = RPP2 * stockRP / RPdemand
@@ -723,332 +635,140 @@ class GSSEMModel:
             P1IS = min(self.params.theta * RPIS / self.params.lambda_, P1IS)
 
             # ERP
-            if self.params.ERP[i] > 0:
+            if ERP > 0:
                 EEproduction = EEHHtotdemand + EEISdemand
                 EEHHmass = EEHHtotdemand * self.params.gammaEEIRP
                 ERPEE = EEproduction * self.params.gammaEEIRP
-                if (self.params.ERP[i] - ERPEE) < 0:
-                    ERPEE = self.params.ERP[i]
-                    self.params.ERP[i] = 0
+                if (ERP - ERPEE) < 0:
+                    if timed:
+                        profile.branch("III ERP exhausted")
+                    ERPEE = ERP
+                    ERP = 0
                 EEIRP = ERPEE
             else:
+                if timed:
+                    profile.branch("III ERP empty")
                 pEE = 0
                 EEproduction = 0
                 EEHHmass = 0
-                self.params.ERPIRP = 0
                 EEHHtotdemand = 0
                 EEISdemand = 0
                 EEHHdemand = 0
 
-                # III.A. make checks again, to balance flows
-
-                # P1
-            if self.params.P1[i] + RPP1 - P1RP - P1H2 - P1H1 - P1HH - P1IS < 0:
-                if self.params.P1[i] + RPP1 - P1RP < 0:
-                    P1RP = self.params.P1[i] + RPP1
-                    P1H2 = 0
-                    P1H1 = 0
-                    P1HH = 0
-                    P1IS = 0
-                else:
-                    totP1demand = P1H2 + P1H1 + P1HH + P1IS
-                    P1avail = self.params.P1[i] + RPP1 - P1RP
-                    P1H2 = P1avail * P1H2 / totP1demand
-                    P1H1 = P1avail * P1H1 / totP1demand
-                    P1HH = P1avail * P1HH / totP1demand
-                    P1IS = P1avail - (P1H2 + P1H1 + P1HH)
-            else:
-                if self.params.P1massdeficit[i] < 0:
-                    P1surplus = min(
-                        self.params.P1[i] + RPP1 - P1RP - P1H2 - P1H1 - P1HH - P1IS,
-                        -self.params.P1massdeficit[i],
-                    )
-                    P1H1 += (
-                        P1surplus
-                        * self.params.P1H1massdeficit[i]
-                        / self.params.P1massdeficit[i]
-                    )
-                    P1IS += (
-                        P1surplus
-                        * self.params.P1ISmassdeficit[i]
-                        / self.params.P1massdeficit[i]
-                    )
-                    P1HH += (
-                        P1surplus
-                        * self.params.P1HHmassdeficit[i]
-                        / self.params.P1massdeficit[i]
-                    )
-
-                    # P2
-            if self.params.IRP[i] <= 0:
-                IRPP2 = 0
-                IRPP3 = 0
-            elif (
-                self.params.IRP[i]
-                - IRPP2
-                - IRPP3
-                - max(self.params.IRP[i] * self.params.mIRPRP, 0)
-                + self.params.RPIRP
-                < 0
-            ):
-                if self.params.P2[i] != 0:
-                    IRPP2 = (
-                        self.params.rIRPP2
-                        * (
-                            self.params.IRP[i]
-                            - max(self.params.IRP[i] * self.params.mIRPRP, 0)
-                            + self.params.RPIRP
-                        )
-                        / (self.params.rIRPP2 + self.params.rIRPP3)
-                    )
-                if self.params.P3[i] != 0:
-                    IRPP3 = (
-                        self.params.rIRPP3
-                        * (
-                            self.params.IRP[i]
-                            - max(self.params.IRP[i] * self.params.mIRPRP, 0)
-                            + self.params.RPIRP
-                        )
-                        / (self.params.rIRPP2 + self.params.rIRPP3)
-                    )
-
-            if (
-                self.params.P2[i] + IRPP2 + RPP2 - P2RP - P2H2 - P2H3 - P2H1
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.P2[i] + IRPP2 + RPP2 - P2RP
-                    < self.params.belownoreproduction
-                ):
-                    P2RP = self.params.P2[i] + IRPP2 + RPP2
-                    P2H2 = 0
-                    P2H3 = 0
-                    P2H1 = 0
-                else:
-                    totP2demand = P2H2 + P2H3 + P2H1
-                    P2avail = self.params.P2[i] + IRPP2 + RPP2 - P2RP
-                    P2H2 = P2H2 * P2avail / totP2demand
-                    P2H3 = P2H3 * P2avail / totP2demand
-                    P2H1 = P2avail - (P2H2 + P2H3)
-
-                    # P3
-            if (
-                self.params.P3[i] + IRPP3 + RPP3 - P3RP - P3H3
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.P3[i] + IRPP3 + RPP3 - P3RP
-                    < self.params.belownoreproduction
-                ):
-                    P3RP = self.params.P3[i] + IRPP3 + RPP3
-                    P3H3 = 0
-                else:
-                    totP3demand = P3H3
-                    P3avail = self.params.P3[i] + IRPP3 + RPP3 - P3RP
-                    P3H3 = P3H3 * P3avail / totP3demand
-
-                    # H1
-            if self.params.H1[i] + P1H1 + P2H1 - H1RP - H1C1 - H1HH < 0:
-                if self.params.H1[i] + P1H1 + P2H1 - H1RP < 0:
-                    H1RP = self.params.H1[i] + P1H1 + P2H1
-                    H1C1 = 0
-                    H1HH = 0
-                else:
-                    totH1demand = H1C1 + H1HH
-                    H1avail = self.params.H1[i] + P1H1 + P2H1 - H1RP
-                    H1C1 = H1avail * H1C1 / totH1demand
-                    H1HH = H1avail - H1C1
-            else:
-                if self.params.H1massdeficit[i] < 0:
-                    H1HH += min(
-                        self.params.H1[i] + P1H1 + P2H1 - H1RP - H1C1 - H1HH,
-                        -self.params.H1massdeficit[i],
-                    )
-
-                    # H2
-            if (
-                self.params.H2[i] + P1H2 + P2H2 - H2RP - H2C1 - H2C2
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.H2[i] + P1H2 + P2H2 - H2RP
-                    < self.params.belownoreproduction
-                ):
-                    H2RP = self.params.H2[i] + P1H2 + P2H2
-                    H2C1 = 0
-                    H2C2 = 0
-                else:
-                    totH2demand = H2C1 + H2C2
-                    H2avail = self.params.H2[i] + P1H2 + P2H2 - H2RP
-                    H2C1 = H2C1 * H2avail / totH2demand
-                    H2C2 = H2avail - H2C1
-
-                    # H3
-            if (
-                self.params.H3[i] + P2H3 + P3H3 - H3RP - H3C2
-                < self.params.belownoreproduction
-            ):
-                if (
-                    self.params.H3[i] + P2H3 + P3H3 - H3RP
-                    < self.params.belownoreproduction
-                ):
-                    H3RP = self.params.H3[i] + P2H3 + P3H3
-                    H3C2 = 0
-                else:
-                    totH3demand = H3C2
-                    H3avail = self.params.H3[i] + P2H3 + P3H3 - H3RP
-                    H3C2 = H3C2 * H3avail / totH3demand
-
-                    # C1
-            if self.params.C1[i] + H1C1 + H2C1 - C1RP < self.params.belownoreproduction:
-                C1RP = self.params.C1[i] + H1C1 + H2C1
-
-                # C2
-            if self.params.C2[i] + H2C2 + H3C2 - C2RP < self.params.belownoreproduction:
-                C2RP = self.params.C2[i] + H2C2 + H3C2
-
-                # HH
-            HHRP = (
-                ceil(self.params.mHH * self.params.numHH[i]) * self.params.percapmass[i]
+            if timed:
+                tick = profile.lap("flows", tick)
+
+                # III.A. make checks again, to balance flows, and update the
+                # compartments (arguments in graph.REBALANCE_INPUTS order)
+            (
+                (P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP, P3H3,
+                 H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP, C2RP, HHRP,
+                 RPP1, RPP2, RPP3, IRPP2, IRPP3),
+                (P1_next, IP1_next, DP1_next, P2_next, IP2_next, DP2_next, P3_next,
+                 IP3_next, DP3_next, H1_next, IH1_next, DH1_next, H2_next, IH2_next,
+                 DH2_next, H3_next, IH3_next, DH3_next, C1_next, IC1_next, DC1_next,
+                 C2_next, IC2_next, DC2_next, HH_next),
+            ) = graph.rebalance(
+                P1, P2, P3, H1, H2, H3, C1, C2, HH, IRP, numHH, percapmass,
+                P1RP, P1H1, P1H2, P1IS, P1HH, P2RP, P2H1, P2H2, P2H3, P3RP,
+                P3H3, H1RP, H1C1, H1HH, H2RP, H2C1, H2C2, H3RP, H3C2, C1RP,
+                C2RP, RPP1, RPP2, RPP3, IRPP2, IRPP3, P1massdeficit,
+                P1H1massdeficit, P1HHmassdeficit, P1ISmassdeficit,
+                H1massdeficit, ceil, profile=profile,
             )
-            if HHRP > (self.params.HH[i] + P1HH + H1HH):
-                HHRP = self.params.HH[i] + P1HH + H1HH
+
+            if timed:
+                tick = profile.lap("rebalancing", tick)
 
                 # IV. Demographic
 
             ISHHflow = max(
                 (self.params.theta + self.params.lambda_)
                 * ISHHdemand
-                * self.params.numHH[i],
+                * numHH,
                 0,
             )
             ISIRP = ISHHflow
-            if self.params.ISmass[i] + P1IS + RPIS - ISIRP <= 0:
-                ISIRP = self.params.ISmass[i] + P1IS + RPIS
+            if ISmass + P1IS + RPIS - ISIRP <= 0:
+                if timed:
+                    profile.branch("IV IS depleted")
+                ISIRP = ISmass + P1IS + RPIS
             else:
                 if (
-                    self.params.ISmassdeficit[i] < 0 and self.params.numHH[i] >= 2
+                    ISmassdeficit < 0 and numHH >= 2
                 ):  # if there is an accumulated deficit
+                    if timed:
+                        profile.branch("IV IS deficit repaid")
                     ISIRP += min(
-                        self.params.ISmass[i] + P1IS + RPIS - ISIRP,
-                        -self.params.ISmassdeficit[i],
+                        ISmass + P1IS + RPIS - ISIRP,
+                        -ISmassdeficit,
                     )
                     # only what you need to make up deficit
 
             if (P1HH + H1HH + ISIRP) == 0:
                 weightedprice = 0
                 percapbirths = 0
-                percapbirths1 = 0
-                percapbirths2 = 0
+                percapbirths_k = np.zeros(classes)
             elif (pP1 * P1HH + pH1 * H1HH + pIS * ISIRP) == 0:
                 weightedprice = 0
                 percapbirths = 0
-                percapbirths1 = 0
-                percapbirths2 = 0
+                percapbirths_k = np.zeros(classes)
             else:
                 weightedprice = (
                     pP1 * P1HH + pH1 * H1HH + pIS * ISIRP + pEE * EEHHmass
                 ) / (P1HH + H1HH + ISIRP + EEHHmass)
-                percapbirths1 = max(
-                    etaa1
-                    - etab1 * sqrt(W / weightedprice)
-                    + self.params.sigmab * self.params.epsilonb1[i] * sqrt(1),
+                percapbirths_k = np.maximum(
+                    etaa_k
+                    - etab * sqrt(W / weightedprice)
+                    + births_noise[i],
                     0,
                 )  # 2P-a
-                percapbirths2 = max(
-                    etaa2
-                    - etab2 * sqrt(W / weightedprice)
-                    + self.params.sigmab * self.params.epsilonb2[i] * sqrt(1),
-                    0,
-                )  # 2P-a
-                percapbirths = percapbirths1 * alfa1 + percapbirths2 * alfa2
+                percapbirths = float(class_total(percapbirths_k, alfa))
 
             # -----Next Step-----
-            # Update state variables for the next time step
+            # Update state variables for the next time step; the ecosystem
+            # compartments and HH were updated by graph.rebalance
 
-            self.params.P1[i + 1] = (
-                self.params.P1[i] + RPP1 - P1RP - P1H2 - P1H1 - P1HH - P1IS
-            )
-            self.params.IP1[i + 1] = RPP1
-            self.params.DP1[i + 1] = P1RP + P1H1 + P1H2 + P1HH + P1IS
-
-            if self.params.P1[i] == 0:
+            if P1 == 0:
                 P1H1demand = 0
                 P1ISdemand = 0
                 P1HHdemand = 0
-                P1HHdemand1 = 0
-                P1HHdemand2 = 0
+                HHdemand_k[:, 0] = 0
 
-            self.params.P1H1massdeficit[i + 1] = (
-                self.params.P1H1massdeficit[i] + P1H1 - P1H1demand
+            P1H1massdeficit_next = (
+                P1H1massdeficit + P1H1 - P1H1demand
             )
-            self.params.P1ISmassdeficit[i + 1] = (
-                self.params.P1ISmassdeficit[i] + P1IS - P1ISdemand
+            P1ISmassdeficit_next = (
+                P1ISmassdeficit + P1IS - P1ISdemand
             )
-            self.params.P1HHmassdeficit[i + 1] = (
-                self.params.P1HHmassdeficit[i]
+            P1HHmassdeficit_next = (
+                P1HHmassdeficit
                 + P1HH
-                - P1HHdemand * self.params.numHH[i]
-            )
-            self.params.P1massdeficit[i + 1] = (
-                self.params.P1H1massdeficit[i + 1]
-                + self.params.P1ISmassdeficit[i + 1]
-                + self.params.P1HHmassdeficit[i + 1]
+                - P1HHdemand * numHH
             )
-
-            self.params.P2[i + 1] = (
-                self.params.P2[i] + IRPP2 + RPP2 - P2RP - P2H2 - P2H3 - P2H1
+            P1massdeficit_next = (
+                P1H1massdeficit_next
+                + P1ISmassdeficit_next
+                + P1HHmassdeficit_next
             )
-            self.params.IP2[i + 1] = RPP2 + IRPP2
-            self.params.DP2[i + 1] = P2RP + P2H1 + P2H2 + P2H3
-
-            self.params.P3[i + 1] = self.params.P3[i] + IRPP3 + RPP3 - P3RP - P3H3
-            self.params.IP3[i + 1] = RPP3 + IRPP3
-            self.params.DP3[i + 1] = P3RP + P3H3
-
-            self.params.H1[i + 1] = self.params.H1[i] + P1H1 + P2H1 - H1RP - H1C1 - H1HH
-            self.params.IH1[i + 1] = P1H1 + P2H1
-            self.params.DH1[i + 1] = H1RP + H1C1 + H1HH
 
-            if self.params.H1[i] == 0:
+            if H1 == 0:
                 H1HHdemand = 0
-                H1HHdemand1 = 0
-                H1HHdemand2 = 0
+                HHdemand_k[:, 1] = 0
 
-            self.params.H1massdeficit[i + 1] = (
-                self.params.H1massdeficit[i] + H1HH - H1HHdemand * self.params.numHH[i]
+            H1massdeficit_next = (
+                H1massdeficit + H1HH - H1HHdemand * numHH
             )
 
-            self.params.H2[i + 1] = self.params.H2[i] + P1H2 + P2H2 - H2RP - H2C1 - H2C2
-            self.params.IH2[i + 1] = P1H2 + P2H2
-            self.params.DH2[i + 1] = H2RP + H2C1 + H2C2
-
-            self.params.H3[i + 1] = self.params.H3[i] + P2H3 + P3H3 - H3RP - H3C2
-            self.params.IH3[i + 1] = P2H3 + P3H3
-            self.params.DH3[i + 1] = H3RP + H3C2
-
-            self.params.C1[i + 1] = self.params.C1[i] + H1C1 + H2C1 - C1RP
-            self.params.IC1[i + 1] = H1C1 + H2C1
-            self.params.DC1[i + 1] = C1RP
+            HH_k_next = HH_next * self.params.f2pe  # 2P-e
 
-            self.params.C2[i + 1] = self.params.C2[i] + H2C2 + H3C2 - C2RP
-            self.params.IC2[i + 1] = H2C2 + H3C2
-            self.params.DC2[i + 1] = C2RP
-
-            self.params.HH[i + 1] = self.params.HH[i] + P1HH + H1HH - HHRP
-            self.params.IHH[i + 1] = P1HH + H1HH
-            self.params.DHH[i + 1] = HHRP
-
-            self.params.HH1[i + 1] = self.params.HH[i + 1] * self.params.f2pe[0]  # 2P-e
-            self.params.HH2[i + 1] = self.params.HH[i + 1] * self.params.f2pe[1]  # 2P-e
-
-            self.params.ISmass[i + 1] = self.params.ISmass[i] + P1IS + RPIS - ISIRP
-            self.params.ISmassdeficit[i + 1] = (
-                self.params.ISmassdeficit[i] + ISIRP - ISHHflow
+            ISmass_next = ISmass + P1IS + RPIS - ISIRP
+            ISmassdeficit_next = (
+                ISmassdeficit + ISIRP - ISHHflow
             )
 
-            self.params.IRP[i + 1] = (
-                self.params.IRP[i]
+            IRP_next = (
+                IRP
                 - IRPP2
                 - IRPP3
                 + self.params.RPIRP
@@ -1056,227 +776,227 @@ class GSSEMModel:
                 - IRPRP
                 + EEIRP
             )
-            self.params.IIRP[i + 1] = self.params.RPIRP + ISIRP + EEIRP
-            self.params.DIRP[i + 1] = IRPP2 + IRPP3 + IRPRP
+            IIRP_next = self.params.RPIRP + ISIRP + EEIRP
+            DIRP_next = IRPP2 + IRPP3 + IRPRP
 
-            self.params.RP[i + 1] = (
+            RP_next = (
                 stockRP - (RPP1 + RPP2 + RPP3) - self.params.RPIRP - RPIS
             )
-            self.params.INRP[i + 1] = stockRP
-            self.params.DRP[i + 1] = RPP1 + RPP2 + RPP3 + self.params.RPIRP + RPIS
-
-            self.params.ERP[i + 1] = self.params.ERP[i] - EEIRP  # En
-
-            self.params.EE[i + 1] = self.params.EE[i] + ERPEE - EEIRP  # En
-
-            self.params.numHH1[i + 1] = max(
-                self.params.numHH1[i]
-                + ceil(percapbirths1 * self.params.numHH1[i])
-                - ceil(mHH1 * self.params.numHH1[i])
-                - ceil(
-                    self.params.numHH1[i]
-                    * (self.params.phi - self.params.phi1)
-                    * (self.params.percapmass1[i] - self.params.idealpercapmass) ** 2
+            INRP_next = stockRP
+            DRP_next = RPP1 + RPP2 + RPP3 + self.params.RPIRP + RPIS
+
+            ERP_next = ERP - EEIRP  # En
+            if forcing is not None:
+                ERP_next = ERP_next + forced.ERP
+
+            EE_next = EE + ERPEE - EEIRP  # En
+
+            numHH_k_next = np.maximum(
+                numHH_k
+                + np.ceil(percapbirths_k * numHH_k)
+                - np.ceil(mHH_k * numHH_k)
+                - np.ceil(
+                    numHH_k
+                    * phi_gap
+                    * (percapmass_k - self.params.idealpercapmass) ** 2
                 ),
                 1,
             )
 
-            self.params.numHH2[i + 1] = max(
-                self.params.numHH2[i]
-                + ceil(percapbirths2 * self.params.numHH2[i])
-                - ceil(mHH2 * self.params.numHH2[i])
+            numHH_next = max(
+                numHH
+                + ceil(percapbirths * numHH)
+                - ceil(mHH * numHH)
                 - ceil(
-                    self.params.numHH2[i]
-                    * (self.params.phi - self.params.phi2)
-                    * (self.params.percapmass2[i] - self.params.idealpercapmass) ** 2
+                    numHH
+                    * phi_gap1
+                    * (percapmass - self.params.idealpercapmass) ** 2
                 ),
                 1,
             )
 
-            self.params.numHH[i + 1] = max(
-                self.params.numHH[i]
-                + ceil(percapbirths * self.params.numHH[i])
-                - ceil(mHH * self.params.numHH[i])
-                - ceil(
-                    self.params.numHH[i]
-                    * (self.params.phi - self.params.phi1)
-                    * (self.params.percapmass[i] - self.params.idealpercapmass) ** 2
-                ),
-                1,
-            )
+            percapmass_k_next = HH_k_next / numHH_k_next  # 2P-a
+            percapmass_next = float(class_total(percapmass_k_next, alfa))
 
-            self.params.percapmass1[i + 1] = (
-                self.params.HH1[i + 1] / self.params.numHH1[i + 1]
-            )  # 2P-a
-            self.params.percapmass2[i + 1] = (
-                self.params.HH2[i + 1] / self.params.numHH2[i + 1]
-            )  # 2P-a
-            self.params.percapmass[i + 1] = (
-                alfa1 * self.params.percapmass1[i + 1]
-                + alfa2 * self.params.percapmass2[i + 1]
-            )
+            if timed:
+                tick = profile.lap("demographic update", tick)
 
             yGHG = [
-                self.params.P1[i],
-                self.params.H1[i],
-                self.params.numHH[i],
+                P1,
+                H1,
+                numHH,
                 P1production,
                 H1production,
                 ISproduction,
                 EEproduction,
-                self.params.P2[i],
-                self.params.P3[i],
-                self.params.RP[i],
+                P2,
+                P3,
+                RP,
             ]
 
-            self.params.CO2eq[i + 1] = (
-                self.params.CO2eq[i]
+            CO2eq_next = (
+                CO2eq
                 + sum(yGHG * self.params.GtCO2eq) * self.params.ppmCO2eq
             )  # In ppm
-
-            # Store results for the current step
-            x.append(
-                [
-                    P1RP,
-                    P1H1,
-                    P1H2,
-                    P1IS,
-                    P1HH,
-                    P2RP,
-                    P2H1,
-                    P2H2,
-                    P2H3,
-                    P3RP,
-                    P3H3,
-                    H1RP,
-                    H1C1,
-                    H1HH,
-                    H2RP,
-                    H2C1,
-                    H2C2,
-                    H3RP,
-                    H3C2,
-                    C1RP,
-                    C2RP,
-                    HHRP,
-                    ISIRP,
-                    RPP1,
-                    RPP2,
-                    RPP3,
-                    RPIS,
-                    IRPP2,
-                    IRPP3,
-                    IRPRP,
-                    P1HHdemand,
-                    H1HHdemand,
-                    ISHHdemand,
-                    P1ISdemand,
-                    RPISdemand,
-                    P1production,
-                    H1production,
-                    ISproduction,
-                    pP1,
-                    pH1,
-                    pIS,
-                    percapbirths,
-                    weightedprice,
-                    W,
-                    W1,
-                    W2,
-                    P1HHdemand1,
-                    P1HHdemand2,
-                    H1HHdemand1,
-                    H1HHdemand2,
-                    ISHHdemand1,
-                    ISHHdemand2,
-                    EEHHdemand1,
-                    EEHHdemand2,
-                    pEE,
-                    EEHHdemand,
-                    EEHHtotdemand,
-                    EEISdemand,
-                    EEproduction,
-                    EEHHmass,
-                    EEIRP,
-                    percapbirths1,
-                    percapbirths2,
-                    mHH1,
-                    mHH2,
-                    EMF,
-                    round(EMF * self.params.numHH[i]),
-                    gRPP1,
-                    gRPP2,
-                    gRPP3,
-                    mHH,
-                    aa,
-                    bb,
-                    cc,
-                    dd,
-                    ee,
-                    ff,
-                ]
+            if forcing is not None:
+                CO2eq_next = CO2eq_next + forced.emissions * self.params.ppmCO2eq
+
+            if timed:
+                tick = profile.lap("ghg", tick)
+
+            # Results of the current step
+            flows = (
+                P1RP,
+                P1H1,
+                P1H2,
+                P1IS,
+                P1HH,
+                P2RP,
+                P2H1,
+                P2H2,
+                P2H3,
+                P3RP,
+                P3H3,
+                H1RP,
+                H1C1,
+                H1HH,
+                H2RP,
+                H2C1,
+                H2C2,
+                H3RP,
+                H3C2,
+                C1RP,
+                C2RP,
+                HHRP,
+                ISIRP,
+                RPP1,
+                RPP2,
+                RPP3,
+                RPIS,
+                IRPP2,
+                IRPP3,
+                IRPRP,
+                P1HHdemand,
+                H1HHdemand,
+                ISHHdemand,
+                P1ISdemand,
+                RPISdemand,
+                P1production,
+                H1production,
+                ISproduction,
+                pP1,
+                pH1,
+                pIS,
+                percapbirths,
+                weightedprice,
+                W,
+                W_k[0],
+                W_k[1],
+                *HHdemand_k[:2].T.ravel(),
+                pEE,
+                EEHHdemand,
+                EEHHtotdemand,
+                EEISdemand,
+                EEproduction,
+                EEHHmass,
+                EEIRP,
+                percapbirths_k[0],
+                percapbirths_k[1],
+                mHH_k[0],
+                mHH_k[1],
+                EMF,
+                round(EMF * numHH),
+                gRPP1,
+                gRPP2,
+                gRPP3,
+                mHH,
+                aa,
+                bb,
+                cc,
+                dd,
+                ee,
+                ff,
             )
+            state = (
+                P1_next,
+                P2_next,
+                P3_next,
+                H1_next,
+                H2_next,
+                H3_next,
+                C1_next,
+                C2_next,
+                HH_next,
+                ISmass_next,
+                RP_next,
+                IRP_next,
+                numHH_next,
+                percapmass_next,
+                P1H1massdeficit_next,
+                P1ISmassdeficit_next,
+                P1HHmassdeficit_next,
+                H1massdeficit_next,
+                ISmassdeficit_next,
+                numHH_k_next[0],
+                numHH_k_next[1],
+                HH_k_next[0],
+                HH_k_next[1],
+                ERP_next,
+                EE_next,
+                CO2eq_next,
+                temp_next,
+                IP1_next,
+                DP1_next,
+                IP2_next,
+                DP2_next,
+                IP3_next,
+                DP3_next,
+                IH1_next,
+                DH1_next,
+                IH2_next,
+                DH2_next,
+                IH3_next,
+                DH3_next,
+                IC1_next,
+                DC1_next,
+                IC2_next,
+                DC2_next,
+                IH3_next,
+                DH3_next,
+                IIRP_next,
+                DIRP_next,
+                INRP_next,
+                DRP_next,
+            )
+            if classes > 2:
+                # Classes 3 .. K follow the two-class layout (see `flow_names`)
+                flows += tuple(np.concatenate(
+                    [W_k[2:], HHdemand_k[2:].T.ravel(), percapbirths_k[2:], mHH_k[2:]]
+                ))
+                state += tuple(np.concatenate([numHH_k_next[2:], HH_k_next[2:]]))
+            if stop is not None and step < self.params.time - 1:
+                reason = stop.check(state)[0]
+                if reason:
+                    self.stop_reason, self.stop_time = reason, i + 1
+            yield Step(step, i + 1, flows, state, ERP)
+            if self.stop_reason is not None:
+                return
+
+            # The last step is computed twice from the same state (as in the
+            # original model), so the state only advances before that
+            if step < self.params.time - 2:
+                (P1, P2, P3, H1, H2, H3, C1, C2, HH, ISmass, RP, IRP, numHH,
+                 percapmass, P1H1massdeficit, P1ISmassdeficit, P1HHmassdeficit,
+                 H1massdeficit, ISmassdeficit, P1massdeficit, numHH_k,
+                 percapmass_k, ERP, EE, CO2eq, temp) = (
+                    P1_next, P2_next, P3_next, H1_next, H2_next, H3_next,
+                    C1_next, C2_next, HH_next, ISmass_next, RP_next, IRP_next,
+                    numHH_next, percapmass_next, P1H1massdeficit_next,
+                    P1ISmassdeficit_next, P1HHmassdeficit_next,
+                    H1massdeficit_next, ISmassdeficit_next, P1massdeficit_next,
+                    numHH_k_next, percapmass_k_next, ERP_next, EE_next,
+                    CO2eq_next, temp_next,
+                )
 
-        # Prepare final results for output
-        y = [
-            self.params.P1,
-            self.params.P2,
-            self.params.P3,
-            self.params.H1,
-            self.params.H2,
-            self.params.H3,
-            self.params.C1,
-            self.params.C2,
-            self.params.HH,
-            self.params.ISmass,
-            self.params.RP,
-            self.params.IRP,
-            self.params.numHH,
-            self.params.percapmass,
-            self.params.P1H1massdeficit,
-            self.params.P1ISmassdeficit,
-            self.params.P1HHmassdeficit,
-            self.params.H1massdeficit,
-            self.params.ISmassdeficit,
-            self.params.numHH1,
-            self.params.numHH2,
-            self.params.HH1,
-            self.params.HH2,
-            self.params.ERP,
-            self.params.EE,
-            self.params.CO2eq,
-            self.params.temp,
-            self.params.IP1,
-            self.params.DP1,
-            self.params.IP2,
-            self.params.DP2,
-            self.params.IP3,
-            self.params.DP3,
-            self.params.IH1,
-            self.params.DH1,
-            self.params.IH2,
-            self.params.DH2,
-            self.params.IH3,
-            self.params.DH3,
-            self.params.IC1,
-            self.params.DC1,
-            self.params.IC2,
-            self.params.DC2,
-            self.params.IH3,
-            self.params.DH3,
-            self.params.IIRP,
-            self.params.DIRP,
-            self.params.INRP,
-            self.params.DRP,
-        ]
-
-        # Save y and x to 2 files
-        # Convert y and x to numpy arrays for easy saving
-        x_array = np.array(x)
-        y_array = np.array([y])  # Wrap y in a list to ensure it has the correct shape
-
-        # Save x and y to files
-        np.save("results/x_results.npy", x_array)
-        np.save("results/y_results.npy", y_array)
-
-        return x, y
+            if timed:
+                tick = profile.lap("recording", tick)
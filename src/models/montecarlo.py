@@ -0,0 +1,191 @@
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.parameters import NOISE_NAMES, Parameters
+from src.utils.statistics import SUMMARY_NAMES
+
+
+class MemberNoise:
+    """
+    Ito noise draws of the given Monte Carlo members, drawn as the run reads
+    them.
+
+    Member k draws from its own `numpy.random.Generator`, seeded with
+    `SeedSequence(seed, spawn_key=(k,))` (the k-th child of
+    `SeedSequence(seed).spawn`), so its realization depends only on `seed`
+    and `k`, never on which other members are run alongside it. Its stream
+    holds, step after step, the draws of every class in `NOISE_NAMES` order.
+
+    Only one chunk of `chunk_size` steps is held at a time, shape
+    (chunk_size, 2, classes, len(members)), so the draws never take
+    O(time * n) memory. Going back to an earlier chunk redraws the streams
+    from the start. `series(name)` gives the (time, classes, members) view of
+    one noise term that `Parameters` takes as an override.
+    """
+
+    def __init__(self, seed: int, members, time: int, classes: int = 2,
+                 chunk_size: int = 128):
+        self.seed = seed
+        self.members = np.atleast_1d(members)
+        self.time = time
+        self.classes = classes
+        self.chunk_size = chunk_size
+        self._generators = None
+        self._next = 0
+        self._begin = 0
+        self._rows = np.empty((0, len(NOISE_NAMES), classes, len(self.members)))
+
+    def at(self, i: int):
+        """Draws of step i, shape (2, classes, len(members))."""
+        if not 0 <= i < self.time:
+            raise IndexError(f"Step {i} is outside the horizon of {self.time} steps")
+        offset = i - self._begin
+        if not 0 <= offset < len(self._rows):
+            self._load(i - i % self.chunk_size)
+            offset = i - self._begin
+        return self._rows[offset]
+
+    def series(self, name: str):
+        """The `NoiseSeries` of the noise term `name` (one of `NOISE_NAMES`)."""
+        return NoiseSeries(self, NOISE_NAMES.index(name))
+
+    def _load(self, begin):
+        # Continue the streams where the last chunk ended, or restart them
+        if self._generators is None or begin < self._next:
+            self._generators = [
+                np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(int(k),)))
+                for k in self.members
+            ]
+            self._next = 0
+        while self._next <= begin:
+            rows = min(self.chunk_size, self.time - self._next)
+            chunk = np.empty((rows, len(NOISE_NAMES), self.classes, len(self.members)))
+            for j, rng in enumerate(self._generators):
+                draws = rng.standard_normal((rows, self.classes, len(NOISE_NAMES)))
+                chunk[..., j] = draws.transpose(0, 2, 1)
+            self._begin, self._rows = self._next, chunk
+            self._next += rows
+
+    def __array__(self, dtype=None, copy=None):
+        draws = np.empty((self.time, len(NOISE_NAMES), self.classes, len(self.members)))
+        for begin in range(0, self.time, self.chunk_size):
+            self._load(begin)
+            draws[begin:begin + len(self._rows)] = self._rows
+        return draws.transpose(1, 0, 2, 3).astype(dtype or float, copy=False)
+
+
+class NoiseSeries:
+    """
+    One noise term of a `MemberNoise`, read like a (time, classes, members)
+    array: `series[i]` draws step i for every member, and
+    `series[..., columns]` selects members (as `GSSEMEnsemble` does when
+    members stop early) without redrawing. Any other index materializes the
+    whole series. `splice` gives a series that reads saved draws for some
+    steps instead, as when a run resumes from a `Checkpoint`.
+    """
+
+    streamed = True
+    ndim = 3
+
+    def __init__(self, noise, index, columns=None, spliced=None):
+        self.noise = noise
+        self.index = index
+        self.columns = columns
+        # (first step, draws) replacing the stream from that step on
+        self.spliced = spliced
+        members = len(noise.members) if columns is None else len(columns)
+        self.shape = (noise.time, noise.classes, members)
+
+    def splice(self, begin: int, draws):
+        """
+        The series with `draws` (steps, classes[, members]) in place of the
+        draws of steps begin .. begin + steps - 1; this one is left as it is.
+        """
+        return NoiseSeries(
+            self.noise, self.index, self.columns, (begin, np.array(draws, dtype=float))
+        )
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            if self.spliced is not None:
+                begin, draws = self.spliced
+                if 0 <= key - begin < len(draws):
+                    return draws[key - begin]
+            row = self.noise.at(int(key))[self.index]
+            return row if self.columns is None else row[:, self.columns]
+        if isinstance(key, tuple) and len(key) == 2 and key[0] is Ellipsis:
+            columns = np.arange(self.shape[-1])[key[1]]
+            spliced = self.spliced
+            if spliced is not None and spliced[1].ndim == 3:
+                spliced = (spliced[0], spliced[1][..., columns])
+            if self.columns is not None:
+                columns = self.columns[columns]
+            return NoiseSeries(self.noise, self.index, columns, spliced)
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        draws = np.asarray(self.noise)[self.index]
+        if self.columns is not None:
+            draws = draws[..., self.columns]
+        if self.spliced is not None:
+            begin, saved = self.spliced
+            draws[begin:begin + len(saved)] = saved[:len(draws) - begin]
+        return draws.astype(dtype or float, copy=False)
+
+
+def member_noise(seed: int, members, time: int, classes: int = 2):
+    """
+    Ito noise draws of the given Monte Carlo members as one array, e.g. to
+    replay or cache a realization of `monte_carlo` (see `MemberNoise`).
+
+    Returns:
+    - ndarray: Shape (2, time, classes, len(members)), in `NOISE_NAMES` order.
+    """
+    return np.asarray(MemberNoise(seed, members, time, classes))
+
+
+def monte_carlo(time: int = 100, n: int = 1000, seed: int = 0, names=SUMMARY_NAMES,
+                overrides: dict = None, members=None, statistics=None, forcing=None,
+                start=None):
+    """
+    Run Ito noise realizations as one batched ensemble and summarize them.
+
+    The Ito process is switched on (`Ito = 1`) and every member gets its own
+    noise stream (see `MemberNoise`), drawn a chunk of steps at a time. The
+    members are reduced step by step to streaming statistics while the
+    ensemble runs, so memory is O(n) for the current step and noise chunk
+    plus O(time) per summarized variable; no trajectory or full noise table
+    is kept.
+
+    Parameters:
+    - time (int): Simulation time period.
+    - n (int): Number of realizations, members 0 .. n - 1.
+    - seed (int): Root seed of the noise streams.
+    - names (tuple): Flows and states to summarize.
+    - overrides (dict): Parameter overrides shared by all members.
+    - members (array): Member indices to run instead of range(n), e.g. one
+      worker's share; each member reproduces its realization of the full run,
+      and the workers' results combine with `EnsembleStatistics.merge`.
+    - statistics (EnsembleStatistics): Accumulators to add to.
+    - forcing (Forcing): Optional exogenous series shared by all members.
+    - start (Checkpoint): Resume the realizations from a snapshot of the
+      same members (see `GSSEMEnsemble.steps`); its saved draws take the
+      place of the streams up to the end of its horizon.
+
+    Returns:
+    - EnsembleStatistics: Per-step mean, variance and quantiles, e.g.
+      `stats["temp"]["quantiles"]` for the 5/50/95% bands.
+    """
+    members = np.arange(n) if members is None else np.atleast_1d(members)
+    classes = Parameters(time, dict(overrides or {})).classes
+    noise = MemberNoise(seed, members, time, classes)
+    ensemble = GSSEMEnsemble(
+        time,
+        n=len(members),
+        overrides={
+            "Ito": 1,
+            **(overrides or {}),
+            **{name: noise.series(name) for name in NOISE_NAMES},
+        },
+        forcing=forcing,
+    )
+    return ensemble.run_statistics(names, statistics, start)
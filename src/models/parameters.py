@@ -1,100 +1,251 @@
 import numpy as np
+from src.models.trajectory import CLASS_STATE_NAMES, DUPLICATE_STATES, state_names
+
+# Ito noise draws of household mortality and births, one row per time step
+# and one column per household class, shape (time, K)
+NOISE_NAMES = ("epsilonm", "epsilonb")
+
+# Demographic trends of household mortality and births at every time index,
+# shape (time, K) or (time, K, N), tabulated on first use
+TREND_NAMES = ("mHH_trend", "etaa_trend")
+
+# Household class parameters, one value per class (poorest first), see
+# `Parameters.init_household_classes`
+CLASS_NAMES = (
+    "numHH_shares", "wage_shares", "P1H1demand_shares", "ISEEdemand_shares",
+    "HH_shares", "health_factors", "mHH_log", "mHH_slope", "mHH_base",
+    "etaa_scale", "etaa_rate",
+)
+
+
+def value_ndim(name: str):
+    """
+    Number of dimensions of a parameter value shared by all ensemble members:
+    2 for the noise draws (time, K), 1 for class parameters (K,) and 0
+    otherwise. A value given per member has one trailing axis more.
+    """
+    return 2 if name in NOISE_NAMES else 1 if name in CLASS_NAMES else 0
+
+
+def by_class(value):
+    """
+    Class values of shape (K,) or (K, N) as (K, 1) or (K, N), so that they
+    broadcast against the (N,) arrays of an ensemble.
+    """
+    value = np.asarray(value, dtype=float)
+    return value.reshape(len(value), -1)
+
+
+def _unbatched(value):
+    # Drop the member axis of a parameter set without member arrays
+    return value[..., 0] if value.shape[-1] == 1 else value
+
+
+def _per_class(value, factors):
+    """A scalar or (N,) value times class factors, shape (K,) or (K, N)."""
+    return _unbatched(np.reshape(value, (1, -1)) * by_class(factors))
+
+
+def _class_factors(numHH_shares, shares):
+    """
+    Per-household factors f_k of a quantity split among the classes.
+
+    Solves the system of the Two Populations modifications (2P) for K classes:
+    1) sum_k numHH_share_k f_k = 1 (the per-household total is kept)
+    2) numHH_share_1 f_1 - numHH_share_k f_k (share_1 / share_k) = 0 for
+       k = 2 .. K (class k receives `share_k` of the total)
+    Shares of shape (K,) or (K, N) give factors of the same shape.
+    """
+    population, shares = np.broadcast_arrays(by_class(numHH_shares), by_class(shares))
+    classes, members = population.shape
+    # Per-member systems are stacked along the first axis, (N, K, K)
+    A = np.zeros((members, classes, classes))
+    A[:, 0] = population.T
+    A[:, 1:, 0] = population[0, :, np.newaxis]
+    k = np.arange(1, classes)
+    A[:, k, k] = (-population[1:] * (shares[0] / shares[1:])).T
+    b = np.zeros(classes)
+    b[0] = 1
+    return _unbatched(np.moveaxis(np.linalg.inv(A).dot(b), -1, 0))
 
 
 class Parameters:
-    def __init__(self, time: int = 100):
+    """
+    Coefficients and initial state of the GSSEM model.
+
+    Only scalars (or (N,) arrays for an ensemble) are stored: state variables
+    such as `P1` or `RP` hold their initial value, and the per-step results
+    live in the `Trajectory` an engine allocates when a run starts. Household
+    class values are arrays with one entry per class, shape (K,) or (K, N).
+    The only per-step arrays are the demographic trends of the classes and
+    the Ito noise draws, both made on first use. The set is read-only once
+    built; pass `overrides` to change values.
+    """
+
+    def __init__(self, time: int = 100, overrides: dict = None):
         """
         Initialize the GSSEM model parameters and variables.
+
+        Parameters:
+        - time (int): Simulation time period.
+        - overrides (dict): Optional mapping of parameter name to value. Each
+          override is applied right after the group that defines it, so values
+          derived in later groups (e.g. `phi_k` from `phi`, `aEE` from
+          `aP1`) pick it up. Values may be NumPy arrays of shape (N,) to
+          describe an ensemble ((K, N) for the class parameters
+          `CLASS_NAMES`); for state variables (e.g. `P1`, `RP`) the override
+          sets the initial value. The Ito noise draws (`NOISE_NAMES`) may be
+          given as arrays of shape (time, K) or (time, K, N), or as streamed
+          `montecarlo.NoiseSeries`; otherwise they are drawn from the global
+          `np.random` state on first use.
         """
         self.time = time
-        # General parameters
-        self.init_general_parameters()
-        # Initial values for populations, resources, and other states
-        self.init_pop_res_states()
-        # Initial deficit values
-        self.init_deficits()
-        # Initial per capita mass and environmental variables
-        self.init_capita_mass_env_var()
-        # Initial inflow and outflow rates
-        self.init_inflows_outflows()
-        # Temperature parameters
-        self.init_temperature()
-        # Growth rates for plants
-        self.init_growth_rates_plants()
-        # Natural parameters
-        self.init_natural_parameters()
-        # Economic parameters
-        self.init_economic_parameters()
-        # Ito process parameters
-        self.init_ito_process()
-
-        # Add other initialization methods with idea model of other researches
-        # Initialize Society Type A - Ideal parameters
-        self.init_society_type_a()
-        # Energy parameters
-        self.init_energy_parameters()
-        # Economic mobility factors
-        self.init_economic_mobility_factors()
-        # Greenhouse gas emission parameters
-        self.init_greenhouse_gas_emissions()
+        overrides = dict(overrides or {})
+        init_groups = [
+            self.init_general_parameters,  # General parameters
+            self.init_pop_res_states,  # Initial values for populations, resources, and other states
+            self.init_deficits,  # Initial deficit values
+            self.init_capita_mass_env_var,  # Initial per capita mass and environmental variables
+            self.init_inflows_outflows,  # Initial inflow and outflow rates
+            self.init_temperature,  # Temperature parameters
+            self.init_growth_rates_plants,  # Growth rates for plants
+            self.init_natural_parameters,  # Natural parameters
+            self.init_economic_parameters,  # Economic parameters
+            self.init_ito_process,  # Ito process parameters
+            self.init_household_classes,  # Household classes and their shares
+            # Add other initialization methods with idea model of other researches
+            self.init_society_type_a,  # Initialize Society Type A - Ideal parameters
+            self.init_energy_parameters,  # Energy parameters
+            self.init_economic_mobility_factors,  # Economic mobility factors
+            self.init_greenhouse_gas_emissions,  # Greenhouse gas emission parameters
+            self.init_emission_factors,  # Emissions per mass unit, from the above
+            self.init_household_demand_coefficients,  # Folded household demand equations
+        ]
+        for init_group in init_groups:
+            defined = set(self.__dict__)
+            init_group()
+            for name in self.__dict__.keys() - defined:
+                if name in overrides:
+                    setattr(self, name, overrides.pop(name))
+
+        # Noise draws given up front, e.g. one realization per member of a
+        # Monte Carlo ensemble (shape (time, K) or (time, K, N)), or streamed
+        # step by step (see `montecarlo.NoiseSeries`)
+        for name in NOISE_NAMES:
+            if name in overrides:
+                value = overrides.pop(name)
+                if not getattr(value, "streamed", False):
+                    value = np.asarray(value, dtype=float)
+                setattr(self, name, value)
+
+        if overrides:
+            raise AttributeError(f"Unknown parameters: {sorted(overrides)}")
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, "_frozen", False):
+            raise AttributeError(
+                f"Parameters are read-only; pass {name!r} in overrides instead"
+            )
+        object.__setattr__(self, name, value)
+
+    def __getattr__(self, name):
+        # Only called for missing attributes: draw the Ito noise on first use,
+        # class by class (mortality, then births), so that two classes see the
+        # stream of the original epsilonm1, epsilonb1, epsilonm2, epsilonb2
+        if name in NOISE_NAMES:
+            draws = np.random.normal(0, 1, (self.classes, len(NOISE_NAMES), self.time))
+            for k, noise in enumerate(NOISE_NAMES):
+                if noise not in self.__dict__:
+                    object.__setattr__(self, noise, draws[:, k].T.copy())
+            return getattr(self, name)
+        if name in TREND_NAMES:
+            # Demographic params due current trends (2014) at every time
+            # index; the engines add the Ito noise
+            t = np.arange(self.time).reshape(-1, 1, 1) + 55
+            mHH_trend = (
+                by_class(self.mHH_log) * np.log(t)
+                + by_class(self.mHH_slope) * t
+                + by_class(self.mHH_base)
+            ) / 1000
+            etaa_trend = (
+                by_class(self.etaa_scale) * np.exp(by_class(self.etaa_rate) * t) + 3
+            ) / 1000
+            object.__setattr__(self, "mHH_trend", _unbatched(mHH_trend))
+            object.__setattr__(self, "etaa_trend", _unbatched(etaa_trend))
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def initial_state(self):
+        """Initial value of each row of the state matrix y (see `state_names`)."""
+        classes = {
+            f"{name}{k}": value
+            for name in CLASS_STATE_NAMES
+            for k, value in enumerate(getattr(self, f"{name}_k"), start=1)
+        }
+        return [
+            classes[name] if name in classes
+            else getattr(self, DUPLICATE_STATES.get(name, name))
+            for name in state_names(self.classes)
+        ]
 
     def init_general_parameters(self):
         """Initialize general model parameters."""
         self.Ito = 0  # Ito process activation flag
         self.Case = 3  # Case number
-        self.pais = 0  # Country identifier
+        self.pais = 0  # Country identifier (one per region of `GSSEMRegions`)
         self.belownoreproduction = 1e-4  # Reproduction threshold for natural ecosystems
 
     def init_pop_res_states(self):
         """Initialize initial values for populations, resources, and other states."""
-        self.P1 = [0.127639522] * self.time
-        self.P2 = [6.637479579] * self.time
-        self.P3 = [1.181396149] * self.time
-        self.H1 = [1.248945367] * self.time
-        self.H2 = [0.065892868] * self.time
-        self.H3 = [1.073417243] * self.time
-        self.C1 = [1.358944396] * self.time
-        self.C2 = [0.611883366] * self.time
-        self.HH = [0.4507] * self.time  # Human households
-        self.ISmass = [0.508187978] * self.time  # Industrial system mass
-        self.RP = [20.10894289] * self.time  # Resource pool
-        self.IRP = [0.881746274] * self.time  # Industrial resource pool
-        self.numHH = [1000] * self.time  # Number of households
+        self.P1 = 0.127639522
+        self.P2 = 6.637479579
+        self.P3 = 1.181396149
+        self.H1 = 1.248945367
+        self.H2 = 0.065892868
+        self.H3 = 1.073417243
+        self.C1 = 1.358944396
+        self.C2 = 0.611883366
+        self.HH = 0.4507  # Human households
+        self.ISmass = 0.508187978  # Industrial system mass
+        self.RP = 20.10894289  # Resource pool
+        self.IRP = 0.881746274  # Industrial resource pool
+        self.numHH = 1000  # Number of households
 
     def init_deficits(self):
         """Initialize initial deficit values."""
-        self.P1H1massdeficit = [0] * self.time
-        self.P1ISmassdeficit = [0] * self.time
-        self.P1HHmassdeficit = [0] * self.time
-        self.H1massdeficit = [0] * self.time
-        self.ISmassdeficit = [0] * self.time
-        self.P1massdeficit = [sum([0, 0, 0])] * self.time # Sum of all P1 deficits
+        self.P1H1massdeficit = 0
+        self.P1ISmassdeficit = 0
+        self.P1HHmassdeficit = 0
+        self.H1massdeficit = 0
+        self.ISmassdeficit = 0
+        self.P1massdeficit = sum([0, 0, 0]) # Sum of all P1 deficits
 
     def init_capita_mass_env_var(self):
         """Initial per capita mass and environmental variables"""
-        self.percapmass = [self.HH[0] / self.numHH[0]]  * self.time
-        self.ERP = [800] * self.time # Environmental resource potential
-        self.EE = [0] * self.time # Environmental efficiency
-        self.CO2eq = [300] * self.time # CO2 equivalent in ppm
+        self.percapmass = self.HH / self.numHH
+        self.ERP = 800 # Environmental resource potential
+        self.EE = 0 # Environmental efficiency
+        self.CO2eq = 300 # CO2 equivalent in ppm
 
     def init_inflows_outflows(self):
         """Initialize inflow and outflow rates for all compartments."""
-        self.IP1, self.DP1 = [0] * self.time, [0] * self.time
-        self.IP2, self.DP2 = [0] * self.time, [0] * self.time
-        self.IP3, self.DP3 = [0] * self.time, [0] * self.time
-        self.IH1, self.DH1 = [0] * self.time, [0] * self.time
-        self.IH2, self.DH2 = [0] * self.time, [0] * self.time
-        self.IH3, self.DH3 = [0] * self.time, [0] * self.time
-        self.IC1, self.DC1 = [0] * self.time, [0] * self.time
-        self.IC2, self.DC2 = [0] * self.time, [0] * self.time
-        self.IHH, self.DHH = [0] * self.time, [0] * self.time
-        self.IIRP, self.DIRP = [0] * self.time, [0] * self.time
-        self.INRP, self.DRP = [0] * self.time, [0] * self.time
+        self.IP1, self.DP1 = 0, 0
+        self.IP2, self.DP2 = 0, 0
+        self.IP3, self.DP3 = 0, 0
+        self.IH1, self.DH1 = 0, 0
+        self.IH2, self.DH2 = 0, 0
+        self.IH3, self.DH3 = 0, 0
+        self.IC1, self.DC1 = 0, 0
+        self.IC2, self.DC2 = 0, 0
+        self.IHH, self.DHH = 0, 0
+        self.IIRP, self.DIRP = 0, 0
+        self.INRP, self.DRP = 0, 0
 
     def init_temperature(self):
         """Initialize temperature parameters."""
-        self.atemp = [-0.21] * self.time  # Temperature anomaly
-        self.temp = [25] * self.time  # Initial temperature
+        self.atemp = -0.21  # Temperature anomaly
+        self.temp = 25  # Initial temperature
         self.tempo = 25  # Optimal temperature
 
     def init_growth_rates_plants(self):
@@ -179,22 +330,48 @@ class Parameters:
         self.etaa	=	0.000271386*52
         self.etab	=	0.00010454*52 
         self.phi	=	10	   #valor de enfermedad           
-        self.idealpercapmass	=	4.51e-05 * 10000 / self.numHH[0] 
+        self.idealpercapmass	=	4.51e-05 * 10000 / self.numHH 
 
     def init_ito_process(self):
         """Initialize Ito process parameters."""
         self.sigmam = 2.34e-05
         self.sigmab = 1.56e-03
-        self.epsilonm1 = np.random.normal(0, 1, self.time)
-        self.epsilonb1 = np.random.normal(0, 1, self.time)
-        self.epsilonm2 = np.random.normal(0, 1, self.time)
-        self.epsilonb2 = np.random.normal(0, 1, self.time)
+        # The noise draws epsilonm/epsilonb are drawn on first use (__getattr__)
 
         # Disable Ito process if not active
         if self.Ito == 0:
             self.sigmam = 0
             self.sigmab = 0
 
+    def init_household_classes(self):
+        """
+        Initialize the household classes, poorest first.
+
+        Every value holds one entry per class, and their common length is the
+        number of classes K: two (poor and rich) by default, as in the
+        original model, or e.g. ten for income deciles. Ensemble overrides
+        may give (K, N) arrays to vary them per member.
+        """
+        # 2P-a) 75-25 total population; 1 = poor, 2 = rich
+        self.numHH_shares = np.array([0.75, 0.25])
+        self.wage_shares = np.array([0.75, 0.25])  # 2P-b) total wages
+        self.P1H1demand_shares = np.array([0.75, 0.25])  # 2P-c) P1demand & H1demand
+        self.ISEEdemand_shares = np.array([0.75, 0.25])  # 2P-d) ISdemand & EEdemand
+        self.HH_shares = np.array([0.75, 0.25])  # 2P-e) HH
+
+        # Healthcare and nutritional issues, phi_k = phi * factor
+        # Rich people have better access to healthcare
+        self.health_factors = np.array([1, 0.5])
+
+        # Demographic trends (2014), with t = i + 55 for time index i:
+        # mortality (mHH_log log(t) + mHH_slope t + mHH_base) / 1000
+        self.mHH_log = np.array([-3.25, 0])
+        self.mHH_slope = np.array([0, -0.0103])
+        self.mHH_base = np.array([20.536, 9.4329])
+        # births intercept (etaa_scale exp(etaa_rate t) + 3) / 1000
+        self.etaa_scale = np.array([41.975, 20.831])
+        self.etaa_rate = np.array([-0.013, -0.012])
+
     # Add other initialization methods with idea model of other researches
     def init_society_type_a(self):
         """
@@ -204,59 +381,46 @@ class Parameters:
         """
         # Based on data taken from International Labor Organization
         # SOCIETY TYPE A - IDEAL
-        # Two Populations modifications (2P):
+        # Two Populations modifications (2P), generalized to the K household
+        # classes of `init_household_classes`:
         # 2P)   IEI 1 Income Equality Index
-        # 2P-a) 75-25 total population; 1 = poor, 2 = rich; 
-        # 2P-b) 75-25 total wages
-        # 2P-c) 75-25 total P1demand & H1demand 
-        # 2P-d) 75-25 total ISdemand & EEdemand
-        # 2P-e) 75-25 HH
+        # 2P-a) share of total population
+        # 2P-b) share of total wages
+        # 2P-c) share of total P1demand & H1demand
+        # 2P-d) share of total ISdemand & EEdemand
+        # 2P-e) share of HH
+        self.classes = len(self.numHH_shares)
+        lengths = {len(getattr(self, name)) for name in CLASS_NAMES}
+        if lengths != {self.classes} or self.classes < 2:
+            raise ValueError(
+                "Household class parameters need one value per class and at "
+                f"least two classes, got lengths {sorted(lengths)}"
+            )
         self.IEI = 1                            # Income Equality Index
-        self.numHH1 = [0.75 * self.numHH[0]] * self.time    # 75% of total households
-        self.numHH2 = [0.25 * self.numHH[0]] * self.time    # 25% of total households
-        self.HH1 = [self.HH[0] * 0.75] * self.time          # 75% of total household income
-        self.HH2 = [self.HH[0] * 0.25] * self.time          # 25% of total household income
+        # Households and household mass of each class, (K,) or (K, N)
+        self.numHH_k = _per_class(self.numHH, self.numHH_shares)
+        self.HH_k = _per_class(self.HH, self.HH_shares)
 
         # Factors related to healthcare and nutritional issues
-        # Rich people have better access to healthcare
-        self.phi1 = self.phi  # Factor for poorer population
-        self.phi2 = self.phi / 2  # Factor for richer population
+        self.phi_k = _per_class(self.phi, self.health_factors)
 
         # Per capita mass calculations
-        self.percapmass1 = [self.HH1[0] / self.numHH1[0]] * self.time  # Per capita mass for poor
-        self.percapmass2 = [self.HH2[0] / self.numHH2[0]] * self.time  # Per capita mass for rich
+        self.percapmass_k = self.HH_k / self.numHH_k
 
         # Factors for modification in individual populations variables
-        # Equations formed by:
-        # 1) pop1 + pop2 = total pop
-        # 2) pop1 - pop2 * (ratio of percentages) = 0
-        total_numHH = self.numHH[0]
-        Ab = np.array(
-            [
-                [self.numHH1[0] / total_numHH, self.numHH2[0] / total_numHH],
-                [
-                    self.numHH1[0] / total_numHH,
-                    -(self.numHH2[0] / total_numHH) * (75 / 25),
-                ],
-            ]
-        )  # 2P-b, d)
-        Ac = np.array(Ab)  # Same as Ab for demo purposes (2P-c, e)
-        Ad = np.array(Ab)  # Same as Ab for demo purposes (2P-b, d)
-        bb = np.array([1, 0])
-
-        # Solve for f2p values
-        self.f2pb = np.linalg.inv(Ab).dot(bb)  # Solution for demand equations
-        self.f2pc = np.linalg.inv(Ac).dot(bb)  # Solution for demand equations
-        self.f2pd = np.linalg.inv(Ad).dot(bb)  # Solution for demand equations
-        self.f2pe = [0.75, 0.25]  # Ratio of populations
+        population = self.numHH_k / self.numHH
+        self.f2pb = _class_factors(population, self.wage_shares)  # 2P-b
+        self.f2pc = _class_factors(population, self.P1H1demand_shares)  # 2P-c
+        self.f2pd = _class_factors(population, self.ISEEdemand_shares)  # 2P-d
+        self.f2pe = np.asarray(self.HH_shares, dtype=float)  # 2P-e) Ratio of populations
 
         # Wages parameters
-        self.aw1 = self.aw * self.f2pb[0]  # 2P-a) Adjusted wage for poor
-        self.aw2 = self.aw * self.f2pb[1]  # 2P-a) Adjusted wage for rich
-        self.cw1 = self.cw * self.f2pb[0]  # 2P-b) Adjusted wage for poor
-        self.cw2 = self.cw * self.f2pb[1]  # 2P-b) Adjusted wage for rich
-        self.dw1 = self.dw * self.f2pb[0]  # 2P-c) Adjusted wage for poor
-        self.dw2 = self.dw * self.f2pb[1]  # 2P-c) Adjusted wage for rich
+        self.aw_k = _per_class(self.aw, self.f2pb)  # 2P-a) Adjusted wages
+        self.cw_k = _per_class(self.cw, self.f2pb)  # 2P-b) Adjusted wages
+        self.dw_k = _per_class(self.dw, self.f2pb)  # 2P-c) Adjusted wages
+
+        # The demographic trends mHH_trend/etaa_trend are tabulated on first
+        # use (__getattr__)
 
     def init_energy_parameters(self):
         """
@@ -282,7 +446,7 @@ class Parameters:
     def init_economic_mobility_factors(self):
         """Initialize economic mobility parameters."""
         self.Wid = 0.31  # Ideal wage from stable simulation without Economic Mobility Factor (EMF)
-        self.Wgid = 0.31 * self.numHH[0]  # Ideal global wage
+        self.Wgid = 0.31 * self.numHH  # Ideal global wage
         self.psi = 1  # Richness distribution factor
 
     def init_greenhouse_gas_emissions(self):
@@ -345,13 +509,74 @@ class Parameters:
             ]
         )
 
+    def init_emission_factors(self):
+        """
+        Derive the emissions per mass unit in a group of their own, so that
+        overrides of `GtCO2eqStb`, `percCO2eq` or `yGHGstb` reach them.
+        """
         # Calculate gigatonnes of CO2 equivalent emitted by mass unit
         self.GtCO2eq = self.GtCO2eqStb * (self.percCO2eq / 100) / self.yGHGstb
 
+    def init_household_demand_coefficients(self):
+        """
+        Fold the household demand equations into a coefficient matrix.
+
+        The demands for P1, H1, IS and EE are linear in the prices, so each row
+        holds the coefficients of [1, pP1, pH1, pIS, pEE] (see
+        `household_demands`). Shape (4, 5), or (4, 5, N) when the demand
+        parameters are overridden per ensemble member.
+        """
+        dP1, zP1, kP1, mP1, nP1 = self.dP1HH, self.zP1HH, self.kP1HH, self.mP1HH, self.nP1HH
+        dH1, zH1, kH1, mH1, nH1 = self.dH1HH, self.zH1HH, self.kH1HH, self.mH1HH, self.nH1HH
+        dIS, zIS, kIS, mIS, nIS = self.dISHH, self.zISHH, self.kISHH, self.mISHH, self.nISHH
+        dEE, zEE, kEE, mEE, nEE = self.dEEHH, self.zEEHH, self.kEEHH, self.mEEHH, self.nEEHH
+        Z = -1 + zP1 + zH1 + zIS
+        ZEE = -1 + zP1 + zH1 + zEE
+
+        rows = [
+            # P1HHdemand
+            [
+                (-dP1 - dH1 * zP1 - dIS * zP1 + dP1 * zH1 + dP1 * zIS) / Z,
+                (kP1 - kH1 * zP1 - kP1 * zH1 - kP1 * zIS) / Z,
+                (-mP1 + mH1 * zP1 - mIS * zP1 + mP1 * zH1 + mP1 * zIS) / Z,
+                (-nP1 - nH1 * zP1 + nIS * zP1 + nP1 * zH1 + nP1 * zIS) / Z,
+                0,
+            ],
+            # H1HHdemand
+            [
+                (-dH1 + dH1 * zP1 - dIS * zH1 - dP1 * zH1 + dH1 * zIS) / Z,
+                (-kH1 + kH1 * zP1 - kIS * zH1 + kP1 * zH1 + kH1 * zIS) / Z,
+                (mH1 - mH1 * zP1 - mIS * zH1 - mP1 * zH1 - mH1 * zIS) / Z,
+                (-nH1 + nH1 * zP1 + nIS * zH1 - nP1 * zH1 + nH1 * zIS) / Z,
+                0,
+            ],
+            # ISHHdemand
+            [
+                -(dIS - dIS * zP1 - dIS * zH1 + dH1 * zIS + dP1 * zIS) / Z,
+                -(kIS - kIS * zP1 - kIS * zH1 + kH1 * zIS - kP1 * zIS) / Z,
+                -(mIS - mIS * zP1 - mIS * zH1 - mH1 * zIS + mP1 * zIS) / Z,
+                -(-nIS + nIS * zP1 + nIS * zH1 + nH1 * zIS + nP1 * zIS) / Z,
+                0,
+            ],
+            # EEHHdemand
+            [
+                -(dEE - dEE * zP1 - dEE * zH1 + dH1 * zEE + dP1 * zEE) / ZEE,
+                -(kEE - kEE * zP1 - kEE * zH1 + kH1 * zEE - kP1 * zEE) / ZEE,
+                -(mEE - mEE * zP1 - mEE * zH1 - mH1 * zEE + mP1 * zEE) / ZEE,
+                0,
+                -(-nEE + nEE * zP1 + nEE * zH1 + nH1 * zEE + nP1 * zEE) / ZEE,
+            ],
+        ]
+        entries = np.broadcast_arrays(*(value for row in rows for value in row))
+        self.HHdemand_coefficients = np.array(entries, dtype=float).reshape(
+            (4, 5) + entries[0].shape
+        )
+
     def print_params(self):
         print("Parameters:")
-        print(self.__dict__.keys())
-        print("\nNumber of parameters:", len(self.__dict__))
+        names = [name for name in self.__dict__ if not name.startswith("_")]
+        print(names)
+        print("\nNumber of parameters:", len(names))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,303 @@
+import hashlib
+import json
+import os
+import numpy as np
+from src.models.checkpoint import Checkpoint
+from src.models.ensemble import GSSEMEnsemble
+from src.models.trajectory import STATE_INDEX, Trajectory, flow_names, state_names
+from src.utils.cache import parameter_hash
+
+# Parameters of the shared atmosphere, equal for every region
+SHARED_NAMES = ("CO2eq", "temp", "tempo", "ppmCO2eq")
+
+# Stocks the regions may exchange
+TRADED_NAMES = ("P1", "H1", "ISmass")
+
+# Per-region coupling of each step: the CO2eq increase (ppm) of the region's
+# emissions, then the mass of each traded stock imported (negative: exported)
+EXCHANGE_NAMES = ("CO2eq",) + TRADED_NAMES
+
+
+class GSSEMRegions(GSSEMEnsemble):
+    """
+    Coupled GSSEM regions sharing one atmosphere.
+
+    Each of the R regions is a full ecosystem and economy, a member of the
+    batched ensemble step, with its own parameters (arrays of shape (R,), as
+    in `GSSEMEnsemble`) and its `pais` identifier (0 .. R - 1 unless given).
+    The regions emit into one CO2eq pool: its increase over a step is the sum
+    of their emissions, so every region sees the same CO2eq and temp.
+
+    With `trade`, the regions also exchange P1, H1 and IS mass with their
+    partners at the end of each step. Region r imports
+    rate * sum_s partners[r, s] * (stock_s - stock_r) of a stock, so mass
+    moves from the larger stocks to the smaller ones and the total is kept.
+    A single region without trade reproduces `GSSEMModel` like an ensemble of
+    one.
+    """
+
+    def __init__(self, time: int = 100, n: int = None, overrides: dict = None,
+                 trade: dict = None, partners=None, forcing=None):
+        """
+        Parameters:
+        - time (int): Simulation time period.
+        - n (int): Number of regions. Inferred from the array overrides when
+          omitted.
+        - overrides (dict): Parameter values replacing the defaults; arrays of
+          shape (R,) give one value per region. The atmosphere (`SHARED_NAMES`)
+          takes one value for all regions.
+        - trade (dict): Stock name (`TRADED_NAMES`) -> fraction of the gap to
+          the partners' stocks exchanged per step, between 0 and 1.
+        - partners (ndarray): Symmetric non-negative weights (R, R) of the
+          trade between regions, each row summing to at most 1. Every region
+          trades with every other one, with weight 1 / R, by default.
+        - forcing (Forcing): Optional exogenous series (see `GSSEMEnsemble`).
+          Its emissions go to the shared atmosphere once, not per region.
+        """
+        overrides = dict(overrides or {})
+        varying = [
+            name for name in SHARED_NAMES
+            if np.ndim(overrides.get(name, 0)) and np.ptp(overrides[name]) != 0
+        ]
+        if varying:
+            raise ValueError(f"The regions share one atmosphere; got regional {varying}")
+        n = self._member_count(overrides, n)
+        if "pais" not in overrides and n > 1:
+            # Regions are numbered 0 .. R - 1 unless `pais` names them
+            overrides["pais"] = np.arange(n)
+        super().__init__(time, n, overrides, forcing)
+
+        trade = dict(trade or {})
+        unknown = set(trade) - set(TRADED_NAMES)
+        if unknown:
+            raise AttributeError(f"Unknown traded stocks: {sorted(unknown)}")
+        if not all(0 <= rate <= 1 for rate in trade.values()):
+            raise ValueError("Trade rates must be between 0 and 1")
+        if partners is None:
+            partners = np.full((self.n, self.n), 1 / self.n)
+        partners = np.array(partners, dtype=float)
+        if partners.shape != (self.n, self.n):
+            raise ValueError(f"partners must have shape ({self.n}, {self.n})")
+        # A region's trade with itself cancels out
+        np.fill_diagonal(partners, 0)
+        if (
+            np.any(partners < 0)
+            or not np.allclose(partners, partners.T)
+            or np.any(partners.sum(axis=1) > 1 + 1e-12)
+        ):
+            raise ValueError(
+                "partners must be symmetric and non-negative, each row summing to at most 1"
+            )
+        self.trade = {name: float(rate) for name, rate in trade.items() if rate}
+        self.partners = partners
+        self._reach = partners.sum(axis=1)
+        self.exchanges = None
+
+    def steps(self, start=None, stop=None):
+        """
+        Advance all regions one step at a time (see `GSSEMEnsemble.steps`).
+
+        After each record, `self.exchange` holds the coupling of the step,
+        shape (4, R) in `EXCHANGE_NAMES` order. The regions share their
+        atmosphere, so none can be retired early and `stop` is not taken.
+        """
+        if stop is not None:
+            raise ValueError("Coupled regions run to the horizon; stop is not supported")
+        return super().steps(start)
+
+    def step_map(self, i, state, EEIRP=0.0, rounding=np.ceil):
+        """The one-step map (see `GSSEMEnsemble.step_map`), one column per region."""
+        if np.shape(state)[1] != self.n:
+            raise ValueError(f"Coupled regions need one state column per region ({self.n})")
+        return super().step_map(i, state, EEIRP, rounding)
+
+    def _atmosphere(self, CO2eq, increase):
+        """CO2eq at i + 1: the regions' increases add up in the shared pool."""
+        increase = np.broadcast_to(increase, (self.n,))
+        self._increase = increase
+        return CO2eq + np.sum(increase)
+
+    def _step(self, i, state, rounding=np.ceil):
+        """Step every region, then exchange the traded stocks between them."""
+        flows, next_state = super()._step(i, state, rounding)
+        exchange = [self._increase]
+        for name in TRADED_NAMES:
+            row = STATE_INDEX[name]
+            stock = np.broadcast_to(next_state[row], (self.n,))
+            if name in self.trade:
+                imports = self.trade[name] * (self.partners @ stock - self._reach * stock)
+                next_state[row] = stock + imports
+            else:
+                imports = np.zeros(self.n)
+            exchange.append(imports)
+        self.exchange = np.array(exchange)
+        return flows, next_state
+
+    def run_simulation(self, dtype=np.float64, start=None, out_dir=None, stop=None,
+                       chunk_size: int = 256):
+        """
+        Run all regions over the time period.
+
+        Steps are collected in blocks of `chunk_size` and written one block
+        at a time: in memory by default, or with `out_dir` into a chunked
+        store of memory-mapped files. The store holds `x.npy` (R, time, 77),
+        `y.npy` (R, 49, time), `exchanges.npy` (R, time, 4), per-chunk
+        `done.npy` flags and a `checkpoint.npz` of the last finished chunk
+        (see `load_regions`). Each block is written as R contiguous runs per
+        file instead of one scattered value per region and state row every
+        step. Calling `run_simulation` again with the same `out_dir` and
+        parameters resumes an interrupted run from its last chunk, and
+        reproduces the uninterrupted one.
+
+        Parameters:
+        - dtype: Storage precision, np.float64 (default) or np.float32. The
+          computation itself always runs in double precision.
+        - start (Checkpoint): Resume from a snapshot (see
+          `GSSEMEnsemble.steps`). Steps before the snapshot are left as NaN.
+        - out_dir (str): Directory of the store; None keeps the results in
+          memory.
+        - stop: Not supported (see `steps`).
+        - chunk_size (int): Steps per block, and per resumable chunk.
+
+        Returns:
+        - Trajectory: Flows (R, time, 77) and states (R, 49, time), accessible
+          by name. The coupling of each step is kept as `self.exchanges`,
+          shape (R, time, 4) in `EXCHANGE_NAMES` order.
+        """
+        if stop is not None:
+            raise ValueError("Coupled regions run to the horizon; stop is not supported")
+        time, n = self.params.time, self.n
+        n_chunks = -(-time // chunk_size)
+        if out_dir is None:
+            self.trajectory = Trajectory.allocate(time, (n,), dtype, self.params.classes)
+            self.exchanges = np.zeros((n, time, len(EXCHANGE_NAMES)), dtype)
+            done = np.zeros(n_chunks, dtype=bool)
+        else:
+            done = self._open_store(out_dir, dtype, chunk_size, start)
+        x, y = self.trajectory
+
+        checkpoint = None if out_dir is None else os.path.join(out_dir, "checkpoint.npz")
+        if done.all():
+            return self.trajectory
+        if done.any() and os.path.exists(checkpoint):
+            start = Checkpoint.load(checkpoint)
+            print(f"Resuming the regions at time index {start.index}.")
+        elif start is None:
+            y[:, :, 0] = self.initial_state().T
+        else:
+            x[:, :start.index] = np.nan
+            y[:, :, :start.index] = np.nan
+            self.exchanges[:, :start.index] = np.nan
+            y[:, :, start.index] = self._broadcast(start.state).T
+
+        # One block of steps begin .. end - 1, which give the states at time
+        # indices begin + 1 .. end (the last step repeats the final index)
+        # (the blocks are time-major, so each value of a record is one
+        # contiguous row)
+        block = min(chunk_size, time)
+        flows = np.empty((block, x.shape[-1], n))
+        states = np.empty((block, y.shape[1], n))
+        exchanges = np.empty((block, len(EXCHANGE_NAMES), n))
+        ERP = STATE_INDEX["ERP"]
+        begin = 0 if start is None else start.index
+        for record in self.steps(start):
+            s, t = record.step - begin, record.index - begin - 1
+            for k, value in enumerate(record.flows):
+                flows[s, k] = value
+            for k, value in enumerate(record.state):
+                states[t, k] = value
+            exchanges[s] = self.exchange
+            # A step zeroes the ERP level of the previous index when the pool
+            # runs out, which may belong to the previous block
+            if t > 0:
+                states[t - 1, ERP] = record.ERP
+            else:
+                y[:, ERP, record.index - 1] = record.ERP
+            end = record.step + 1
+            if end % chunk_size and end < time:
+                continue
+
+            x[:, begin:end] = flows[:s + 1].transpose(2, 0, 1)
+            self.exchanges[:, begin:end] = exchanges[:s + 1].transpose(2, 0, 1)
+            y[:, :, begin + 1:begin + t + 2] = states[:t + 1].transpose(2, 1, 0)
+            if out_dir is not None:
+                self.trajectory.flush()
+                self.exchanges.flush()
+                if end < time - 1:
+                    Checkpoint.from_step(record, self.params).save(checkpoint)
+                done[(end - 1) // chunk_size] = True
+                done.flush()
+            begin = end
+        return self.trajectory
+
+    def _open_store(self, out_dir, dtype, chunk_size, start):
+        """Create the store of a run, or reopen it to resume an interrupted run."""
+        time, n = self.params.time, self.n
+        manifest = {
+            "time": time,
+            "regions": n,
+            "classes": self.params.classes,
+            "chunk_size": chunk_size,
+            "dtype": np.dtype(dtype).str,
+            "parameters": parameter_hash(self.params, type(self).__name__, dtype),
+            "trade": self.trade,
+            "partners": hashlib.sha256(self.partners.tobytes()).hexdigest(),
+            "forcing": None if self.forcing is None else self.forcing.path or "memory",
+            "start": None if start is None else start.index,
+        }
+        manifest_path = os.path.join(out_dir, "manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                stored = json.load(f)
+            if stored != json.loads(json.dumps(manifest)):
+                raise ValueError(
+                    f"{out_dir} holds a different run; use a new output directory"
+                )
+            mode = "r+"
+        else:
+            os.makedirs(out_dir, exist_ok=True)
+            mode = "w+"
+
+        self.trajectory = Trajectory(
+            *(
+                np.lib.format.open_memmap(
+                    os.path.join(out_dir, f"{name}.npy"), mode=mode, dtype=dtype,
+                    shape=shape,
+                )
+                for name, shape in (
+                    ("x", (n, time, len(flow_names(self.params.classes)))),
+                    ("y", (n, len(state_names(self.params.classes)), time)),
+                )
+            )
+        )
+        self.exchanges = np.lib.format.open_memmap(
+            os.path.join(out_dir, "exchanges.npy"), mode=mode, dtype=dtype,
+            shape=(n, time, len(EXCHANGE_NAMES)),
+        )
+        done = np.lib.format.open_memmap(
+            os.path.join(out_dir, "done.npy"), mode=mode, dtype=bool,
+            shape=(-(-time // chunk_size),),
+        )
+        if mode == "w+":
+            # Written last, so a directory without it is never mistaken for a run
+            with open(manifest_path, "w") as f:
+                json.dump(manifest, f)
+        return done
+
+
+def load_regions(out_dir: str):
+    """
+    Open the store of a regions run without loading it into memory.
+
+    Returns:
+    - Trajectory: Flows (R, time, 77) and states (R, 49, time), by name.
+    - exchanges (memmap): Coupling per region and step, shape (R, time, 4)
+      in `EXCHANGE_NAMES` order.
+    - done (ndarray): Per-chunk completion flags.
+    """
+    result = Trajectory.load(
+        os.path.join(out_dir, "x.npy"), os.path.join(out_dir, "y.npy")
+    )
+    exchanges = np.load(os.path.join(out_dir, "exchanges.npy"), mmap_mode="r")
+    done = np.load(os.path.join(out_dir, "done.npy"))
+    return result, exchanges, done
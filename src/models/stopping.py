@@ -0,0 +1,102 @@
+import numpy as np
+from src.models.trajectory import STATE_INDEX
+
+# Floors the model pins collapsed compartments to: numHH never drops below one
+# household, and a plant stock that falls under `belownoreproduction` is zeroed
+COLLAPSE = {"numHH": 1, "P2": 0, "P3": 0}
+
+# Stocks compared by the steady-state test by default: the compartments of the
+# ecosystem and economy and the resource pools. CO2eq and temp only grow, the
+# household counts grow with births, and the other rows are deficits or the
+# per-step inflow and outflow records of the compartments.
+STEADY_NAMES = (
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "ISmass", "RP", "IRP",
+    "ERP", "EE",
+)
+
+
+class StopCriteria:
+    """
+    Conditions that end a run before its horizon.
+
+    Checked on the state reached by every step but the last (which repeats the
+    previous step); a run stops at the first time index where one holds:
+    - extinction (dict): State name -> floor; the run stops once the state is
+      at or below its floor, reason "extinction of <name>". `COLLAPSE` holds
+      the floors of the collapsed human and plant populations.
+    - rtol, atol (float): Steady state; the run stops once every state named
+      in `steady` (`STEADY_NAMES` by default) changed by at most
+      atol + rtol * |value| for `patience` consecutive steps, reason
+      "steady state". Off while rtol is None.
+    - co2_threshold (float): The run stops once CO2eq reaches it, reason
+      "CO2eq threshold".
+
+    `GSSEMModel` ends the run, while `GSSEMEnsemble` retires the stopped
+    members and continues with the others. An instance keeps the state of one
+    run at a time and is reset by `steps()`.
+    """
+
+    def __init__(self, extinction: dict = None, rtol: float = None,
+                 atol: float = 0.0, patience: int = 10, co2_threshold: float = None,
+                 steady=STEADY_NAMES):
+        self.extinction = dict(extinction or {})
+        self.rtol = rtol
+        self.atol = atol
+        self.patience = patience
+        self.co2_threshold = co2_threshold
+        self.steady = tuple(steady)
+        unknown = (set(self.extinction) | set(self.steady)) - set(STATE_INDEX)
+        if unknown:
+            raise AttributeError(f"Unknown state names: {sorted(unknown)}")
+        self._steady_rows = [STATE_INDEX[name] for name in self.steady]
+
+    def settings(self):
+        """The criteria as a JSON-serializable dict, e.g. to record a sweep."""
+        return {
+            "extinction": self.extinction,
+            "rtol": self.rtol,
+            "atol": self.atol,
+            "patience": self.patience,
+            "co2_threshold": self.co2_threshold,
+            "steady": list(self.steady),
+        }
+
+    def reset(self, state):
+        """Start a run from `state`, the 49 state rows of shape (49,) or (49, N)."""
+        self._previous = np.array(state, dtype=float).reshape(len(state), -1)
+        self._calm = np.zeros(self._previous.shape[1], dtype=np.int64)
+
+    def check(self, state):
+        """
+        Test the state reached by a step.
+
+        Returns:
+        - ndarray: Stop reason per member, shape (N,); "" while running. When
+          several conditions hold the first listed above is reported.
+        """
+        state = np.array(
+            [np.broadcast_to(value, self._calm.shape) for value in state], dtype=float
+        )
+        reasons = np.full(self._calm.shape, "", dtype=object)
+
+        if self.co2_threshold is not None:
+            reasons[state[STATE_INDEX["CO2eq"]] >= self.co2_threshold] = "CO2eq threshold"
+
+        if self.rtol is not None:
+            rows = state[self._steady_rows]
+            change = np.abs(rows - self._previous[self._steady_rows])
+            calm = np.all(change <= self.atol + self.rtol * np.abs(rows), axis=0)
+            self._calm = np.where(calm, self._calm + 1, 0)
+            reasons[self._calm >= self.patience] = "steady state"
+
+        # Listed last so that it takes precedence
+        for name, floor in reversed(list(self.extinction.items())):
+            reasons[state[STATE_INDEX[name]] <= floor] = f"extinction of {name}"
+
+        self._previous = state
+        return reasons
+
+    def retain(self, keep):
+        """Drop the members where `keep` is False (retired from an ensemble)."""
+        self._previous = self._previous[:, keep]
+        self._calm = self._calm[keep]
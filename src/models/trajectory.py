@@ -0,0 +1,305 @@
+from functools import lru_cache
+from typing import NamedTuple
+import numpy as np
+
+# Columns of the flow matrix x, one row per time step
+FLOW_NAMES = [
+    "P1RP", "P1H1", "P1H2", "P1IS", "P1HH", "P2RP", "P2H1", "P2H2", "P2H3",
+    "P3RP", "P3H3", "H1RP", "H1C1", "H1HH", "H2RP", "H2C1", "H2C2", "H3RP",
+    "H3C2", "C1RP", "C2RP", "HHRP", "ISIRP", "RPP1", "RPP2", "RPP3", "RPIS",
+    "IRPP2", "IRPP3", "IRPRP", "P1HHdemand", "H1HHdemand", "ISHHdemand",
+    "P1ISdemand", "RPISdemand", "P1production", "H1production",
+    "ISproduction", "pP1", "pH1", "pIS", "percapbirths", "weightedprice", "W",
+    "W1", "W2", "P1HHdemand1", "P1HHdemand2", "H1HHdemand1", "H1HHdemand2",
+    "ISHHdemand1", "ISHHdemand2", "EEHHdemand1", "EEHHdemand2", "pEE",
+    "EEHHdemand", "EEHHtotdemand", "EEISdemand", "EEproduction", "EEHHmass",
+    "EEIRP", "percapbirths1", "percapbirths2", "mHH1", "mHH2", "EMF",
+    "EMFnumHH", "gRPP1", "gRPP2", "gRPP3", "mHH", "aa", "bb", "cc", "dd", "ee",
+    "ff",
+]
+
+# Rows of the state matrix y, one column per time step. Rows 43/44 repeat
+# IH3/DH3, as in the y layout of the original MATLAB model.
+STATE_NAMES = [
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "ISmass", "RP",
+    "IRP", "numHH", "percapmass", "P1H1massdeficit", "P1ISmassdeficit",
+    "P1HHmassdeficit", "H1massdeficit", "ISmassdeficit", "numHH1", "numHH2",
+    "HH1", "HH2", "ERP", "EE", "CO2eq", "temp", "IP1", "DP1", "IP2", "DP2",
+    "IP3", "DP3", "IH1", "DH1", "IH2", "DH2", "IH3", "DH3", "IC1", "DC1",
+    "IC2", "DC2", "IH3_copy", "DH3_copy", "IIRP", "DIRP", "INRP", "DRP",
+]
+
+# Rows that repeat another row, and the row they repeat
+DUPLICATE_STATES = {"IH3_copy": "IH3", "DH3_copy": "DH3"}
+
+# Flows and states of each household class. Classes 1 and 2 have the
+# columns and rows above (W1, W2, numHH1, numHH2, ...); a run with K > 2
+# classes appends those of classes 3 .. K, grouped by name (W3 .. WK,
+# P1HHdemand3 .. P1HHdemandK, ...), so the two-class layout is a prefix of
+# every layout and the indices below hold for any K.
+CLASS_FLOW_NAMES = (
+    "W", "P1HHdemand", "H1HHdemand", "ISHHdemand", "EEHHdemand", "percapbirths",
+    "mHH",
+)
+CLASS_STATE_NAMES = ("numHH", "HH")
+
+FLOW_INDEX = {name: k for k, name in enumerate(FLOW_NAMES)}
+STATE_INDEX = {name: k for k, name in enumerate(STATE_NAMES)}
+
+
+def flow_names(classes: int = 2):
+    """Columns of the flow matrix x of a run with `classes` household classes."""
+    return FLOW_NAMES + [
+        f"{name}{k}" for name in CLASS_FLOW_NAMES for k in range(3, classes + 1)
+    ]
+
+
+def state_names(classes: int = 2):
+    """Rows of the state matrix y of a run with `classes` household classes."""
+    return STATE_NAMES + [
+        f"{name}{k}" for name in CLASS_STATE_NAMES for k in range(3, classes + 1)
+    ]
+
+
+@lru_cache(maxsize=None)
+def flow_index(classes: int = 2):
+    """Column of each flow in x, by name (`FLOW_INDEX` for two classes)."""
+    return {name: k for k, name in enumerate(flow_names(classes))}
+
+
+@lru_cache(maxsize=None)
+def state_index(classes: int = 2):
+    """Row of each state in y, by name (`STATE_INDEX` for two classes)."""
+    return {name: k for k, name in enumerate(state_names(classes))}
+
+
+@lru_cache(maxsize=None)
+def class_rows(name: str, classes: int):
+    """Rows of y holding a per-class state (e.g. "numHH"), classes 1 .. K in order."""
+    index = state_index(classes)
+    rows = np.array([index[f"{name}{k}"] for k in range(1, classes + 1)])
+    rows.flags.writeable = False
+    return rows
+
+
+def flow_classes(columns: int):
+    """Number of household classes of a run with `columns` flows."""
+    return (columns - len(FLOW_NAMES)) // len(CLASS_FLOW_NAMES) + 2
+
+
+class Trajectory:
+    """
+    Named, zero-copy access to the flows and states of a run.
+
+    - flows: shape (*lead, time, 77), the layout of the scalar x.
+    - states: shape (*lead, 49, time), the layout of the scalar y.
+    `lead` is empty for a single run and (N,) for an ensemble. A run with
+    K > 2 household classes has 7 (K - 2) more flows and 2 (K - 2) more
+    states (see `flow_names` and `state_names`).
+
+    Every flow and state is available by name, either as `result["temp"]` or
+    `result.temp`, and is a view into the underlying arrays. Slicing with
+    `result[10:50]` selects time steps without copying. Unpacking
+    `x, y = result` gives the positional matrices.
+    """
+
+    def __init__(self, flows, states):
+        """
+        Parameters:
+        - flows (ndarray): Flow matrix, shape (*lead, time, 77).
+        - states (ndarray): State matrix, shape (*lead, 49, time).
+        """
+        self.flows = flows
+        self.states = states
+
+    @classmethod
+    def allocate(cls, time: int, lead: tuple = (), dtype=np.float64,
+                 classes: int = 2):
+        """
+        Preallocate storage for a run.
+
+        Both matrices are views into one float buffer allocated up front, so
+        the engine writes each step in place and nothing is copied on the way
+        to disk.
+
+        Parameters:
+        - time (int): Simulation time period.
+        - lead (tuple): Leading dimensions, e.g. (N,) for N ensemble members.
+        - dtype: np.float64 (default) or np.float32 to halve the memory.
+        - classes (int): Number of household classes.
+        """
+        lead = tuple(lead)
+        columns, rows = len(flow_names(classes)), len(state_names(classes))
+        size = int(np.prod(lead, dtype=np.int64))
+        n_flows = size * time * columns
+        buffer = np.zeros(n_flows + size * rows * time, dtype)
+        return cls(
+            buffer[:n_flows].reshape(lead + (time, columns)),
+            buffer[n_flows:].reshape(lead + (rows, time)),
+        )
+
+    @classmethod
+    def create(cls, x_path: str, y_path: str, time: int, lead: tuple = (),
+               dtype=np.float64, classes: int = 2):
+        """
+        Create storage for a run as memory-mapped `.npy` files.
+
+        The engine then writes each step straight to disk, so a run may be
+        larger than RAM, and the files can be opened with `load` while or
+        after it runs. Single runs keep the historical y shape (1, 49, time).
+
+        Parameters:
+        - x_path, y_path (str): Files of the flow and state matrices.
+        - time (int): Simulation time period.
+        - lead (tuple): Leading dimensions, e.g. (N,) for N ensemble members.
+        - dtype: np.float64 (default) or np.float32.
+        - classes (int): Number of household classes.
+        """
+        lead = tuple(lead)
+        flows = np.lib.format.open_memmap(
+            x_path,
+            mode="w+",
+            dtype=dtype,
+            shape=lead + (time, len(flow_names(classes))),
+        )
+        states = np.lib.format.open_memmap(
+            y_path,
+            mode="w+",
+            dtype=dtype,
+            shape=(lead or (1,)) + (len(state_names(classes)), time),
+        )
+        return cls(flows, states if lead else states[0])
+
+    @classmethod
+    def load(cls, x_path: str, y_path: str):
+        """
+        Open saved x and y files as memory maps.
+
+        Nothing is read until a flow or state is accessed, so selecting a few
+        names only loads those from disk.
+        """
+        flows = np.load(x_path, mmap_mode="r")
+        states = np.load(y_path, mmap_mode="r")
+        if states.ndim == flows.ndim + 1:
+            # Single runs are saved with the historical y shape (1, 49, time)
+            states = states[0]
+        return cls(flows, states)
+
+    @classmethod
+    def load_mat(cls, path: str):
+        """
+        Read the x and y matrices of a MATLAB run, such as `results/ResultsGW.mat`.
+
+        The MATLAB model records the first 67 flows (up to EMFnumHH); the
+        flows added by this port are NaN. Its y has one row per time index
+        plus a trailing one, which is dropped so that states line up with
+        the y of this model. Requires SciPy.
+        """
+        from scipy.io import loadmat
+
+        data = loadmat(path)
+        x, y = data["x"], data["y"]
+        flows = np.full((len(x), len(FLOW_NAMES)), np.nan)
+        flows[:, :x.shape[1]] = x
+        return cls(flows, np.ascontiguousarray(y[:len(x)].T))
+
+    @property
+    def time(self):
+        return self.flows.shape[-2]
+
+    @property
+    def classes(self):
+        """Number of household classes of the run."""
+        return flow_classes(self.flows.shape[-1])
+
+    def flow(self, name: str):
+        """View of one flow column over time."""
+        return self.flows[..., flow_index(self.classes)[name]]
+
+    def state(self, name: str):
+        """View of one state row over time."""
+        return self.states[..., state_index(self.classes)[name], :]
+
+    def columns(self, names):
+        """Views of several flows and states, keyed by name."""
+        return {name: self[name] for name in names}
+
+    def records(self):
+        """
+        Flows as a NumPy structured array with one named field per flow.
+
+        The result is a view of the flow matrix (shape (*lead, time)), so it
+        requires the flows to be contiguous along the last axis.
+        """
+        dtype = np.dtype(
+            [(name, self.flows.dtype) for name in flow_names(self.classes)]
+        )
+        return self.flows.view(dtype)[..., 0]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key in flow_index(self.classes):
+                return self.flow(key)
+            return self.state(key)
+        if isinstance(key, slice):
+            return Trajectory(self.flows[..., key, :], self.states[..., key])
+        raise TypeError("Index a Trajectory with a flow/state name or a time slice")
+
+    def __getattr__(self, name):
+        # Only flow/state names are looked up, and only once `flows` is set:
+        # unpickling probes attributes (e.g. `__setstate__`) on an instance
+        # whose `__dict__` is still empty, and must not recurse into this
+        flows = self.__dict__.get("flows")
+        if flows is None or name.startswith("_"):
+            raise AttributeError(name)
+        if name in ("flows", "states", "classes"):
+            raise AttributeError(name)
+        classes = flow_classes(flows.shape[-1])
+        if name in flow_index(classes) or name in state_index(classes):
+            return self[name]
+        raise AttributeError(name)
+
+    def __iter__(self):
+        yield self.flows
+        yield self.states
+
+    def flush(self):
+        """Write pending changes of memory-mapped storage to disk."""
+        for array in (self.flows, self.states):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def save(self, x_path: str, y_path: str):
+        """Write x and y to `.npy` files, keeping the historical y shape (1, 49, time)."""
+        single = self.flows.ndim == 2
+        np.save(x_path, self.flows)
+        np.save(y_path, self.states[np.newaxis] if single else self.states)
+
+
+class Step(NamedTuple):
+    """
+    One step of a run, as yielded by the `steps()` generators.
+
+    - step: Step number, 0 .. time - 1.
+    - index: Time index of `state` (the last step repeats index time - 1).
+    - flows: The 77 flows of the step, in `FLOW_NAMES` order (`flow_names`
+      with more than two household classes).
+    - state: The 49 state values at `index`, in `STATE_NAMES` order.
+    - ERP: ERP level the step drew from; it is zeroed when the pool runs out
+      during the step, which also overwrites ERP at `index - 1`.
+    For an ensemble every value is an array of shape (N,).
+    """
+
+    step: int
+    index: int
+    flows: tuple
+    state: tuple
+    ERP: float
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            classes = flow_classes(len(self.flows))
+            if key in flow_index(classes):
+                return self.flows[flow_index(classes)[key]]
+            return self.state[state_index(classes)[key]]
+        return tuple.__getitem__(self, key)
@@ -0,0 +1,243 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+from time import perf_counter
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.models import GSSEMModel
+from src.models.parameters import Parameters
+from src.models.trajectory import Trajectory
+
+
+def environment():
+    """Metadata of the machine and code a benchmark ran on."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import matplotlib
+
+        matplotlib_version = matplotlib.__version__
+    except ImportError:
+        matplotlib_version = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": commit,
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "matplotlib": matplotlib_version,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _best_of(func, repeat):
+    """Shortest wall time of `repeat` calls of `func`."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        best = min(best, perf_counter() - start)
+    return best
+
+
+def bench_single_run(time):
+    """
+    Time the scalar step loop over `time` steps.
+
+    The steps are streamed, so long horizons need no trajectory storage. A run
+    the model cannot complete (e.g. an overflow of the diverging population)
+    is reported with the steps it reached and the error.
+    """
+    model = GSSEMModel(time)
+    steps = 0
+    error = None
+    start = perf_counter()
+    try:
+        for _ in model.steps():
+            steps += 1
+    except (OverflowError, ValueError, ZeroDivisionError) as exc:
+        error = f"{type(exc).__name__}: {exc}"
+    seconds = perf_counter() - start
+    return {
+        "seconds": seconds,
+        "steps": steps,
+        "steps_per_second": steps / seconds,
+        "error": error,
+    }
+
+
+def bench_ensemble(n, time=100):
+    """Time an ensemble of `n` members and report its throughput."""
+    ensemble = GSSEMEnsemble(time, n=n)
+    start = perf_counter()
+    ensemble.run_simulation()
+    seconds = perf_counter() - start
+    return {"seconds": seconds, "runs_per_second": n / seconds}
+
+
+def bench_parameters(time, repeat=20):
+    """Time the construction of a `Parameters` set."""
+    return {"seconds": _best_of(lambda: Parameters(time), repeat)}
+
+
+def bench_serialization(time, n=None, repeat=3):
+    """Time saving a result to `.npy` files and opening it again."""
+    lead = () if n is None else (n,)
+    result = Trajectory.allocate(time, lead)
+    result.flows[...] = np.random.random(result.flows.shape)
+    result.states[...] = np.random.random(result.states.shape)
+    with tempfile.TemporaryDirectory() as tmp:
+        x_path = os.path.join(tmp, "x.npy")
+        y_path = os.path.join(tmp, "y.npy")
+        save = _best_of(lambda: result.save(x_path, y_path), repeat)
+        load = _best_of(
+            lambda: np.asarray(Trajectory.load(x_path, y_path).states).sum(), repeat
+        )
+        size = os.path.getsize(x_path) + os.path.getsize(y_path)
+    return {"seconds": save + load, "save_seconds": save, "load_seconds": load,
+            "megabytes": size / 1e6}
+
+
+def bench_plot(time=100):
+    """Time `plot_utils.plot` on a run, writing the figures to a scratch folder."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from src.utils.plot_utils import plot
+
+    result = GSSEMEnsemble(time, n=1).run_simulation()
+    result = Trajectory(result.flows[0], result.states[0])
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.makedirs(os.path.join(tmp, "figs"))
+        os.chdir(tmp)
+        try:
+            start = perf_counter()
+            plot(result)
+            seconds = perf_counter() - start
+        finally:
+            os.chdir(cwd)
+            matplotlib.pyplot.close("all")
+    return {"seconds": seconds}
+
+
+BENCHMARKS = {
+    "single_run[time=100]": lambda: bench_single_run(100),
+    "single_run[time=1000]": lambda: bench_single_run(1000),
+    "single_run[time=10000]": lambda: bench_single_run(10_000),
+    "ensemble[n=10]": lambda: bench_ensemble(10),
+    "ensemble[n=100]": lambda: bench_ensemble(100),
+    "ensemble[n=1000]": lambda: bench_ensemble(1000),
+    "parameters[time=100]": lambda: bench_parameters(100),
+    "parameters[time=1000000]": lambda: bench_parameters(1_000_000),
+    "serialization[time=10000]": lambda: bench_serialization(10_000),
+    "serialization[n=1000,time=100]": lambda: bench_serialization(100, n=1000),
+    "plot[time=100]": lambda: bench_plot(100),
+}
+
+
+def run_benchmarks(names=None):
+    """
+    Run the benchmark suite.
+
+    Parameters:
+    - names (list): Benchmarks to run (keys of `BENCHMARKS`). Defaults to all.
+
+    Returns:
+    - dict: {"environment": {...}, "benchmarks": {name: {"seconds": ..., ...}}}
+    """
+    results = {}
+    for name in names or BENCHMARKS:
+        results[name] = BENCHMARKS[name]()
+        error = results[name].get("error")
+        print(f"{name}: {results[name]['seconds']:.4f} s" + (f" ({error})" if error else ""))
+    return {"environment": environment(), "benchmarks": results}
+
+
+RATES = ("steps_per_second", "runs_per_second")
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare benchmark results with a baseline.
+
+    A benchmark regresses when its throughput (`RATES`, wall time for
+    benchmarks without one) is more than `threshold` (fraction) worse than in
+    the baseline. A benchmark that stopped with an error, or got fewer steps
+    done than the baseline, fails outright. Benchmarks missing from either
+    side are skipped.
+
+    Returns:
+    - list: One dict per shared benchmark with name, baseline and current
+      seconds, the slowdown ratio, the error (if any) and whether it regressed.
+    """
+    report = []
+    for name, current in results["benchmarks"].items():
+        previous = baseline["benchmarks"].get(name)
+        if previous is None:
+            continue
+        rate = next((key for key in RATES if key in current and key in previous), None)
+        if rate is None:
+            ratio = current["seconds"] / previous["seconds"]
+        else:
+            ratio = previous[rate] / current[rate]
+        error = current.get("error")
+        if error is None and current.get("steps", 0) < previous.get("steps", 0):
+            error = f"stopped after {current['steps']} of {previous['steps']} steps"
+        report.append({
+            "name": name,
+            "baseline": previous["seconds"],
+            "current": current["seconds"],
+            "ratio": ratio,
+            "error": error,
+            "regressed": error is not None or ratio > 1 + threshold,
+        })
+    return report
+
+
+def run_and_compare(out_path, baseline_path=None, threshold=0.2):
+    """
+    Run the suite, write the results as JSON and compare with a baseline.
+
+    Parameters:
+    - out_path (str): JSON file for the results.
+    - baseline_path (str): JSON file of an earlier run to compare against.
+    - threshold (float): Allowed slowdown before a benchmark regresses.
+
+    Returns:
+    - bool: True when no benchmark regressed.
+    """
+    results = run_benchmarks()
+    with open(out_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results written to {out_path}")
+    if baseline_path is None:
+        return True
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    report = compare(results, baseline, threshold)
+    for row in report:
+        if row["error"] is not None:
+            status = f"FAILED ({row['error']})"
+        else:
+            status = "REGRESSED" if row["regressed"] else "ok"
+        print(
+            f"{row['name']}: {row['baseline']:.4f} s -> {row['current']:.4f} s "
+            f"(x{row['ratio']:.2f}) {status}"
+        )
+    return not any(row["regressed"] for row in report)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_and_compare(*sys.argv[1:3]) else 1)
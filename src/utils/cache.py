@@ -0,0 +1,144 @@
+import hashlib
+import os
+from collections import OrderedDict
+import numpy as np
+from src.models.parameters import NOISE_NAMES, TREND_NAMES
+from src.models.trajectory import Trajectory
+
+CACHE_DIR = ".gssem_cache"
+
+# Every source of the model package can change a result: the engines, the
+# balancing graph they are generated from, the compiled kernel, forcing, ...
+MODELS_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "models")
+
+_code_versions = {}
+
+
+def code_version(models_dir: str = None):
+    """Hash of the model sources, so results of older code are never reused."""
+    models_dir = models_dir or MODELS_DIR
+    if models_dir not in _code_versions:
+        digest = hashlib.sha256()
+        for name in sorted(os.listdir(models_dir)):
+            if name.endswith(".py"):
+                digest.update(name.encode())
+                with open(os.path.join(models_dir, name), "rb") as f:
+                    digest.update(f.read())
+        _code_versions[models_dir] = digest.hexdigest()
+    return _code_versions[models_dir]
+
+
+def parameter_hash(params, engine: str, dtype=np.float64):
+    """
+    Content hash of everything that determines a run.
+
+    Covers every coefficient and initial state (as float64, so `1000` and
+    `1000.0` agree), the horizon, the noise draws when the Ito process is
+    active, the engine, the storage dtype and `code_version()`.
+
+    Returns:
+    - str: Hex digest, or None when the run is not reproducible (active noise
+      that would be drawn from the global `np.random` state).
+    """
+    noisy = np.any(params.sigmam != 0) or np.any(params.sigmab != 0)
+    if noisy and not all(name in params.__dict__ for name in NOISE_NAMES):
+        return None
+
+    digest = hashlib.sha256()
+    digest.update(f"{engine}|{np.dtype(dtype).str}|{code_version()}".encode())
+    for name in sorted(params.__dict__):
+        # The trends are tabulated from the class parameters on first use
+        if name.startswith("_") or name in TREND_NAMES:
+            continue
+        if name in NOISE_NAMES and not noisy:
+            continue
+        value = np.ascontiguousarray(params.__dict__[name], dtype=np.float64)
+        digest.update(f"|{name}{value.shape}".encode())
+        digest.update(value.tobytes())
+    return digest.hexdigest()
+
+
+class RunCache:
+    """
+    Content-addressed cache of run results, keyed on `parameter_hash`.
+
+    Results are kept in memory (LRU, at most `memory_items` runs) and on disk
+    in `directory` as `<key>.x.npy` / `<key>.y.npy` (LRU by access time, at
+    most `max_bytes`). Returned trajectories are read-only, since they are
+    shared with the cache.
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = 2**30,
+                 memory_items: int = 16):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, key):
+        return (
+            os.path.join(self.directory, f"{key}.x.npy"),
+            os.path.join(self.directory, f"{key}.y.npy"),
+        )
+
+    def _remember(self, key, result):
+        for array in result:
+            array.setflags(write=False)
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """The stored `Trajectory` of `key`, or None."""
+        if key is None:
+            return None
+        x_path, y_path = self._paths(key)
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            result = self._memory[key]
+        else:
+            try:
+                result = Trajectory(np.load(x_path), np.load(y_path))
+            except (OSError, ValueError):
+                return None
+            self._remember(key, result)
+        # Memory hits count as a use too, or the disk LRU would evict them first
+        for path in (x_path, y_path):
+            if os.path.exists(path):
+                os.utime(path)
+        return result
+
+    def put(self, key, result):
+        """Store a `Trajectory` (copied) under `key`."""
+        if key is None:
+            return
+        result = Trajectory(np.array(result.flows), np.array(result.states))
+        x_path, y_path = self._paths(key)
+        # Written under a temporary name first, so readers never see half a file
+        for path, array in zip((x_path, y_path), result):
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(path + ".tmp", path)
+        self._remember(key, result)
+        self._evict()
+
+    def _evict(self):
+        """Delete the least recently used runs until the cap is respected."""
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".npy"):
+                stat = os.stat(os.path.join(self.directory, name))
+                key = name.split(".")[0]
+                size, used = entries.get(key, (0, 0))
+                entries[key] = (size + stat.st_size, max(used, stat.st_mtime))
+        total = sum(size for size, _ in entries.values())
+        for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._memory.pop(key, None)
+            total -= size
@@ -0,0 +1,256 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.trajectory import Trajectory
+
+# Reference output of the original MATLAB model, shipped with the repository
+REFERENCE_PATH = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                              "results", "ResultsGW.mat")
+
+# Stocks and population fitted by default
+TARGET_NAMES = (
+    "P1", "P2", "P3", "H1", "H2", "H3", "C1", "C2", "HH", "ISmass", "RP", "IRP",
+    "numHH",
+)
+
+
+class Calibration(NamedTuple):
+    """
+    Result of `calibrate`.
+
+    - parameters: Best parameter values found, name -> value.
+    - loss: Their loss (see `trajectory_loss`).
+    - history: Best loss after each generation, generation 0 being the
+      initial population.
+    - generations: Generations run, including those of a resumed checkpoint.
+    - evaluations: Simulations run, including those of a resumed checkpoint.
+    - converged: Whether the losses of the population met the tolerance
+      before the generation limit.
+    """
+
+    parameters: dict
+    loss: float
+    history: np.ndarray
+    generations: int
+    evaluations: int
+    converged: bool
+
+
+def trajectory_loss(result, reference, names=TARGET_NAMES):
+    """
+    Normalized squared distance of simulated trajectories to a reference.
+
+    Each series is scaled by the standard deviation of its reference (its
+    largest magnitude when constant), squared errors are averaged over the
+    time steps the reference has values for (NaN marks a gap) and then over
+    `names`, so the loss is unitless and every series weighs the same.
+
+    Parameters:
+    - result (Trajectory): Simulated run or ensemble, shape (*lead, ...).
+    - reference (Trajectory): Target run; only its first `result.time` steps
+      are compared.
+    - names (tuple): Flows and states to compare.
+
+    Returns:
+    - ndarray: Loss per run, shape lead; inf for runs that are not finite.
+    """
+    time = min(result.time, reference.time)
+    total = 0.0
+    for name in names:
+        target = np.asarray(reference[name][:time], dtype=float)
+        observed = np.isfinite(target)
+        if not observed.any():
+            raise ValueError(f"The reference has no values of {name}")
+        scale = np.std(target[observed]) or np.abs(target[observed]).max() or 1.0
+        error = (result[name][..., :time][..., observed] - target[observed]) / scale
+        total = total + np.mean(error**2, axis=-1)
+    loss = total / len(names)
+    return np.where(np.isfinite(loss), loss, np.inf)
+
+
+def _population_loss(time, overrides, reference, names):
+    """Simulate one batch of parameter sets as an ensemble and score it."""
+    ensemble = GSSEMEnsemble(time, overrides=overrides)
+    return trajectory_loss(ensemble.run_simulation(), reference, names)
+
+
+class _Objective:
+    """Loss of a population, as one ensemble or in chunks across a process pool."""
+
+    def __init__(self, bounds, reference, names, time, overrides, workers, chunk_size):
+        self.names = list(bounds)
+        self.low = np.array([low for low, _ in bounds.values()], dtype=float)
+        self.high = np.array([high for _, high in bounds.values()], dtype=float)
+        self.reference = reference
+        self.targets = tuple(names)
+        self.time = time
+        self.overrides = dict(overrides or {})
+        self.chunk_size = chunk_size
+        self.pool = ProcessPoolExecutor(workers) if workers and workers > 1 else None
+
+    def parameters(self, unit):
+        """Parameter values of points in unit coordinates, shape (..., d)."""
+        values = self.low + (self.high - self.low) * unit
+        return {name: values[..., j] for j, name in enumerate(self.names)}
+
+    def __call__(self, unit):
+        samples = self.parameters(unit)
+        chunks = [
+            dict(self.overrides, **{
+                name: values[start:start + self.chunk_size]
+                for name, values in samples.items()
+            })
+            for start in range(0, len(unit), self.chunk_size)
+        ]
+        results = (self.pool.map if self.pool else map)(
+            _population_loss,
+            [self.time] * len(chunks),
+            chunks,
+            [self.reference] * len(chunks),
+            [self.targets] * len(chunks),
+        )
+        return np.concatenate(list(results))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def _save_checkpoint(path, names, population, losses, history, evaluations, rng):
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        names=np.array(names),
+        population=population,
+        losses=losses,
+        history=np.asarray(history),
+        evaluations=evaluations,
+        rng=json.dumps(rng.bit_generator.state),
+    )
+    os.replace(tmp, path)
+
+
+def _load_checkpoint(path, names, rng):
+    with np.load(path) as data:
+        if list(data["names"]) != list(names):
+            raise ValueError(
+                f"Checkpoint {path} calibrates {list(data['names'])}, not {list(names)}"
+            )
+        rng.bit_generator.state = json.loads(str(data["rng"]))
+        return (data["population"], data["losses"], list(data["history"]),
+                int(data["evaluations"]))
+
+
+def calibrate(bounds: dict, reference: Trajectory = None, names=TARGET_NAMES,
+              time: int = None, overrides: dict = None, population: int = None,
+              generations: int = 300, mutation=(0.5, 1.0), crossover: float = 0.7,
+              tol: float = 1e-3, seed: int = 0, workers: int = None,
+              chunk_size: int = 256, checkpoint: str = None, verbose: bool = False):
+    """
+    Fit parameters to reference trajectories by differential evolution.
+
+    Runs DE/best/1/bin with dithered mutation: each generation, every member
+    of the population proposes a trial point (the best member plus a scaled
+    difference of two others, crossed with its own parameters) and keeps it
+    if its loss is lower. A whole generation of trial points is simulated as
+    one `GSSEMEnsemble`, or in chunks of `chunk_size` across `workers`
+    processes.
+
+    Parameters:
+    - bounds (dict): Parameter name -> (low, high), the fitted parameters
+      and their search ranges (see `sensitivity.parameter_bounds`).
+    - reference (Trajectory): Target trajectories, e.g. observed series with
+      NaN for missing values. Defaults to the MATLAB results in
+      `REFERENCE_PATH`.
+    - names (tuple): Flows and states to fit (see `trajectory_loss`).
+    - time (int): Simulation time period; the reference's by default.
+    - overrides (dict): Fixed parameter values of every run.
+    - population (int): Population size; 10 per fitted parameter by default.
+    - generations (int): Generation limit.
+    - mutation (float or tuple): Difference weight, or a (low, high) range
+      drawn from per generation.
+    - crossover (float): Probability of taking each parameter from the
+      mutant.
+    - tol (float): Converged once std(losses) <= tol * |mean(losses)|.
+    - seed (int): Seed of the initial population and of the evolution.
+    - workers (int): Worker processes; the population is evaluated in this
+      process when omitted or 1.
+    - chunk_size (int): Runs per ensemble.
+    - checkpoint (str): `.npz` file written after every generation. When it
+      exists, the calibration resumes from it and continues exactly as the
+      uninterrupted run would have.
+    - verbose (bool): Print the best loss of each generation.
+
+    Returns:
+    - Calibration: The best parameters, their loss and the convergence history.
+    """
+    if reference is None:
+        reference = Trajectory.load_mat(REFERENCE_PATH)
+    time = time or reference.time
+    d = len(bounds)
+    size = population or 10 * d
+    if size < 4:
+        raise ValueError("Differential evolution needs a population of at least 4")
+    rng = np.random.default_rng(seed)
+    objective = _Objective(bounds, reference, names, time, overrides, workers, chunk_size)
+
+    try:
+        if checkpoint is not None and os.path.exists(checkpoint):
+            members, losses, history, evaluations = _load_checkpoint(
+                checkpoint, objective.names, rng
+            )
+        else:
+            # Latin hypercube start: each parameter range is split in `size` strata
+            members = (
+                rng.permuted(np.tile(np.arange(size), (d, 1)), axis=1).T
+                + rng.random((size, d))
+            ) / size
+            losses = objective(members)
+            history, evaluations = [losses.min()], size
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, objective.names, members, losses, history,
+                                 evaluations, rng)
+
+        generation = len(history) - 1
+        converged = bool(np.std(losses) <= tol * np.abs(np.mean(losses)))
+        while generation < generations and not converged:
+            weight = rng.uniform(*mutation) if np.ndim(mutation) else mutation
+            # Two distinct partners per member, other than the member itself
+            others = np.array([rng.choice(size - 1, 2, replace=False) for _ in range(size)])
+            others += others >= np.arange(size)[:, np.newaxis]
+            best = members[np.argmin(losses)]
+            mutant = best + weight * (members[others[:, 0]] - members[others[:, 1]])
+            cross = rng.random((size, d)) < crossover
+            cross[np.arange(size), rng.integers(0, d, size)] = True
+            trial = np.clip(np.where(cross, mutant, members), 0, 1)
+
+            trial_losses = objective(trial)
+            evaluations += size
+            better = trial_losses <= losses
+            members[better], losses[better] = trial[better], trial_losses[better]
+            generation += 1
+            history.append(losses.min())
+            converged = bool(np.std(losses) <= tol * np.abs(np.mean(losses)))
+            if checkpoint is not None:
+                _save_checkpoint(checkpoint, objective.names, members, losses, history,
+                                 evaluations, rng)
+            if verbose:
+                print(f"Generation {generation}: best loss {losses.min():.6g}")
+    finally:
+        objective.close()
+
+    best = np.argmin(losses)
+    return Calibration(
+        parameters={
+            name: float(value)
+            for name, value in objective.parameters(members[best]).items()
+        },
+        loss=float(losses[best]),
+        history=np.array(history),
+        generations=generation,
+        evaluations=evaluations,
+        converged=converged,
+    )
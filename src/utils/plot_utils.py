@@ -1,28 +1,36 @@
 import numpy as np
 import matplotlib.pyplot as plt
+from src.models.trajectory import Trajectory
 
-def plot(x, y):
-    x = np.array(x)
-    y = np.array(y)
+def plot(result, y=None):
+    """
+    Plot the figures of a run.
+
+    Parameters:
+    - result (Trajectory): Result of `GSSEMModel.run_simulation`. The flow and
+      state matrices may also be passed positionally as `plot(x, y)`.
+    """
+    if y is not None:
+        result = Trajectory(np.asarray(result), np.asarray(y))
     # Giả sử dữ liệu đã được chuẩn bị từ trước
     # time = length(x) và các mảng `y`, `yc`, `x` được cung cấp trước
-    time = len(x)  # Thời gian, tương đương với số bước
+    time = result.time  # Thời gian, tương đương với số bước
     t = np.arange(time)  # thời gian cho các biến y
     t2 = np.arange(1, time + 1)  # thời gian cho các biến x
 
     # Các dữ liệu từ y và yc (lấy mẫu từ y và yc)
-    P1 = y[0]
-    P2 = y[1]
-    P3 = y[2]
-    H1 = y[3]
-    H2 = y[4]
-    H3 = y[5]
-    C1 = y[6]
-    C2 = y[7]
-    RP = y[10]
-    IRP = y[11]
-    NumHH = y[12]
-    ERP = y[23]
+    P1 = result["P1"]
+    P2 = result["P2"]
+    P3 = result["P3"]
+    H1 = result["H1"]
+    H2 = result["H2"]
+    H3 = result["H3"]
+    C1 = result["C1"]
+    C2 = result["C2"]
+    RP = result["RP"]
+    IRP = result["IRP"]
+    NumHH = result["numHH"]
+    ERP = result["ERP"]
 
     # P1e = yc[:, 0]
     # P2e = yc[:, 1]
@@ -66,10 +74,10 @@ def plot(x, y):
     ERP = scale_data(ERP)
 
     # Biểu đồ Figure 15
-    Temp = y[26]
+    Temp = result["temp"]
     print(Temp.shape)
-    mHHe = x[:, 73] * 1000
-    mHHgw = x[:, 76] * 1000
+    mHHe = result["cc"] * 1000
+    mHHgw = result["ff"] * 1000
 
     plt.figure(figsize=(14, 8))
     plt.subplot(111)
@@ -85,9 +93,9 @@ def plot(x, y):
     plt.savefig('figs/Figure_15.jpeg', dpi=300)
 
     # Biểu đồ Figure 16
-    beta1 = x[:, 67] * 100
-    beta2 = x[:, 68] * 100
-    beta3 = x[:, 69] * 100
+    beta1 = result["gRPP1"] * 100
+    beta2 = result["gRPP2"] * 100
+    beta3 = result["gRPP3"] * 100
 
     plt.figure(figsize=(14, 8))
     plt.subplot(111)
@@ -162,3 +170,34 @@ def plot(x, y):
     plt.axis([1, 100, -0.2, 1.3])
     plt.tight_layout()
     plt.savefig('figs/Figure_20.jpeg', dpi=300)
+
+
+def plot_fan(statistics, name, levels=(0.05, 0.5, 0.95), path=None):
+    """
+    Fan chart of one variable over ensemble members.
+
+    Parameters:
+    - statistics (EnsembleStatistics): Result of
+      `GSSEMEnsemble.run_statistics` or `monte_carlo`.
+    - name (str): Flow or state to plot.
+    - levels (tuple): Quantile levels; the outermost pairs shade the bands and
+      a middle level is drawn as a line.
+    - path (str): Output file. Defaults to `figs/Fan_<name>.jpeg`.
+    """
+    t = np.arange(statistics.time)
+    bands = statistics.quantiles(name, levels)
+
+    plt.figure(figsize=(14, 8))
+    for k in range(len(levels) // 2):
+        plt.fill_between(t, bands[k], bands[-k - 1], color='b', alpha=0.2,
+                         label=f'{levels[k]:.0%}-{levels[-k - 1]:.0%}')
+    if len(levels) % 2:
+        middle = len(levels) // 2
+        plt.plot(t, bands[middle], 'b-', linewidth=3, label=f'{levels[middle]:.0%}')
+    plt.plot(t, statistics.mean(name), 'r--', linewidth=2, label='Mean')
+    plt.xlabel('Year', fontsize=24)
+    plt.ylabel(name, fontsize=24)
+    plt.legend(loc='best')
+    plt.grid()
+    plt.tight_layout()
+    plt.savefig(path or f'figs/Fan_{name}.jpeg', dpi=300)
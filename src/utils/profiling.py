@@ -0,0 +1,68 @@
+from collections import defaultdict
+from time import perf_counter
+
+
+class PhaseProfile:
+    """
+    Wall time per phase of the time loop and counts of the balancing branches.
+
+    Filled by `GSSEMModel.steps(profile=...)`: each phase adds the time since
+    the previous phase ended, and each balancing branch (e.g. "III P1 rationed",
+    the P1 shortage path of section III) adds one count when it is taken.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.branches = defaultdict(int)
+
+    def lap(self, phase: str, since: float):
+        """Charge the time since `since` to `phase`; returns the current time."""
+        now = perf_counter()
+        self.seconds[phase] += now - since
+        self.calls[phase] += 1
+        return now
+
+    def branch(self, name: str, count: int = 1):
+        """Count a balancing branch being taken."""
+        self.branches[name] += count
+
+    def report(self):
+        """
+        The profile as a plain dict (JSON-serializable).
+
+        Returns:
+        - dict: {"steps", "seconds", "phases": {phase: {"seconds", "calls",
+          "share", "us_per_call"}}, "branches": {branch: {"count", "per_step"}}}
+        """
+        total = sum(self.seconds.values())
+        steps = max(self.calls.values(), default=0)
+        return {
+            "steps": steps,
+            "seconds": total,
+            "phases": {
+                phase: {
+                    "seconds": seconds,
+                    "calls": self.calls[phase],
+                    "share": seconds / total if total else 0.0,
+                    "us_per_call": 1e6 * seconds / self.calls[phase],
+                }
+                for phase, seconds in self.seconds.items()
+            },
+            "branches": {
+                name: {"count": count, "per_step": count / steps if steps else 0.0}
+                for name, count in sorted(self.branches.items())
+            },
+        }
+
+    def __str__(self):
+        report = self.report()
+        lines = [f"{report['steps']} steps in {report['seconds']:.4f} s"]
+        for phase, row in report["phases"].items():
+            lines.append(
+                f"  {phase:<20} {row['seconds']:9.4f} s {100 * row['share']:5.1f}% "
+                f"{row['us_per_call']:8.2f} us/step"
+            )
+        for name, row in report["branches"].items():
+            lines.append(f"  {name:<28} {row['count']:8d} ({row['per_step']:.2%} of steps)")
+        return "\n".join(lines)
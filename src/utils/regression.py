@@ -0,0 +1,156 @@
+import os
+import sys
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.models import GSSEMModel
+from src.models.trajectory import FLOW_NAMES, STATE_NAMES, Trajectory
+
+
+def _scalar_engine(time):
+    return GSSEMModel(time).run_simulation(np.float64, out_dir=None)
+
+
+def _jit_engine(time):
+    # Without Numba the kernel is plain Python, and passing proves nothing
+    from src.models.jit import NUMBA, run_steps
+
+    if not NUMBA:
+        return None
+    model = GSSEMModel(time)
+    result = Trajectory.allocate(time)
+    result.states[:, 0] = model.params.initial_state()
+    run_steps(model.params, result.flows, result.states)
+    return result
+
+
+def _ensemble_engine(time):
+    result = GSSEMEnsemble(time, n=1).run_simulation()
+    return Trajectory(result.flows[0], result.states[0])
+
+
+# Engines under test: name -> function(time) returning a single-run Trajectory,
+# or None when the engine is not available here
+ENGINES = {
+    "scalar": _scalar_engine,
+    "ensemble": _ensemble_engine,
+    "jit": _jit_engine,
+}
+
+# Golden results of the engines, kept apart from `results/`, which every
+# `run_simulation` with the default `out_dir` overwrites. Opened read-only.
+REFERENCE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                             "tests", "fixtures")
+
+# Results of the original MATLAB model, shipped with the repository
+MAT_REFERENCE = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                             "results", "ResultsGW.mat")
+
+# Reference results: name -> (loader, atol, rtol). References without
+# tolerances are only reported: ResultsGW.mat comes from a MATLAB run with
+# constant household mortality (mHH1 = mHH2 = mHH) and birth rates, where the
+# engines follow the 2014 demographic trends, so they part ways after step 0.
+REFERENCES = {
+    "npy": (
+        lambda: Trajectory.load(
+            os.path.join(REFERENCE_DIR, "x_reference.npy"),
+            os.path.join(REFERENCE_DIR, "y_reference.npy"),
+        ),
+        1e-10,
+        1e-9,
+    ),
+    "mat": (lambda: Trajectory.load_mat(MAT_REFERENCE), None, None),
+}
+
+
+def compare(result, reference, atol=None, rtol=None):
+    """
+    Per-column errors of a run against a reference run.
+
+    Columns are compared over the time steps both runs have; NaN in the
+    reference (e.g. flows the MATLAB model does not record) are skipped.
+
+    Parameters:
+    - result, reference (Trajectory): Single runs.
+    - atol, rtol (float): A column passes when every value is within
+      atol + rtol * |reference|. Without tolerances every column passes.
+
+    Returns:
+    - list: One dict per flow and state with name, max_abs and max_rel
+      error (relative to the nonzero reference values) and whether it passed.
+    """
+    time = min(result.time, reference.time)
+    report = []
+    for name in FLOW_NAMES + STATE_NAMES:
+        actual = np.asarray(result[name][:time], dtype=float)
+        expected = np.asarray(reference[name][:time], dtype=float)
+        observed = ~np.isnan(expected)
+        if not observed.any():
+            continue
+        actual, expected = actual[observed], expected[observed]
+        error = np.abs(actual - expected)
+        error[actual == expected] = 0  # equal infinities
+        error[np.isnan(error)] = np.inf
+        relative = np.divide(
+            error, np.abs(expected), out=np.zeros_like(error),
+            where=expected != 0,
+        )
+        passed = atol is None or bool(np.all(error <= atol + rtol * np.abs(expected)))
+        report.append({
+            "name": name,
+            "max_abs": float(error.max()),
+            "max_rel": float(relative.max()),
+            "passed": passed,
+        })
+    return report
+
+
+def run_regression(engines=None, references=None, time: int = 100,
+                   verbose: bool = False):
+    """
+    Run each engine and compare it with each reference.
+
+    Prints the worst columns of every comparison (all columns when
+    `verbose`) and the columns out of tolerance. Engines that are not
+    available (jit without Numba) are reported as skipped. Takes well under
+    a second per engine, so it can run on every change to the engines.
+
+    Parameters:
+    - engines (list): Names in `ENGINES`; all by default.
+    - references (list): Names in `REFERENCES`; all by default.
+    - time (int): Simulation time period; the references hold 100 steps.
+    - verbose (bool): Print every column.
+
+    Returns:
+    - bool: True when every column of every comparison with tolerances passed.
+    """
+    loaded = {name: REFERENCES[name][0]() for name in references or REFERENCES}
+    passed = True
+    for engine in engines or ENGINES:
+        result = ENGINES[engine](time)
+        if result is None:
+            print(f"{engine}: skipped, not available")
+            continue
+        for name, reference in loaded.items():
+            _, atol, rtol = REFERENCES[name]
+            report = compare(result, reference, atol, rtol)
+            failed = [row for row in report if not row["passed"]]
+            passed = passed and not failed
+            tolerance = "report only" if atol is None else f"atol={atol:g} rtol={rtol:g}"
+            status = f"{len(failed)} columns FAILED" if failed else "ok"
+            if atol is None:
+                status = "largest errors"
+            print(f"{engine} vs {name} ({tolerance}): {status}")
+            rows = report if verbose else sorted(
+                report, key=lambda row: -row["max_abs"]
+            )[:5]
+            for row in failed + [row for row in rows if row["passed"]]:
+                mark = "" if row["passed"] else " FAILED"
+                print(
+                    f"  {row['name']}: max abs {row['max_abs']:.3g}, "
+                    f"max rel {row['max_rel']:.3g}{mark}"
+                )
+    return passed
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_regression(sys.argv[1:] or None) else 1)
@@ -0,0 +1,319 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.parameters import Parameters
+from src.models.trajectory import flow_index, state_index
+
+# Independent scalar coefficients of `Parameters`. Values derived from others
+# when the parameters are built (aw_k, phi_k, aEE, Wgid, ...), initial states,
+# coefficients that are zero by default and those no engine reads (etaa, Wid)
+# are left out.
+COEFFICIENTS = (
+    "belownoreproduction", "tempo", "gRPP1p", "gRPP2p", "gRPP3p", "gP2H2",
+    "gP2H3", "gP3H3", "gH2C1", "gH2C2", "gH3C2", "rIRPP2", "rIRPP3", "mP2",
+    "mP3", "mH2", "mH3", "mC1", "mC2", "RPIRP", "gP1H2", "gH1C1", "mP1", "mH1",
+    "aw", "cw", "dw", "aP1", "bP1", "cP1", "aP1p", "bP1p", "cP1p", "aH1", "bH1",
+    "cH1", "aH1p", "bH1p", "cH1p", "aIS", "bIS", "cIS", "aISp", "bISp", "cISp",
+    "dP1H1", "eP1H1", "fP1H1", "gP1H1", "dP1HH", "zP1HH", "kP1HH", "mP1HH",
+    "dH1HH", "zH1HH", "kH1HH", "mH1HH", "dISHH", "zISHH", "kISHH", "mISHH",
+    "nISHH", "khat", "theta", "lambda_", "mHH", "H1bar", "etab", "phi",
+    "idealpercapmass", "dEEHH", "zEEHH", "kEEHH", "mEEHH", "nEEHH", "gammaEEIS",
+    "gammaEEIRP", "psi", "ppmCO2eq", "GtCO2eqStb",
+)
+
+# Scalar outputs of a run: name -> (flow or state, reduction over time)
+OUTPUTS = {
+    "final numHH": ("numHH", "last"),
+    "peak CO2eq": ("CO2eq", "max"),
+    "min RP": ("RP", "min"),
+}
+
+_REDUCTIONS = {"last": lambda total, value: value, "max": np.fmax, "min": np.fmin,
+               "mean": np.add}
+
+
+def parameter_bounds(names=COEFFICIENTS, spread: float = 0.1, time: int = 100):
+    """
+    Ranges of +/- `spread` (fraction) around the default parameter values.
+
+    Returns:
+    - dict: Parameter name -> (low, high).
+    """
+    params = Parameters(time)
+    bounds = {}
+    for name in names:
+        value = getattr(params, name)
+        bounds[name] = tuple(sorted((value * (1 - spread), value * (1 + spread))))
+    return bounds
+
+
+def _scale(unit, bounds):
+    """Map unit-hypercube rows (N, d) onto the bounds, as a sample table."""
+    return {
+        name: low + (high - low) * unit[:, j]
+        for j, (name, (low, high)) in enumerate(bounds.items())
+    }
+
+
+def _evaluate_chunk(time, overrides, outputs):
+    """Run one chunk as an ensemble, reducing each member to its outputs."""
+    ensemble = GSSEMEnsemble(time, overrides=overrides)
+    n = ensemble.n
+    flow_rows = flow_index(ensemble.params.classes)
+    state_rows = state_index(ensemble.params.classes)
+    totals = {}
+
+    def fold(variable, values):
+        for output, (name, how) in outputs.items():
+            if name == variable:
+                values = np.broadcast_to(values, (n,))
+                previous = totals.get(output)
+                totals[output] = (
+                    np.array(values, dtype=float)
+                    if previous is None
+                    else _REDUCTIONS[how](previous, values)
+                )
+
+    flows = {name for name, _ in outputs.values() if name in flow_rows}
+    states = {name for name, _ in outputs.values() if name not in flow_rows}
+    # States are folded one index late, after a step may have zeroed ERP
+    pending, pending_index = ensemble.initial_state(), 0
+    for record in ensemble.steps():
+        for name in flows:
+            fold(name, record[name])
+        if record.index > pending_index:
+            for name in states:
+                fold(name, record.ERP if name == "ERP" else pending[state_rows[name]])
+        pending, pending_index = record.state, record.index
+    for name in states:
+        fold(name, pending[state_rows[name]])
+
+    # Flows are folded once per step and states once per time index
+    for output, (name, how) in outputs.items():
+        if how == "mean":
+            totals[output] = totals[output] / time
+    return totals
+
+
+def evaluate(samples: dict, outputs: dict = OUTPUTS, time: int = 100,
+             chunk_size: int = 4096, workers: int = None):
+    """
+    Run every row of a sample table and reduce each run to scalar outputs.
+
+    The table is split into chunks of `chunk_size` runs, each simulated as one
+    `GSSEMEnsemble` in a process pool and reduced while it steps, so memory is
+    O(chunk_size) per worker and no trajectory is kept.
+
+    Parameters:
+    - samples (dict): Parameter name -> array of N values.
+    - outputs (dict): Output name -> (flow or state name, "last", "max",
+      "min" or "mean" over the run); see `OUTPUTS`.
+    - time (int): Simulation time period.
+    - chunk_size (int): Runs per ensemble.
+    - workers (int): Worker processes. Defaults to all cores.
+
+    Returns:
+    - dict: Output name -> array of N values, in the order of the samples.
+    """
+    samples = {name: np.asarray(values, dtype=float) for name, values in samples.items()}
+    n = len(next(iter(samples.values())))
+    chunks = [
+        {name: values[start:start + chunk_size] for name, values in samples.items()}
+        for start in range(0, n, chunk_size)
+    ]
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        results = list(
+            pool.map(
+                _evaluate_chunk,
+                [time] * len(chunks),
+                chunks,
+                [outputs] * len(chunks),
+            )
+        )
+    return {
+        output: np.concatenate([result[output] for result in results])
+        for output in outputs
+    }
+
+
+def saltelli_design(bounds: dict, n: int, seed: int = 0):
+    """
+    Sample table for Sobol indices (Saltelli 2010).
+
+    Two independent base samples A and B of n points are followed by the d
+    matrices A_B(j), A with column j taken from B: n (d + 2) runs in total.
+
+    Returns:
+    - dict: Parameter name -> array of n (d + 2) values.
+    """
+    d = len(bounds)
+    rng = np.random.default_rng(seed)
+    base = rng.random((n, 2 * d))
+    A, B = base[:, :d], base[:, d:]
+    blocks = [A, B]
+    for j in range(d):
+        AB = A.copy()
+        AB[:, j] = B[:, j]
+        blocks.append(AB)
+    return _scale(np.vstack(blocks), bounds)
+
+
+def _interval(draws, level):
+    """Percentile interval of bootstrap draws along the first axis, shape (d, 2)."""
+    tail = 100 * (1 - level) / 2
+    return np.percentile(draws, [tail, 100 - tail], axis=0).T
+
+
+def sobol_indices(values, names, bootstrap: int = 1000, level: float = 0.95,
+                  seed: int = 0):
+    """
+    First-order and total Sobol indices from the runs of `saltelli_design`.
+
+    Uses the Saltelli (2010) estimator of S1 and the Jansen estimator of ST.
+    Confidence intervals are percentile intervals over `bootstrap`
+    resamplings of the n base points.
+
+    Parameters:
+    - values (array): Output of the n (d + 2) runs, in design order.
+    - names (list): The d parameter names, in design order.
+
+    Returns:
+    - dict: {"names", "S1", "S1_interval", "ST", "ST_interval"}; indices have
+      shape (d,) and intervals (d, 2).
+    """
+    names = list(names)
+    d = len(names)
+    values = np.asarray(values, dtype=float)
+    n = len(values) // (d + 2)
+    fA, fB = values[:n], values[n:2 * n]
+    fAB = values[2 * n:].reshape(d, n)
+
+    def estimate(rows):
+        a, b = fA[rows], fB[rows]
+        both = np.concatenate([a, b], axis=-1)
+        # Centered outputs keep S1 independent of a constant offset
+        mean = np.mean(both, axis=-1, keepdims=True)
+        a, b = a - mean, b - mean
+        var = np.var(both, axis=-1)
+        first, total = [], []
+        for j in range(d):
+            ab = fAB[j][rows] - mean
+            first.append(np.mean(b * (ab - a), axis=-1) / var)
+            total.append(0.5 * np.mean((a - ab) ** 2, axis=-1) / var)
+        return np.array(first), np.array(total)
+
+    S1, ST = estimate(np.arange(n))
+    rows = np.random.default_rng(seed).integers(0, n, size=(bootstrap, n))
+    S1_draws, ST_draws = estimate(rows)
+    return {
+        "names": names,
+        "S1": S1,
+        "S1_interval": _interval(S1_draws.T, level),
+        "ST": ST,
+        "ST_interval": _interval(ST_draws.T, level),
+    }
+
+
+def morris_design(bounds: dict, trajectories: int, levels: int = 4, seed: int = 0):
+    """
+    Sample table for Morris elementary effects.
+
+    Each trajectory starts at a random point of a grid with `levels` values
+    per parameter and moves one parameter at a time, in random order and
+    direction, by delta = levels / (2 (levels - 1)): r (d + 1) runs in total.
+
+    Returns:
+    - samples (dict): Parameter name -> array of r (d + 1) values.
+    - steps (tuple): (signed, order), the signed step of each parameter in
+      unit coordinates and the order in which the parameters move, both of
+      shape (r, d); pass it on to `morris_indices`.
+    """
+    d = len(bounds)
+    rng = np.random.default_rng(seed)
+    delta = levels / (2 * (levels - 1))
+    grid = np.arange(levels // 2) / (levels - 1)
+    points = np.empty((trajectories, d + 1, d))
+    order = np.array([rng.permutation(d) for _ in range(trajectories)])
+    up = rng.random((trajectories, d)) < 0.5
+    start = rng.choice(grid, size=(trajectories, d))
+    points[:, 0] = np.where(up, start, start + delta)
+    signed = np.where(up, delta, -delta)
+    for k in range(d):
+        points[:, k + 1] = points[:, k]
+        moved = order[:, k]
+        rows = np.arange(trajectories)
+        points[rows, k + 1, moved] += signed[rows, moved]
+    return _scale(points.reshape(-1, d), bounds), (signed, order)
+
+
+def morris_indices(values, names, steps, bootstrap: int = 1000, level: float = 0.95,
+                   seed: int = 0):
+    """
+    Morris screening measures from the runs of `morris_design`.
+
+    Elementary effects are per unit of each parameter's range. mu is their
+    mean, mu_star the mean of their absolute values (the overall influence)
+    and sigma their standard deviation (interactions and nonlinearity). The
+    interval of mu_star is a percentile interval over `bootstrap`
+    resamplings of the trajectories.
+
+    Returns:
+    - dict: {"names", "mu", "mu_star", "mu_star_interval", "sigma"}.
+    """
+    names = list(names)
+    d = len(names)
+    signed, order = steps
+    values = np.asarray(values, dtype=float).reshape(-1, d + 1)
+    r = len(values)
+    rows = np.arange(r)[:, np.newaxis]
+    effects = np.empty((r, d))
+    effects[rows, order] = np.diff(values, axis=1) / signed[rows, order]
+
+    resampled = np.random.default_rng(seed).integers(0, r, size=(bootstrap, r))
+    mu_star_draws = np.abs(effects)[resampled].mean(axis=1)
+    return {
+        "names": names,
+        "mu": effects.mean(axis=0),
+        "mu_star": np.abs(effects).mean(axis=0),
+        "mu_star_interval": _interval(mu_star_draws, level),
+        "sigma": effects.std(axis=0, ddof=1) if r > 1 else np.zeros(d),
+    }
+
+
+def sobol_analysis(bounds: dict, n: int = 1024, outputs: dict = OUTPUTS,
+                   time: int = 100, seed: int = 0, bootstrap: int = 1000,
+                   level: float = 0.95, chunk_size: int = 4096, workers: int = None):
+    """
+    Sobol indices of the outputs with respect to the parameters in `bounds`.
+
+    Runs n (d + 2) simulations (see `saltelli_design` and `evaluate`), e.g.
+    82 000 for the 80 `COEFFICIENTS` at n = 1000.
+
+    Returns:
+    - dict: Output name -> `sobol_indices` result.
+    """
+    samples = saltelli_design(bounds, n, seed)
+    results = evaluate(samples, outputs, time, chunk_size, workers)
+    return {
+        output: sobol_indices(values, bounds, bootstrap, level, seed)
+        for output, values in results.items()
+    }
+
+
+def morris_analysis(bounds: dict, trajectories: int = 100, levels: int = 4,
+                    outputs: dict = OUTPUTS, time: int = 100, seed: int = 0,
+                    bootstrap: int = 1000, level: float = 0.95,
+                    chunk_size: int = 4096, workers: int = None):
+    """
+    Morris screening of the parameters in `bounds`, r (d + 1) simulations.
+
+    Returns:
+    - dict: Output name -> `morris_indices` result.
+    """
+    samples, steps = morris_design(bounds, trajectories, levels, seed)
+    results = evaluate(samples, outputs, time, chunk_size, workers)
+    return {
+        output: morris_indices(values, bounds, steps, bootstrap, level, seed)
+        for output, values in results.items()
+    }
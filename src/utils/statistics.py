@@ -0,0 +1,201 @@
+from math import log
+import numpy as np
+
+# Variables summarized by default, and the quantile levels of a 5/50/95% fan
+SUMMARY_NAMES = ("numHH", "CO2eq", "temp", "RP")
+QUANTILES = (0.05, 0.5, 0.95)
+
+
+class RunningStats:
+    """
+    Streaming mean and variance of one variable at every time step.
+
+    Batches of values (e.g. the members of an ensemble at step t) are folded in
+    with Welford's update in its batched form (Chan et al.), so nothing but
+    three arrays of length `time` is kept. Two instances fed with disjoint
+    members combine with `merge`. Non-finite values (diverged members) are
+    left out; `count` tells how many values each step holds.
+    """
+
+    def __init__(self, time: int):
+        self.count = np.zeros(time, dtype=np.int64)
+        self._mean = np.zeros(time)
+        self._m2 = np.zeros(time)
+
+    def update(self, t: int, values):
+        """Add a batch of values observed at time step t."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        if not len(values):
+            return
+        mean = values.mean()
+        self._combine(t, len(values), mean, ((values - mean) ** 2).sum())
+
+    def merge(self, other):
+        """Fold in the statistics of another instance (same time period)."""
+        self._combine(slice(None), other.count, other._mean, other._m2)
+        return self
+
+    def _combine(self, t, count, mean, m2):
+        total = self.count[t] + count
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = mean - self._mean[t]
+            weight = np.where(total > 0, count / np.maximum(total, 1), 0)
+            self._m2[t] = self._m2[t] + m2 + delta**2 * self.count[t] * weight
+            self._mean[t] = self._mean[t] + delta * weight
+        self.count[t] = total
+
+    @property
+    def mean(self):
+        return np.where(self.count > 0, self._mean, np.nan)
+
+    @property
+    def var(self):
+        """Population variance over the values of each step."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self._m2 / self.count, np.nan)
+
+    @property
+    def std(self):
+        return np.sqrt(self.var)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch of one variable at every time step.
+
+    Values are counted in logarithmic buckets (the DDSketch scheme): a value x
+    falls in bucket ceil(log_gamma |x|) with gamma = (1 + a) / (1 - a), so any
+    quantile is returned within a relative error `a` of an actual value,
+    whatever the number of values. Memory grows with the spread of the values
+    (about 1150 buckets per decade at a = 0.1%), not with their number. Merging
+    adds bucket counts, so the result does not depend on how the values were
+    split or in which order the sketches are merged. Non-finite values are
+    left out.
+    """
+
+    def __init__(self, time: int, relative_accuracy: float = 0.001):
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = log(self._gamma)
+        self._positive = [{} for _ in range(time)]
+        self._negative = [{} for _ in range(time)]
+        self._zero = np.zeros(time, dtype=np.int64)
+
+    def update(self, t: int, values):
+        """Add a batch of values observed at time step t."""
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[np.isfinite(values)]
+        self._zero[t] += np.count_nonzero(values == 0)
+        for buckets, side in (
+            (self._positive[t], values[values > 0]),
+            (self._negative[t], -values[values < 0]),
+        ):
+            if len(side):
+                keys, counts = np.unique(
+                    np.ceil(np.log(side) / self._log_gamma).astype(np.int64),
+                    return_counts=True,
+                )
+                for key, count in zip(keys.tolist(), counts.tolist()):
+                    buckets[key] = buckets.get(key, 0) + count
+
+    def merge(self, other):
+        """Fold in the buckets of another sketch (same time and accuracy)."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches with different accuracies cannot be merged")
+        for mine, theirs in zip(
+            self._positive + self._negative, other._positive + other._negative
+        ):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        self._zero += other._zero
+        return self
+
+    def _value(self, key):
+        return 2 * self._gamma**key / (self._gamma + 1)
+
+    def quantile(self, q: float):
+        """Quantile q (0..1) at every step; NaN for steps without values."""
+        result = np.full(len(self._zero), np.nan)
+        for t, (positive, negative, zero) in enumerate(
+            zip(self._positive, self._negative, self._zero)
+        ):
+            # Buckets in increasing order of value
+            buckets = [
+                (-self._value(key), count)
+                for key, count in sorted(negative.items(), reverse=True)
+            ]
+            buckets.append((0.0, int(zero)))
+            buckets += [
+                (self._value(key), count) for key, count in sorted(positive.items())
+            ]
+            total = sum(count for _, count in buckets)
+            if not total:
+                continue
+            rank = q * (total - 1)
+            seen = 0
+            for value, count in buckets:
+                seen += count
+                if seen > rank:
+                    result[t] = value
+                    break
+        return result
+
+
+class EnsembleStatistics:
+    """
+    Streaming per-step statistics of several variables over ensemble members.
+
+    Holds a `RunningStats` and a `QuantileSketch` per variable, so a fan chart
+    of any number of members needs O(time) memory. Fed by
+    `GSSEMEnsemble.run_statistics`; instances built for disjoint members (e.g.
+    one per worker process) combine with `merge`.
+
+    `stats["temp"]` gives {"mean": (time,), "var": (time,), "quantiles":
+    (len(QUANTILES), time)}.
+    """
+
+    def __init__(self, time: int, names=SUMMARY_NAMES, relative_accuracy: float = 0.001):
+        self.time = time
+        self.names = tuple(names)
+        self.moments = {name: RunningStats(time) for name in self.names}
+        self.sketches = {
+            name: QuantileSketch(time, relative_accuracy) for name in self.names
+        }
+
+    def update(self, name: str, t: int, values):
+        """Add the values of `name` at time step t."""
+        self.moments[name].update(t, values)
+        self.sketches[name].update(t, values)
+
+    def merge(self, other):
+        """Fold in another instance with the same time period and names."""
+        if (other.time, other.names) != (self.time, self.names):
+            raise ValueError("Statistics of different runs cannot be merged")
+        for name in self.names:
+            self.moments[name].merge(other.moments[name])
+            self.sketches[name].merge(other.sketches[name])
+        return self
+
+    def count(self, name: str):
+        return self.moments[name].count
+
+    def mean(self, name: str):
+        return self.moments[name].mean
+
+    def var(self, name: str):
+        return self.moments[name].var
+
+    def std(self, name: str):
+        return self.moments[name].std
+
+    def quantiles(self, name: str, levels=QUANTILES):
+        """Quantiles of `name`, shape (len(levels), time)."""
+        return np.array([self.sketches[name].quantile(q) for q in levels])
+
+    def __getitem__(self, name):
+        return {
+            "mean": self.mean(name),
+            "var": self.var(name),
+            "quantiles": self.quantiles(name),
+        }
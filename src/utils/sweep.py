@@ -0,0 +1,230 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.parameters import Parameters
+from src.models.trajectory import Trajectory, flow_index, state_index
+from src.utils.cache import parameter_hash
+
+
+def parameter_grid(grid: dict):
+    """
+    Expand a parameter grid into a sample table.
+
+    Parameters:
+    - grid (dict): Parameter name -> list of values.
+
+    Returns:
+    - dict: Parameter name -> array holding every combination of the grid.
+    """
+    names = list(grid)
+    axes = np.meshgrid(*(np.atleast_1d(grid[name]) for name in names), indexing="ij")
+    return {name: axis.ravel().astype(float) for name, axis in zip(names, axes)}
+
+
+def load_samples(path: str):
+    """
+    Read a sample table from a `.json` grid or a `.csv` table.
+
+    The JSON file maps parameter names to lists of values and is expanded with
+    `parameter_grid`. The CSV file has one parameter per column (header row
+    with the names) and one run per row.
+    """
+    if path.endswith(".json"):
+        with open(path) as f:
+            return parameter_grid(json.load(f))
+    table = np.genfromtxt(path, delimiter=",", names=True, ndmin=1)
+    return {name: np.asarray(table[name], dtype=float) for name in table.dtype.names}
+
+
+def _run_chunk(time, overrides, stop=None):
+    """Run one chunk of the sweep as an ensemble (executed in a worker)."""
+    ensemble = GSSEMEnsemble(time, overrides=overrides)
+    x, y = ensemble.run_simulation(stop=stop)
+    return x, y, ensemble.stop_time, ensemble.stop_reason.astype(str)
+
+
+def _open_store(out_dir, samples, time, chunk_size, stop=None):
+    """Create the sweep store, or reopen it to resume an interrupted sweep."""
+    n = len(next(iter(samples.values())))
+    n_chunks = -(-n // chunk_size)
+    # The layout of x and y depends on the number of household classes
+    first = {name: values[0] for name, values in samples.items()}
+    classes = Parameters(time, first).classes
+    manifest = {
+        "time": time,
+        "n": n,
+        "chunk_size": chunk_size,
+        "names": list(samples),
+        # Resumed chunks must stop on the same criteria as the finished ones
+        "stop": None if stop is None else stop.settings(),
+    }
+    manifest_path = os.path.join(out_dir, "manifest.json")
+
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            stored = json.load(f)
+        stored_samples = np.load(os.path.join(out_dir, "samples.npz"))
+        same_samples = all(
+            np.array_equal(stored_samples[name], samples[name]) for name in samples
+        )
+        if stored != manifest or not same_samples:
+            raise ValueError(
+                f"{out_dir} holds a different sweep; use a new output directory"
+            )
+        mode = "r+"
+    else:
+        os.makedirs(out_dir, exist_ok=True)
+        np.savez(os.path.join(out_dir, "samples.npz"), **samples)
+        mode = "w+"
+
+    flows, states = len(flow_index(classes)), len(state_index(classes))
+    x = np.lib.format.open_memmap(
+        os.path.join(out_dir, "x.npy"), mode=mode, shape=(n, time, flows)
+    )
+    y = np.lib.format.open_memmap(
+        os.path.join(out_dir, "y.npy"), mode=mode, shape=(n, states, time)
+    )
+    done = np.lib.format.open_memmap(
+        os.path.join(out_dir, "done.npy"), mode=mode, dtype=bool, shape=(n_chunks,)
+    )
+    stop_time = np.lib.format.open_memmap(
+        os.path.join(out_dir, "stop_time.npy"), mode=mode, dtype=np.int64, shape=(n,)
+    )
+    stop_reason = np.lib.format.open_memmap(
+        os.path.join(out_dir, "stop_reason.npy"), mode=mode, dtype="U32", shape=(n,)
+    )
+    if mode == "w+":
+        stop_time[:] = time - 1
+        # Written last, so a directory without it is never mistaken for a sweep
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f)
+    return x, y, done, stop_time, stop_reason
+
+
+def _point_keys(samples, rows, time):
+    """`parameter_hash` of each sample row, as a single ensemble member."""
+    return [
+        parameter_hash(
+            Parameters(time, {name: values[i] for name, values in samples.items()}),
+            GSSEMEnsemble.__name__,
+        )
+        for i in rows
+    ]
+
+
+def run_sweep(samples: dict, out_dir: str, time: int = 100, chunk_size: int = 256,
+              workers: int = None, cache=None, stop=None):
+    """
+    Run a parameter sweep across a process pool.
+
+    The sample table is split into chunks of `chunk_size` runs. Each worker
+    simulates a chunk as one `GSSEMEnsemble`, so per-worker memory is bounded
+    by the chunk size. Finished chunks are written into a single store in
+    `out_dir` as soon as they arrive: `x.npy` (N, time, 77), `y.npy`
+    (N, 49, time) (with the columns and rows of classes 3 to K after those,
+    see `flow_names`), the sample table in `samples.npz`, a per-chunk
+    `done.npy` flag, and per run the `stop_time.npy` and `stop_reason.npy` of
+    `stop`. Calling `run_sweep` again with the same arguments resumes an
+    interrupted sweep and only runs the missing chunks.
+
+    Parameters:
+    - samples (dict): Parameter name -> array of N values (see `parameter_grid`).
+    - out_dir (str): Directory of the output store.
+    - time (int): Simulation time period.
+    - chunk_size (int): Runs per chunk.
+    - workers (int): Worker processes. Defaults to all cores.
+    - cache (RunCache): Runs found in the cache (e.g. from an earlier sweep
+      over overlapping points) are copied into the store instead of being
+      simulated; only the remaining runs of a chunk go to a worker, and their
+      results are added to the cache.
+    - stop (StopCriteria): Retire runs early (see `GSSEMEnsemble.steps`); the
+      steps after a run stopped are left as NaN. The cache is not used, as it
+      holds complete runs.
+    """
+    samples = {name: np.asarray(values, dtype=float) for name, values in samples.items()}
+    x, y, done, stop_time, stop_reason = _open_store(
+        out_dir, samples, time, chunk_size, stop
+    )
+    if stop is not None:
+        cache = None
+    n = x.shape[0]
+    workers = workers or os.cpu_count()
+    todo = iter([k for k in range(len(done)) if not done[k]])
+    print(f"Sweep of {n} runs: {int(done.sum())}/{len(done)} chunks already done.")
+
+    with ProcessPoolExecutor(workers) as pool:
+        pending = {}
+        while True:
+            # Keep a bounded number of chunks in flight
+            for k in todo:
+                rows = np.arange(k * chunk_size, min((k + 1) * chunk_size, n))
+                keys = [None] * len(rows)
+                if cache is not None:
+                    keys = _point_keys(samples, rows, time)
+                    hits = [cache.get(key) for key in keys]
+                    for i, hit in zip(rows, hits):
+                        if hit is not None:
+                            x[i], y[i] = hit
+                    missing = [j for j, hit in enumerate(hits) if hit is None]
+                    rows, keys = rows[missing], [keys[j] for j in missing]
+                    if not len(rows):
+                        x.flush()
+                        y.flush()
+                        done[k] = True
+                        done.flush()
+                        continue
+                chunk = {name: values[rows] for name, values in samples.items()}
+                pending[pool.submit(_run_chunk, time, chunk, stop)] = k, rows, keys
+                if len(pending) >= 2 * workers:
+                    break
+            if not pending:
+                break
+
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                k, rows, keys = pending.pop(future)
+                chunk_x, chunk_y, stop_time[rows], stop_reason[rows] = future.result()
+                x[rows], y[rows] = chunk_x, chunk_y
+                if cache is not None:
+                    for key, flows, states in zip(keys, chunk_x, chunk_y):
+                        cache.put(key, Trajectory(flows, states))
+                for store in (x, y, stop_time, stop_reason):
+                    store.flush()
+                done[k] = True
+                done.flush()
+            print(f"Chunks done: {int(done.sum())}/{len(done)}")
+
+    return out_dir
+
+
+def load_sweep(out_dir: str):
+    """
+    Open a sweep store without loading it into memory.
+
+    Returns:
+    - samples (dict): Parameter name -> array of N values.
+    - x (memmap): Flows, shape (N, time, 77 + 7(K - 2)) for K classes.
+    - y (memmap): States, shape (N, 49 + 2(K - 2), time).
+    - done (ndarray): Per-chunk completion flags.
+    """
+    samples = dict(np.load(os.path.join(out_dir, "samples.npz")))
+    x = np.load(os.path.join(out_dir, "x.npy"), mmap_mode="r")
+    y = np.load(os.path.join(out_dir, "y.npy"), mmap_mode="r")
+    done = np.load(os.path.join(out_dir, "done.npy"))
+    return samples, x, y, done
+
+
+def load_stops(out_dir: str):
+    """
+    Stop records of a sweep run with `stop` criteria.
+
+    Returns:
+    - stop_time (ndarray): Time index of each run's last state, shape (N,).
+    - stop_reason (ndarray): Why each run stopped, "" for the runs that
+      reached the horizon.
+    """
+    stop_time = np.load(os.path.join(out_dir, "stop_time.npy"))
+    stop_reason = np.load(os.path.join(out_dir, "stop_reason.npy"))
+    return stop_time, stop_reason
@@ -0,0 +1,39 @@
+from src.utils.benchmark import bench_single_run, compare
+
+
+def _results(**benchmarks):
+    return {"benchmarks": benchmarks}
+
+
+def test_crashed_run_fails_even_when_faster():
+    baseline = _results(run={"seconds": 1.0, "steps": 1000, "steps_per_second": 1000.0,
+                             "error": None})
+    crashed = _results(run={"seconds": 0.1, "steps": 100, "steps_per_second": 1000.0,
+                            "error": "OverflowError: overflow"})
+    (row,) = compare(crashed, baseline)
+    assert row["regressed"]
+    assert row["error"].startswith("OverflowError")
+
+
+def test_short_run_fails():
+    baseline = _results(run={"seconds": 1.0, "steps": 1000, "steps_per_second": 1000.0})
+    short = _results(run={"seconds": 0.5, "steps": 500, "steps_per_second": 1000.0})
+    (row,) = compare(short, baseline)
+    assert row["regressed"]
+    assert "500 of 1000" in row["error"]
+
+
+def test_compares_throughput():
+    baseline = _results(ensemble={"seconds": 1.0, "runs_per_second": 100.0},
+                        parameters={"seconds": 1.0})
+    current = _results(ensemble={"seconds": 1.0, "runs_per_second": 50.0},
+                       parameters={"seconds": 1.1})
+    rows = {row["name"]: row for row in compare(current, baseline)}
+    assert rows["ensemble"]["ratio"] == 2.0 and rows["ensemble"]["regressed"]
+    assert not rows["parameters"]["regressed"]
+
+
+def test_single_run_reports_overflow():
+    result = bench_single_run(16_000)
+    assert result["error"].startswith("OverflowError")
+    assert result["steps"] < 16_000
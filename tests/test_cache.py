@@ -0,0 +1,91 @@
+import os
+import shutil
+import time
+import numpy as np
+from src.models.models import GSSEMModel
+from src.models.parameters import Parameters
+from src.models.trajectory import Trajectory
+from src.utils import cache
+from src.utils.cache import RunCache, parameter_hash
+
+TIME = 40
+
+
+def test_editing_a_graph_rule_misses_the_cache(tmp_path, monkeypatch):
+    models_dir = tmp_path / "models"
+    shutil.copytree(cache.MODELS_DIR, models_dir)
+    monkeypatch.setattr(cache, "MODELS_DIR", str(models_dir))
+    params = Parameters(10)
+    store = RunCache(str(tmp_path / "cache"))
+    key = parameter_hash(params, "GSSEMModel")
+    store.put(key, Trajectory.allocate(10))
+    assert store.get(parameter_hash(params, "GSSEMModel")) is not None
+
+    graph = models_dir / "graph.py"
+    source = graph.read_text()
+    rule = 'Flow("H3C2", "p.gH3C2 * H3 * C2")'
+    assert rule in source
+    graph.write_text(source.replace(rule, 'Flow("H3C2", "0.5 * p.gH3C2 * H3 * C2")'))
+    cache._code_versions.clear()
+    edited = parameter_hash(params, "GSSEMModel")
+    assert edited != key
+    assert store.get(edited) is None
+
+
+def test_every_model_source_is_hashed(tmp_path):
+    shutil.copytree(cache.MODELS_DIR, tmp_path / "models")
+    before = cache.code_version(str(tmp_path / "models"))
+    with open(tmp_path / "models" / "jit.py", "a") as f:
+        f.write("\n# edited\n")
+    cache._code_versions.clear()
+    assert cache.code_version(str(tmp_path / "models")) != before
+
+
+def test_a_hit_returns_the_stored_run(tmp_path):
+    store = RunCache(str(tmp_path))
+    first = GSSEMModel(TIME).run_simulation(out_dir=None, cache=store)
+    hit = GSSEMModel(TIME).run_simulation(out_dir=None, cache=store)
+    assert hit is store.get(parameter_hash(Parameters(TIME), "GSSEMModel"))
+    np.testing.assert_array_equal(hit.flows, first.flows)
+    np.testing.assert_array_equal(hit.states, first.states)
+    assert not hit.flows.flags.writeable
+    # A new cache over the same directory reads the run back from disk
+    again = GSSEMModel(TIME).run_simulation(out_dir=None, cache=RunCache(str(tmp_path)))
+    np.testing.assert_array_equal(again.flows, first.flows)
+    np.testing.assert_array_equal(again.states, first.states)
+
+
+def test_a_changed_parameter_or_code_version_misses(tmp_path, monkeypatch):
+    store = RunCache(str(tmp_path))
+    key = parameter_hash(Parameters(TIME), "GSSEMModel")
+    store.put(key, GSSEMModel(TIME).run_simulation(out_dir=None))
+    assert store.get(parameter_hash(Parameters(TIME), "GSSEMModel")) is not None
+    assert store.get(parameter_hash(Parameters(TIME, {"phi": 11.0}), "GSSEMModel")) is None
+    assert store.get(parameter_hash(Parameters(TIME + 1), "GSSEMModel")) is None
+    assert store.get(parameter_hash(Parameters(TIME), "GSSEMEnsemble")) is None
+    monkeypatch.setattr(cache, "code_version", lambda models_dir=None: "edited")
+    assert store.get(parameter_hash(Parameters(TIME), "GSSEMModel")) is None
+
+
+def test_eviction_keeps_the_most_recently_used_runs(tmp_path):
+    result = Trajectory.allocate(TIME)
+    probe = RunCache(str(tmp_path / "probe"))
+    probe.put("probe", result)
+    size = sum(os.path.getsize(path) for path in probe._paths("probe"))
+
+    store = RunCache(str(tmp_path / "cache"), max_bytes=2 * size)
+    store.put("a", result)
+    store.put("b", result)
+    # File times are coarse: date the writes apart so their order is known
+    now = time.time()
+    for age, key in ((20, "a"), (10, "b")):
+        for path in store._paths(key):
+            os.utime(path, (now - age, now - age))
+    # Served from memory, but still the most recent use on disk
+    assert store.get("a") is not None
+    store.put("c", result)
+    assert sorted(os.listdir(store.directory)) == [
+        "a.x.npy", "a.y.npy", "c.x.npy", "c.y.npy",
+    ]
+    assert store.get("b") is None
+    assert store.get("a") is not None
@@ -0,0 +1,53 @@
+import numpy as np
+from src.models.ensemble import GSSEMEnsemble
+from src.models.parameters import Parameters
+from src.models.trajectory import Trajectory
+from src.utils.calibration import calibrate, trajectory_loss
+
+TIME = 30
+
+
+def _reference(overrides):
+    result = GSSEMEnsemble(TIME, overrides=overrides).run_simulation()
+    return Trajectory(result.flows[0], result.states[0])
+
+
+def test_recovers_a_perturbed_coefficient():
+    default = Parameters(TIME).gRPP1p
+    reference = _reference({"gRPP1p": 1.05 * default})
+    fit = calibrate({"gRPP1p": (0.9 * default, 1.2 * default)}, reference,
+                    population=8, generations=40, seed=1)
+    assert fit.converged
+    np.testing.assert_allclose(fit.parameters["gRPP1p"], 1.05 * default, rtol=1e-3)
+    assert fit.loss < 1e-8
+    assert np.all(np.diff(fit.history) <= 0)
+
+
+def test_search_stays_within_the_bounds():
+    # The target lies above the range, so the best point is its upper end
+    default = Parameters(TIME).gRPP1p
+    reference = _reference({"gRPP1p": 1.5 * default})
+    fit = calibrate({"gRPP1p": (0.9 * default, 1.2 * default)}, reference,
+                    population=8, generations=40, seed=1)
+    assert 0.9 * default <= fit.parameters["gRPP1p"] <= 1.2 * default
+    np.testing.assert_allclose(fit.parameters["gRPP1p"], 1.2 * default, rtol=1e-3)
+    assert fit.loss > 0
+
+
+def test_loss_is_zero_on_the_reference_and_skips_gaps():
+    reference = _reference({})
+    assert trajectory_loss(reference, reference) == 0
+    result = Trajectory(reference.flows, reference.states.copy())
+    result.states[0, 5:] *= 2
+    gappy = Trajectory(reference.flows, reference.states.copy())
+    gappy.states[0, 5:] = np.nan
+    assert trajectory_loss(result, reference) > 0
+    assert trajectory_loss(result, gappy) == 0
+
+
+def test_default_reference_loads_outside_the_repository(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    default = Parameters(5).gRPP1p
+    fit = calibrate({"gRPP1p": (0.9 * default, 1.1 * default)}, time=5,
+                    population=4, generations=0)
+    assert fit.generations == 0 and fit.evaluations == 4
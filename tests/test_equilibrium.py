@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from src.models.equilibrium import FROZEN, fixed_point, household_counts
+from src.models.parameters import Parameters
+
+# The variables of yGHGstb the populated equilibrium pins down: P1, H1, the
+# households and the productions (P2, P3 and RP move along its neutral
+# total-mass direction)
+PINNED = slice(0, 7)
+
+
+def test_populated_equilibrium_matches_stable_values():
+    eq = fixed_point(overrides={"gammaEEIRP": 0}, frozen=FROZEN + household_counts())
+    assert eq.converged and not eq.collapsed
+    assert eq.stable
+    np.testing.assert_allclose(
+        eq.ghg_values()[PINNED], Parameters().yGHGstb[PINNED], rtol=0.1, atol=1e-4
+    )
+    assert eq["RP"] == pytest.approx(Parameters().yGHGstb[-1], rel=0.05)
+
+
+def test_collapse_is_excluded():
+    eq = fixed_point()
+    assert not eq.collapsed
+    assert eq["numHH"] > 1
+    collapse = fixed_point(exclude_collapse=False)
+    assert collapse.converged and collapse.collapsed
+
+
+@pytest.mark.parametrize("method", ["newton", "anderson"])
+def test_hopeless_solves_stop_early(method):
+    eq = fixed_point(method=method, max_iter=10000)
+    assert not eq.converged
+    assert eq.iterations < 1000
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+from src.models.ensemble import GSSEMEnsemble
+from src.models.forcing import FORCING_NAMES, Forcing
+from src.models.models import GSSEMModel
+
+ROWS = 23
+
+
+def _series():
+    steps = np.arange(ROWS, dtype=float)
+    return {"emissions": 0.5 + steps / 10, "temp": -steps / 100}
+
+
+def _sources(tmp_path):
+    series = _series()
+    csv = tmp_path / "forcing.csv"
+    csv.write_text(
+        "emissions,temp\n"
+        + "".join(f"{float(e)!r},{float(t)!r}\n" for e, t in zip(series["emissions"], series["temp"]))
+    )
+    table = np.zeros(ROWS, dtype=[("emissions", float), ("temp", float)])
+    table["emissions"], table["temp"] = series["emissions"], series["temp"]
+    structured = tmp_path / "structured.npy"
+    np.save(structured, table)
+    plain = tmp_path / "plain.npy"
+    np.save(plain, np.column_stack([series["emissions"], series["temp"]]))
+    return {
+        "csv": lambda size: Forcing(str(csv), chunk_size=size),
+        "structured": lambda size: Forcing(str(structured), chunk_size=size),
+        "plain": lambda size: Forcing(str(plain), ("emissions", "temp"), chunk_size=size),
+        "dict": lambda size: Forcing(series, chunk_size=size),
+    }
+
+
+@pytest.mark.parametrize("source", ["csv", "structured", "plain", "dict"])
+@pytest.mark.parametrize("chunk_size", [1, 5, ROWS, 64])
+def test_reads_across_chunk_boundaries(tmp_path, source, chunk_size):
+    forcing = _sources(tmp_path)[source](chunk_size)
+    series = _series()
+    # Forward through every boundary, then back to an earlier chunk
+    for i in list(range(ROWS)) + [0, 11, 4, ROWS - 1, 5]:
+        step = forcing.at(i)
+        assert step.emissions == series["emissions"][i]
+        assert step.temp == series["temp"][i]
+        assert step.mHH == step.etaa == step.ERP == 0
+    forcing.close()
+
+
+@pytest.mark.parametrize("source", ["csv", "structured", "plain", "dict"])
+def test_reading_past_the_end_raises(tmp_path, source):
+    forcing = _sources(tmp_path)[source](5)
+    assert forcing.at(ROWS - 1).emissions == _series()["emissions"][-1]
+    with pytest.raises(IndexError):
+        forcing.at(ROWS)
+    with pytest.raises(IndexError):
+        GSSEMModel(ROWS + 2, forcing=forcing).run_simulation(out_dir=None)
+    # A run of ROWS + 1 steps reads rows 0 .. ROWS - 1
+    GSSEMModel(ROWS + 1, forcing=forcing).run_simulation(out_dir=None)
+
+
+def test_unknown_series_and_unnamed_columns_raise(tmp_path):
+    with pytest.raises(AttributeError):
+        Forcing({"rain": np.zeros(3)})
+    with pytest.raises(ValueError):
+        Forcing(np.zeros((3, 2)), ("emissions",))
+    assert set(Forcing({"ERP": np.zeros(3)}).names) <= set(FORCING_NAMES)
+
+
+def test_one_forcing_is_shared_by_every_member(tmp_path):
+    overrides = {"phi": [8.0, 10.0, 12.0]}
+    forcing = _sources(tmp_path)["csv"](4)
+    ensemble = GSSEMEnsemble(ROWS + 1, overrides=overrides, forcing=forcing)
+    result = ensemble.run_simulation()
+    for k, phi in enumerate(overrides["phi"]):
+        single = GSSEMModel(ROWS + 1, {"phi": phi}, forcing=forcing)
+        expected = single.run_simulation(out_dir=None)
+        np.testing.assert_allclose(result.flows[k], expected.flows, rtol=1e-9, atol=1e-12)
+        np.testing.assert_allclose(result.states[k], expected.states, rtol=1e-9,
+                                   atol=1e-12)
+    unforced = GSSEMEnsemble(ROWS + 1, overrides=overrides).run_simulation()
+    assert not np.allclose(unforced["CO2eq"], result["CO2eq"])
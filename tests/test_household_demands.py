@@ -0,0 +1,163 @@
+import numpy as np
+from src.models.models import GSSEMModel, household_demands
+from src.models.parameters import Parameters
+
+
+def expanded_demands(p, pP1, pH1, pIS, pEE):
+    """The household demand equations as written in the original model."""
+    P1HHdemand = (
+        (
+            1
+            / (
+                -1
+                + p.zP1HH
+                + p.zH1HH
+                + p.zISHH
+            )
+        )
+        * (
+            -p.dP1HH
+            - p.mP1HH * pH1
+            - p.nP1HH * pIS
+            + p.kP1HH * pP1
+            - p.dH1HH * p.zP1HH
+            - p.dISHH * p.zP1HH
+            + p.mH1HH * pH1 * p.zP1HH
+            - p.mISHH * pH1 * p.zP1HH
+            - p.nH1HH * pIS * p.zP1HH
+            + p.nISHH * pIS * p.zP1HH
+            - p.kH1HH * pP1 * p.zP1HH
+            + p.dP1HH * p.zH1HH
+            + p.mP1HH * pH1 * p.zH1HH
+            + p.nP1HH * pIS * p.zH1HH
+            - p.kP1HH * pP1 * p.zH1HH
+            + p.dP1HH * p.zISHH
+            + p.mP1HH * pH1 * p.zISHH
+            + p.nP1HH * pIS * p.zISHH
+            - p.kP1HH * pP1 * p.zISHH
+        )
+    )
+    H1HHdemand = (
+        (
+            1
+            / (
+                -1
+                + p.zP1HH
+                + p.zH1HH
+                + p.zISHH
+            )
+        )
+        * (
+            -p.dH1HH
+            + p.mH1HH * pH1
+            - p.nH1HH * pIS
+            - p.kH1HH * pP1
+            + p.dH1HH * p.zP1HH
+            - p.mH1HH * pH1 * p.zP1HH
+            + p.nH1HH * pIS * p.zP1HH
+            + p.kH1HH * pP1 * p.zP1HH
+            - p.dISHH * p.zH1HH
+            - p.dP1HH * p.zH1HH
+            - p.mISHH * pH1 * p.zH1HH
+            - p.mP1HH * pH1 * p.zH1HH
+            + p.nISHH * pIS * p.zH1HH
+            - p.nP1HH * pIS * p.zH1HH
+            - p.kISHH * pP1 * p.zH1HH
+            + p.kP1HH * pP1 * p.zH1HH
+            + p.dH1HH * p.zISHH
+            - p.mH1HH * pH1 * p.zISHH
+            + p.nH1HH * pIS * p.zISHH
+            + p.kH1HH * pP1 * p.zISHH
+        )
+    )
+    ISHHdemand = (
+        -(
+            (
+                p.dISHH
+                + p.mISHH * pH1
+                - p.nISHH * pIS
+                + p.kISHH * pP1
+                - p.dISHH * p.zP1HH
+                - p.mISHH * pH1 * p.zP1HH
+                + p.nISHH * pIS * p.zP1HH
+                - p.kISHH * pP1 * p.zP1HH
+                - p.dISHH * p.zH1HH
+                - p.mISHH * pH1 * p.zH1HH
+                + p.nISHH * pIS * p.zH1HH
+                - p.kISHH * pP1 * p.zH1HH
+                + p.dH1HH * p.zISHH
+                + p.dP1HH * p.zISHH
+                - p.mH1HH * pH1 * p.zISHH
+                + p.mP1HH * pH1 * p.zISHH
+                + p.nH1HH * pIS * p.zISHH
+                + p.nP1HH * pIS * p.zISHH
+                + p.kH1HH * pP1 * p.zISHH
+                - p.kP1HH * pP1 * p.zISHH
+            )
+            / (
+                -1
+                + p.zP1HH
+                + p.zH1HH
+                + p.zISHH
+            )
+        )
+    )
+    EEHHdemand = (
+        -(
+            (
+                p.dEEHH
+                + p.mEEHH * pH1
+                - p.nEEHH * pEE
+                + p.kEEHH * pP1
+                - p.dEEHH * p.zP1HH
+                - p.mEEHH * pH1 * p.zP1HH
+                + p.nEEHH * pEE * p.zP1HH
+                - p.kEEHH * pP1 * p.zP1HH
+                - p.dEEHH * p.zH1HH
+                - p.mEEHH * pH1 * p.zH1HH
+                + p.nEEHH * pEE * p.zH1HH
+                - p.kEEHH * pP1 * p.zH1HH
+                + p.dH1HH * p.zEEHH
+                + p.dP1HH * p.zEEHH
+                - p.mH1HH * pH1 * p.zEEHH
+                + p.mP1HH * pH1 * p.zEEHH
+                + p.nH1HH * pEE * p.zEEHH
+                + p.nP1HH * pEE * p.zEEHH
+                + p.kH1HH * pP1 * p.zEEHH
+                - p.kP1HH * pP1 * p.zEEHH
+            )
+            / (
+                -1
+                + p.zP1HH
+                + p.zH1HH
+                + p.zEEHH
+            )
+        )
+    )
+
+    return P1HHdemand, H1HHdemand, ISHHdemand, EEHHdemand
+
+
+def test_folded_demands_match_expanded_equations_over_a_run():
+    model = GSSEMModel(time=100)
+    result = model.run_simulation(out_dir=None)
+    prices = [result[name] for name in ("pP1", "pH1", "pIS", "pEE")]
+    for t in range(result.time):
+        step_prices = [price[t] for price in prices]
+        np.testing.assert_allclose(
+            household_demands(model.params, *step_prices),
+            expanded_demands(model.params, *step_prices),
+            rtol=1e-12,
+            atol=0,
+        )
+
+
+def test_folded_demands_match_expanded_equations_of_an_ensemble():
+    params = Parameters(overrides={"zP1HH": np.linspace(1e-8, 1e-7, 50)})
+    prices = [np.linspace(0.1, 2, 50) * scale for scale in (1, 2, 3, 4)]
+    np.testing.assert_allclose(
+        household_demands(params, *prices),
+        expanded_demands(params, *prices),
+        rtol=1e-12,
+        atol=0,
+    )
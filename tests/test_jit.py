@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from src.models import jit
+from src.models.checkpoint import Checkpoint
+from src.models.models import GSSEMModel
+from src.models.trajectory import Trajectory
+
+# Three household classes (see the README)
+SHARES = [0.5, 0.3, 0.2]
+THREE_CLASSES = {
+    "numHH_shares": SHARES, "wage_shares": [0.2, 0.3, 0.5],
+    "P1H1demand_shares": SHARES, "ISEEdemand_shares": SHARES, "HH_shares": SHARES,
+    "health_factors": [1, 0.75, 0.5],
+    "mHH_log": [-3.25, 0, 0], "mHH_slope": [0, -0.0103, -0.0103],
+    "mHH_base": [20.536, 9.4329, 9.4329],
+    "etaa_scale": [41.975, 20.831, 20.831], "etaa_rate": [-0.013, -0.012, -0.012],
+}
+
+
+def _noise(time, classes):
+    rng = np.random.default_rng(0)
+    return {"Ito": 1, "epsilonm": rng.standard_normal((time, classes)),
+            "epsilonb": rng.standard_normal((time, classes))}
+
+
+def _kernel(model, start=None):
+    """Run `model` in the kernel: compiled with Numba, plain Python otherwise."""
+    params = model.params
+    result = Trajectory.allocate(params.time, classes=params.classes)
+    if start is None:
+        result.states[:, 0] = params.initial_state()
+    else:
+        result.states[:, start.index] = start.state
+    jit.run_steps(params, result.flows, result.states, *model._start(start))
+    return result
+
+
+@pytest.mark.parametrize("time, overrides", [
+    (200, {}),
+    (100, THREE_CLASSES),
+    (100, _noise(100, 2)),
+    (100, {**THREE_CLASSES, **_noise(100, 3)}),
+])
+def test_kernel_matches_python_engine(time, overrides):
+    expected = GSSEMModel(time, overrides).run_simulation(out_dir=None)
+    result = _kernel(GSSEMModel(time, overrides))
+    np.testing.assert_allclose(result.flows, expected.flows, rtol=1e-9, atol=1e-10)
+    np.testing.assert_allclose(result.states, expected.states, rtol=1e-9, atol=1e-10)
+
+
+def test_kernel_resumes_a_checkpoint():
+    overrides = {**THREE_CLASSES, **_noise(100, 3)}
+    model = GSSEMModel(100, overrides)
+    for record in model.steps():
+        if record.index == 40:
+            start = Checkpoint.from_step(record, model.params)
+            break
+    expected = GSSEMModel(100, overrides).run_simulation(out_dir=None, start=start)
+    result = _kernel(GSSEMModel(100, overrides), start)
+    np.testing.assert_allclose(
+        result.flows[40:], expected.flows[40:], rtol=1e-9, atol=1e-10
+    )
+    np.testing.assert_allclose(
+        result.states[:, 40:], expected.states[:, 40:], rtol=1e-9, atol=1e-10
+    )
+
+
+@pytest.mark.skipif(not jit.NUMBA, reason="Numba is not installed")
+def test_jit_backend_matches_python_backend():
+    model = GSSEMModel(100, THREE_CLASSES)
+    expected = model.run_simulation(out_dir=None)
+    result = GSSEMModel(100, THREE_CLASSES).run_simulation(out_dir=None, backend="jit")
+    np.testing.assert_allclose(result.flows, expected.flows, rtol=1e-9, atol=1e-10)
+    np.testing.assert_allclose(result.states, expected.states, rtol=1e-9, atol=1e-10)
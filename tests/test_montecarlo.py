@@ -0,0 +1,54 @@
+import numpy as np
+from src.models.checkpoint import Checkpoint
+from src.models.ensemble import GSSEMEnsemble
+from src.models.montecarlo import MemberNoise, member_noise, monte_carlo
+from src.models.parameters import NOISE_NAMES
+
+
+def test_member_noise_does_not_depend_on_split_or_chunks():
+    full = member_noise(3, range(6), 300)
+    split = np.concatenate(
+        [member_noise(3, range(0, 2), 300), member_noise(3, range(2, 6), 300)], axis=-1
+    )
+    np.testing.assert_array_equal(full, split)
+    noise = MemberNoise(3, [4, 1], 300, chunk_size=7)
+    series = noise.series("epsilonb")
+    steps = [299, 0, 150, 151]
+    for i in steps:
+        np.testing.assert_array_equal(series[i], full[1, i][:, [4, 1]])
+    np.testing.assert_array_equal(series[..., [1]][42], full[1, 42][:, [1]])
+
+
+def test_streamed_noise_matches_drawn_noise():
+    noise = member_noise(5, range(4), 50)
+    replayed = GSSEMEnsemble(
+        50, overrides={"Ito": 1, **dict(zip(NOISE_NAMES, noise))}
+    ).run_statistics(("numHH", "temp"))
+    streamed = monte_carlo(time=50, n=4, seed=5, names=("numHH", "temp"))
+    for name in ("numHH", "temp"):
+        np.testing.assert_array_equal(streamed.mean(name), replayed.mean(name))
+
+
+def test_split_members_merge_to_the_full_run():
+    full = monte_carlo(time=50, n=6, seed=2, names=("numHH",))
+    split = monte_carlo(time=50, seed=2, names=("numHH",), members=range(0, 4))
+    split.merge(monte_carlo(time=50, seed=2, names=("numHH",), members=range(4, 6)))
+    np.testing.assert_allclose(split.mean("numHH"), full.mean("numHH"), rtol=1e-12)
+    np.testing.assert_array_equal(split.count("numHH"), full.count("numHH"))
+
+
+def test_resumed_monte_carlo_matches_the_uninterrupted_run():
+    names = ("numHH", "temp", "W1")
+    noise = MemberNoise(7, range(5), 60)
+    ensemble = GSSEMEnsemble(
+        60, overrides={"Ito": 1, **{name: noise.series(name) for name in NOISE_NAMES}}
+    )
+    for record in ensemble.steps():
+        if record.index == 25:
+            start = Checkpoint.from_step(record, ensemble.params)
+            break
+    full = monte_carlo(time=60, n=5, seed=7, names=names)
+    resumed = monte_carlo(time=60, n=5, seed=7, names=names, start=start)
+    for name in names:
+        np.testing.assert_array_equal(resumed.mean(name)[26:], full.mean(name)[26:])
+        np.testing.assert_array_equal(resumed.var(name)[26:], full.var(name)[26:])
@@ -0,0 +1,22 @@
+import numpy as np
+from src.models.parameters import TREND_NAMES, Parameters
+from src.utils.cache import parameter_hash
+
+
+def test_trends_are_tabulated_on_first_use():
+    params = Parameters(1_000_000)
+    assert not set(TREND_NAMES) & set(params.__dict__)
+    key = parameter_hash(params, "GSSEMModel")
+    assert params.mHH_trend.shape == params.etaa_trend.shape == (1_000_000, 2)
+    assert parameter_hash(params, "GSSEMModel") == key
+
+
+def test_trends_follow_the_class_parameters():
+    params = Parameters(5, {"mHH_base": [10.0, 20.0], "etaa_rate": [0.0, 0.0]})
+    t = np.arange(5) + 55
+    np.testing.assert_allclose(
+        params.mHH_trend[:, 0], (-3.25 * np.log(t) + 10) / 1000
+    )
+    np.testing.assert_allclose(params.etaa_trend[:, 1], (20.831 + 3) / 1000)
+    batch = Parameters(5, {"mHH_base": np.array([[10.0, 11.0], [20.0, 21.0]])})
+    assert batch.mHH_trend.shape == (5, 2, 2)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from src.models.models import GSSEMModel
+from src.utils.profiling import PhaseProfile
+
+TIME = 150
+
+PHASES = [
+    "demographics", "pricing", "demand", "flows", "rebalancing",
+    "demographic update", "ghg", "recording",
+]
+
+# mP2 = 0.5 starves P2: it collapses at index 10 and stays empty, while P1
+# and H1 are rationed along the way
+OVERRIDES = {"mP2": 0.5}
+
+
+def test_profile_records_phases_and_branches():
+    model = GSSEMModel(TIME, OVERRIDES)
+    result = model.run_simulation(out_dir=None, profile=True)
+    report = model.profile.report()
+    assert report["steps"] == TIME
+    assert list(report["phases"]) == PHASES
+    assert all(row["calls"] == TIME for row in report["phases"].values())
+    assert report["seconds"] > 0
+    # Every step taken from an empty P2 is a collapse, in the balancing pass
+    # and again when the flows are refreshed
+    collapsed = int(np.count_nonzero(result.P2 == 0))
+    assert collapsed > 0
+    assert report["branches"]["III P2 collapse"]["count"] == collapsed
+    assert report["branches"]["III.A P2 collapse"]["count"] == collapsed
+    assert report["branches"]["III P1 rationed"]["count"] > 0
+    assert report["branches"]["III H1 rationed"]["count"] > 0
+
+
+def test_default_run_does_no_profiling(monkeypatch):
+    profiled = GSSEMModel(TIME, OVERRIDES).run_simulation(out_dir=None, profile=True)
+
+    def fail(*args, **kwargs):
+        pytest.fail("profiled a run without profile=True")
+
+    monkeypatch.setattr(PhaseProfile, "lap", fail)
+    monkeypatch.setattr(PhaseProfile, "branch", fail)
+    model = GSSEMModel(TIME, OVERRIDES)
+    result = model.run_simulation(out_dir=None)
+    assert model.profile is None
+    np.testing.assert_array_equal(result.flows, profiled.flows)
+    np.testing.assert_array_equal(result.states, profiled.states)
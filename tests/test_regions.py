@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from src.models.ensemble import GSSEMEnsemble
+from src.models.regions import GSSEMRegions
+
+
+def test_regions_are_numbered_unless_named():
+    regions = GSSEMRegions(10, overrides={"phi": [8, 10, 12]})
+    assert regions.n == 3
+    np.testing.assert_array_equal(regions.params.pais, [0, 1, 2])
+    np.testing.assert_array_equal(regions.params.phi, [8, 10, 12])
+    named = GSSEMRegions(10, overrides={"pais": [4, 7]})
+    np.testing.assert_array_equal(named.params.pais, [4, 7])
+    assert GSSEMRegions(10, n=3).n == 3
+
+
+def test_single_region_runs_like_an_ensemble_of_one():
+    region = GSSEMRegions(20).run_simulation()
+    member = GSSEMEnsemble(20).run_simulation()
+    np.testing.assert_array_equal(region.flows, member.flows)
+    np.testing.assert_array_equal(region.states, member.states)
+
+
+def test_mismatched_region_arrays_raise():
+    with pytest.raises(ValueError):
+        GSSEMRegions(10, n=3, overrides={"phi": [8, 10]})
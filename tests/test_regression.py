@@ -0,0 +1,20 @@
+import pytest
+from src.models.jit import NUMBA
+from src.utils.regression import ENGINES, REFERENCES, compare
+
+
+@pytest.mark.parametrize("engine", sorted(ENGINES))
+def test_engine_reproduces_reference(engine):
+    if engine == "jit" and not NUMBA:
+        pytest.skip("Numba is not installed")
+    loader, atol, rtol = REFERENCES["npy"]
+    report = compare(ENGINES[engine](100), loader(), atol, rtol)
+    assert report
+    assert [row["name"] for row in report if not row["passed"]] == []
+
+
+@pytest.mark.parametrize("reference", sorted(REFERENCES))
+def test_references_load_outside_the_repository(reference, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    result = REFERENCES[reference][0]()
+    assert result.flows.shape[-1] == 77
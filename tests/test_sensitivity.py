@@ -0,0 +1,32 @@
+import numpy as np
+from src.models.jit import KernelParameters, kernel_parameters
+from src.models.parameters import NOISE_NAMES, Parameters
+from src.utils.sensitivity import COEFFICIENTS, saltelli_design, sobol_indices
+
+
+def test_sobol_indices_of_additive_function_with_offset():
+    # f = 1000 + x1 + 0.1 x2 on the unit square: S1 = ST = [1, 0.01] / 1.01
+    bounds = {"x1": (0.0, 1.0), "x2": (0.0, 1.0)}
+    samples = saltelli_design(bounds, 10_000, seed=1)
+    values = 1000 + samples["x1"] + 0.1 * samples["x2"]
+    indices = sobol_indices(values, list(bounds), bootstrap=100)
+    expected = np.array([1.0, 0.01]) / 1.01
+    np.testing.assert_allclose(indices["S1"], expected, atol=0.03)
+    np.testing.assert_allclose(indices["ST"], expected, atol=0.03)
+    assert np.all(indices["S1_interval"][:, 0] <= indices["S1_interval"][:, 1])
+
+
+def test_every_coefficient_reaches_the_engines():
+    # Read by the step itself, or through a derived value the step reads
+    read = set(KernelParameters._fields)
+    defaults = kernel_parameters(Parameters(10))
+    for name in COEFFICIENTS:
+        if name in read:
+            continue
+        value = getattr(Parameters(10), name)
+        changed = kernel_parameters(Parameters(10, {name: value * 1.1}))
+        assert any(
+            not np.array_equal(a, b, equal_nan=True)
+            for field, a, b in zip(KernelParameters._fields, changed, defaults)
+            if field not in NOISE_NAMES
+        ), name
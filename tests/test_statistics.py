@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from src.utils.statistics import EnsembleStatistics, QuantileSketch, RunningStats
+
+TIME = 4
+
+
+def _values(n, seed=0):
+    # Members per step with both signs, zeros and a diverged member
+    rng = np.random.default_rng(seed)
+    values = rng.lognormal(0, 2, (TIME, n)) * rng.choice([-1, 1], (TIME, n))
+    values[:, :3] = 0
+    values[:, 3] = np.nan
+    return values
+
+
+def _fill(cls, values, *args):
+    stats = cls(TIME, *args)
+    for t, row in enumerate(values):
+        stats.update(t, row)
+    return stats
+
+
+def test_running_stats_match_numpy():
+    values = _values(1000)
+    stats = RunningStats(TIME)
+    for batch in np.array_split(values, 7, axis=1):
+        for t, row in enumerate(batch):
+            stats.update(t, row)
+    np.testing.assert_array_equal(stats.count, 999)
+    np.testing.assert_allclose(stats.mean, np.nanmean(values, axis=1), rtol=1e-10)
+    np.testing.assert_allclose(stats.var, np.nanvar(values, axis=1), rtol=1e-10)
+    assert np.isnan(RunningStats(TIME).mean).all()
+
+
+def test_running_stats_merge_in_any_grouping():
+    parts = [_fill(RunningStats, part) for part in np.array_split(_values(600), 3, axis=1)]
+    left = RunningStats(TIME).merge(parts[0]).merge(parts[1]).merge(parts[2])
+    right = parts[0].merge(parts[1].merge(parts[2]))
+    whole = _fill(RunningStats, _values(600))
+    for merged in (left, right):
+        np.testing.assert_array_equal(merged.count, whole.count)
+        np.testing.assert_allclose(merged.mean, whole.mean, rtol=1e-10)
+        np.testing.assert_allclose(merged.var, whole.var, rtol=1e-10)
+
+
+def test_merged_sketches_equal_one_sketch_over_all_members():
+    values = _values(900)
+    whole = _fill(QuantileSketch, values)
+    a, b, c = (_fill(QuantileSketch, part) for part in np.array_split(values, 3, axis=1))
+    left = a.merge(b).merge(c)
+    a, b, c = (_fill(QuantileSketch, part) for part in np.array_split(values, 3, axis=1))
+    right = c.merge(b.merge(a))
+    for q in (0, 0.05, 0.5, 0.95, 1):
+        np.testing.assert_array_equal(left.quantile(q), whole.quantile(q))
+        np.testing.assert_array_equal(right.quantile(q), whole.quantile(q))
+
+
+@pytest.mark.parametrize("accuracy", [0.01, 0.001])
+def test_quantiles_within_the_relative_accuracy(accuracy):
+    values = _values(5000, seed=1)
+    sketch = _fill(QuantileSketch, values, accuracy)
+    for q in (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99):
+        # The sketch returns the value of rank q (n - 1), rounded down
+        exact = np.nanquantile(values, q, axis=1, method="lower")
+        error = np.abs(sketch.quantile(q) - exact)
+        assert np.all(error <= accuracy * np.abs(exact) + 1e-300)
+
+
+def test_sketches_of_other_accuracies_do_not_merge():
+    with pytest.raises(ValueError):
+        QuantileSketch(TIME, 0.01).merge(QuantileSketch(TIME, 0.001))
+    with pytest.raises(ValueError):
+        EnsembleStatistics(TIME, ("temp",)).merge(EnsembleStatistics(TIME, ("RP",)))
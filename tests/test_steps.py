@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from src.models.models import GSSEMModel
+from src.models.trajectory import STATE_INDEX, Trajectory
+
+TIME = 120
+
+
+def test_steps_stream_the_run_without_a_trajectory(monkeypatch):
+    expected = GSSEMModel(TIME).run_simulation(out_dir=None)
+
+    def fail(*args, **kwargs):
+        pytest.fail("steps() allocated a trajectory")
+
+    monkeypatch.setattr(Trajectory, "allocate", fail)
+    monkeypatch.setattr(Trajectory, "create", fail)
+    model = GSSEMModel(TIME)
+    erp = STATE_INDEX["ERP"]
+    others = np.arange(len(expected.states)) != erp
+    count = 0
+    for record in model.steps():
+        # ERP at `index` is only final once the next step zeroes it or not
+        np.testing.assert_array_equal(record.flows, expected.flows[record.step])
+        np.testing.assert_array_equal(
+            np.array(record.state)[others], expected.states[others, record.index]
+        )
+        assert record.ERP == expected.states[erp, record.index - 1]
+        assert record["temp"] == record.state[STATE_INDEX["temp"]]
+        count += 1
+    assert count == TIME
+    assert not hasattr(model, "trajectory")
+
+
+def test_stopping_the_iteration_stops_the_run():
+    steps = GSSEMModel(TIME).steps()
+    records = [next(steps) for _ in range(3)]
+    assert [record.step for record in records] == [0, 1, 2]
+    assert [record.index for record in records] == [1, 2, 3]
+    steps.close()
+    with pytest.raises(StopIteration):
+        next(steps)
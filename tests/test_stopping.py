@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from src.models.ensemble import GSSEMEnsemble
+from src.models.models import GSSEMModel
+from src.models.stopping import COLLAPSE, StopCriteria
+from src.models.trajectory import STATE_NAMES
+
+
+def _run(stop, time=300):
+    model = GSSEMModel(time)
+    result = model.run_simulation(out_dir=None, stop=stop)
+    return model, result
+
+
+def test_collapse_stops_at_the_first_extinct_compartment():
+    model, result = _run(StopCriteria(extinction=COLLAPSE))
+    assert model.stop_reason == "extinction of P2"
+    assert result["P2"][model.stop_time] <= 0 < result["P2"][model.stop_time - 1]
+    assert np.isnan(result.states[:, model.stop_time + 1:]).all()
+    assert np.isnan(result.flows[model.stop_time:]).all()
+
+
+def test_co2_threshold_stops_once_reached():
+    model, result = _run(StopCriteria(co2_threshold=1000))
+    assert model.stop_reason == "CO2eq threshold"
+    assert result["CO2eq"][model.stop_time] >= 1000 > result["CO2eq"][model.stop_time - 1]
+
+
+def test_steady_state_compares_the_compartments():
+    # The compartments settle after the collapse while the household count
+    # keeps growing, so requiring every state row to be calm never stops
+    model, result = _run(StopCriteria(rtol=1e-3), time=3000)
+    assert model.stop_reason == "steady state"
+    assert model.stop_time < 2999
+    model, _ = _run(StopCriteria(rtol=1e-3, steady=STATE_NAMES), time=3000)
+    assert model.stop_reason is None
+
+
+def test_unknown_rows_raise():
+    with pytest.raises(AttributeError):
+        StopCriteria(rtol=1e-3, steady=("nope",))
+
+
+def test_ensemble_retires_members_at_their_own_stop():
+    stop = StopCriteria(co2_threshold=1000)
+    ensemble = GSSEMEnsemble(300, overrides={"ppmCO2eq": [0.22024, 0.3]})
+    ensemble.run_simulation(stop=stop)
+    single, _ = _run(StopCriteria(co2_threshold=1000))
+    assert list(ensemble.stop_reason) == ["CO2eq threshold"] * 2
+    assert ensemble.stop_time[0] == single.stop_time
+    assert ensemble.stop_time[1] < ensemble.stop_time[0]
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from src.models.ensemble import GSSEMEnsemble
+from src.models.stopping import StopCriteria
+from src.utils.sweep import load_stops, load_sweep, parameter_grid, run_sweep
+
+
+def test_sweep_store_matches_the_ensemble(tmp_path):
+    samples = parameter_grid({"phi": [8, 10, 12]})
+    out_dir = str(tmp_path / "sweep")
+    run_sweep(samples, out_dir, time=10, chunk_size=2, workers=1)
+    _, x, y, done = load_sweep(out_dir)
+    expected = GSSEMEnsemble(10, overrides=samples).run_simulation()
+    assert done.all()
+    np.testing.assert_array_equal(x, expected.flows)
+    np.testing.assert_array_equal(y, expected.states)
+    stop_time, stop_reason = load_stops(out_dir)
+    np.testing.assert_array_equal(stop_time, 9)
+    assert (stop_reason == "").all()
+
+    # Resuming a finished sweep runs nothing and keeps the store
+    run_sweep(samples, out_dir, time=10, chunk_size=2, workers=1)
+    np.testing.assert_array_equal(load_sweep(out_dir)[1], expected.flows)
+
+
+def test_resuming_with_other_stop_criteria_raises(tmp_path):
+    samples = parameter_grid({"phi": [8, 10]})
+    out_dir = str(tmp_path / "sweep")
+    run_sweep(samples, out_dir, time=10, workers=1, stop=StopCriteria(co2_threshold=1000))
+    with pytest.raises(ValueError):
+        run_sweep(samples, out_dir, time=10, workers=1, stop=StopCriteria(co2_threshold=900))
+    with pytest.raises(ValueError):
+        run_sweep(samples, out_dir, time=10, workers=1)
+    run_sweep(samples, out_dir, time=10, workers=1, stop=StopCriteria(co2_threshold=1000))
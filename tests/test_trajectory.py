@@ -0,0 +1,94 @@
+import pickle
+import numpy as np
+import pytest
+from src.models.ensemble import GSSEMEnsemble
+from src.models.models import GSSEMModel
+from src.models.trajectory import STATE_INDEX, Trajectory
+
+TIME = 60
+
+
+def test_pickle_round_trip():
+    result = Trajectory.allocate(5, classes=3)
+    result.flows[:] = np.arange(result.flows.size).reshape(result.flows.shape)
+    result.states[:] = 1.5
+    copy = pickle.loads(pickle.dumps(result))
+    assert copy.classes == 3
+    np.testing.assert_array_equal(copy.flows, result.flows)
+    np.testing.assert_array_equal(copy.states, result.states)
+    np.testing.assert_array_equal(copy.temp, result.temp)
+
+
+def test_unknown_names_raise_attribute_error():
+    result = Trajectory.allocate(3)
+    assert not hasattr(result, "nope")
+    assert not hasattr(result, "_private")
+
+
+def test_single_run_files_keep_the_historical_y_shape(tmp_path):
+    model = GSSEMModel(TIME)
+    result = model.run_simulation(out_dir=str(tmp_path))
+    expected = GSSEMModel(TIME).run_simulation(out_dir=None)
+    assert np.load(tmp_path / "x_results.npy").shape == (TIME, 77)
+    assert np.load(tmp_path / "y_results.npy").shape == (1, 49, TIME)
+    assert result.states.shape == (49, TIME)
+    loaded = Trajectory.load(str(tmp_path / "x_results.npy"),
+                             str(tmp_path / "y_results.npy"))
+    np.testing.assert_array_equal(loaded.flows, expected.flows)
+    np.testing.assert_array_equal(loaded.states, expected.states)
+    np.testing.assert_array_equal(loaded.temp, expected.temp)
+
+
+def test_ensemble_files_keep_the_member_layout(tmp_path):
+    overrides = {"phi": [8.0, 10.0, 12.0]}
+    GSSEMEnsemble(TIME, overrides=overrides).run_simulation(out_dir=str(tmp_path))
+    expected = GSSEMEnsemble(TIME, overrides=overrides).run_simulation()
+    loaded = Trajectory.load(str(tmp_path / "x_results.npy"),
+                             str(tmp_path / "y_results.npy"))
+    assert loaded.flows.shape == (3, TIME, 77)
+    assert loaded.states.shape == (3, 49, TIME)
+    np.testing.assert_array_equal(loaded.flows, expected.flows)
+    np.testing.assert_array_equal(loaded.states, expected.states)
+
+
+def test_flushed_steps_can_be_read_during_a_run(tmp_path):
+    x_path, y_path = str(tmp_path / "x.npy"), str(tmp_path / "y.npy")
+    model = GSSEMModel(TIME)
+    result = Trajectory.create(x_path, y_path, TIME)
+    result.states[:, 0] = model.params.initial_state()
+    expected = GSSEMModel(TIME).run_simulation(out_dir=None)
+    for record in model.steps():
+        result.flows[record.step] = record.flows
+        result.states[:, record.index] = record.state
+        result.states[STATE_INDEX["ERP"], record.index - 1] = record.ERP
+        if record.step == 20:
+            break
+    result.flush()
+    # The run is still open: the first 21 steps are on disk, the rest is zero
+    partial = Trajectory.load(x_path, y_path)
+    np.testing.assert_array_equal(partial.flows[:21], expected.flows[:21])
+    np.testing.assert_array_equal(partial.states[:, :21], expected.states[:, :21])
+    assert not partial.flows[21:].any()
+
+
+@pytest.mark.parametrize("out_dir", [False, True])
+def test_float32_runs_store_float32(tmp_path, out_dir):
+    expected = GSSEMModel(TIME).run_simulation(out_dir=None)
+    result = GSSEMModel(TIME).run_simulation(
+        dtype=np.float32, out_dir=str(tmp_path) if out_dir else None
+    )
+    assert result.flows.dtype == result.states.dtype == np.float32
+    if out_dir:
+        assert np.load(tmp_path / "y_results.npy").dtype == np.float32
+    # Only storage is single precision, so the error is one rounding
+    np.testing.assert_allclose(result.flows, expected.flows, rtol=1e-6, atol=1e-30)
+    np.testing.assert_allclose(result.states, expected.states, rtol=1e-6, atol=1e-30)
+
+
+def test_float32_ensembles_store_float32():
+    overrides = {"phi": [8.0, 10.0, 12.0]}
+    expected = GSSEMEnsemble(TIME, overrides=overrides).run_simulation()
+    result = GSSEMEnsemble(TIME, overrides=overrides).run_simulation(dtype=np.float32)
+    assert result.flows.dtype == result.states.dtype == np.float32
+    np.testing.assert_allclose(result.flows, expected.flows, rtol=1e-6, atol=1e-30)
+    np.testing.assert_allclose(result.states, expected.states, rtol=1e-6, atol=1e-30)